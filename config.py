@@ -25,16 +25,73 @@ class ChatConfig:
     "recollect": "别吵，我在思考...",
     "modify_file": "正在修改文件，别乱动...",
     "typing_text": "正在敲键盘...",
+    "read_tool_result": "翻翻刚才的输出...",
     }
     # 最大工具调用轮次，防止无限循环 (来自 chat.py line 144)
     MAX_TOOL_CALLS = 8
     
-    # 对话历史记录最大长度
-    MAX_CONVERSATION_HISTORY = 10
+    # 只读工具：流式输出中参数一旦完整就提前在后台执行
+    READ_ONLY_TOOLS = ["read_file", "read_notes", "recollect", "read_tool_result"]
+    # 提前执行只读工具的线程数
+    SPECULATIVE_TOOL_WORKERS = 2
+    
+    # 单次请求的提示词token预算（估算值），对话历史按整轮从最旧处裁剪以满足预算
+    # 预算中会先扣除系统提示词（含检索到的记忆/笔记）、工具定义和回复的MAX_TOKENS
+    MAX_PROMPT_TOKENS = 8000
+
+    # 提示词缓存友好布局：系统消息只放固定的人设提示词，
+    # 当前时间和检索到的记忆/笔记附加在本轮用户消息前（不写入对话历史），
+    # 使请求前缀在多轮之间保持字节级稳定，命中服务商的前缀缓存
+    PROMPT_CACHE_LAYOUT = False
+
+    # 附加到用户消息前的上下文包装格式
+    VOLATILE_CONTEXT_TEMPLATE = "（以下是系统附加的上下文，不是用户的输入）\n{context}\n（附加上下文结束）\n\n{message}"
+
+    # 单条工具结果的token预算，超出时去重+首尾截断，完整输出另存并可用read_tool_result分段查看
+    TOOL_RESULT_MAX_TOKENS = 1500
+    # read_tool_result每次返回的token上限（需小于TOOL_RESULT_MAX_TOKENS）
+    TOOL_RESULT_PAGE_TOKENS = 1200
+    # 完整工具输出的存储目录和保留数量
+    TOOL_RESULT_STORE_DIR = "data/tool_results"
+    TOOL_RESULT_STORE_MAX_FILES = 50
+    
+    # 语义回复缓存：相似问题在人设、检索上下文和最近对话相同时直接回放之前的回答（只缓存没有调用工具的回复）
+    RESPONSE_CACHE_ENABLED = False
+    # 缓存有效期（秒）
+    RESPONSE_CACHE_TTL = 3600
+    # 命中所需的最低余弦相似度，同时也是替换旧条目的阈值
+    RESPONSE_CACHE_SIMILARITY = 0.95
+    # 最多缓存的回答数量
+    RESPONSE_CACHE_MAX_ENTRIES = 200
+    # 缓存键包含的最近消息条数（当前输入之前），上文不同的追问不会命中别的对话的回答
+    RESPONSE_CACHE_HISTORY_MESSAGES = 4
+    # 回放缓存回答时每个流式块的字符数
+    RESPONSE_CACHE_REPLAY_CHUNK = 8
+    
+    # 工具清单缓存（保存每个工具的tool_definition和文件mtime/哈希，启动时无需导入工具模块）
+    TOOL_MANIFEST_PATH = "data/tool_manifest.json"
     
     # API调用超时时间（秒）
     API_TIMEOUT = 40
     
+    # 对冲请求：超过最近TTFT（首字节时间）的该分位数仍没有首字节时，再发一个相同请求，先出数据的胜出
+    # 被对冲的请求输入token会计费两次（约5%的请求），还会多占一个并发名额，默认关闭
+    HEDGE_ENABLED = False
+    HEDGE_PERCENTILE = 0.95
+    # 样本不足HEDGE_MIN_SAMPLES时使用的等待时间（秒）
+    HEDGE_INITIAL_DELAY = 8.0
+    HEDGE_MIN_SAMPLES = 5
+    # 等待时间的上下限（秒）
+    HEDGE_MIN_DELAY = 1.0
+    HEDGE_MAX_DELAY = 15.0
+    # TTFT直方图保留的最近样本数
+    TTFT_WINDOW = 200
+    
+    # 429/5xx/连接错误的重试次数和指数退避参数（秒）
+    RETRY_MAX_ATTEMPTS = 3
+    RETRY_BASE_DELAY = 1.0
+    RETRY_MAX_DELAY = 20.0
+    
     # 流式响应相关配置
     MAX_TOKENS = 512
     TEMPERATURE = 0.7
@@ -46,7 +103,87 @@ class SummaryConfig:
 你的输出是一个json，包含以下字段：
 "summary" <string> 总结本次对话，不超过50字。
 "add" <string array> 仅精炼列举本次对话中助手需**长期记忆**的新增重要信息，每条必须独立、简洁、完整、保证长期有效。如果没有就保留空数组。
-"remove" <string array> 列出在本次对话中助手需要遗忘的错误或过时的记忆，只能是**已经记录的笔记**中的，可以为空。"""
+"remove" <string array> 列出在本次对话中助手需要遗忘的错误或过时的记忆，只能是**已经记录的笔记**中的，可以为空。
+输入可能包含连续的多轮对话，请把它们作为一次对话整体总结。"""
+    # 总结队列最多积压的对话轮数，超出时丢弃最早的
+    QUEUE_MAX_SIZE = 20
+    # 一次总结请求最多合并的对话轮数
+    BATCH_MAX_TURNS = 5
+    
+    # 总结前的本地筛选：寒暄、过短或与最近记忆高度相似的对话不单独总结，
+    # 而是合并到下一轮需要总结的对话中（调用过工具的对话总是总结）
+    GATING_ENABLED = True
+    # 用户输入去掉标点和空白后不超过这个长度时视为无需总结
+    MIN_USER_CHARS = 2
+    # 视为寒暄的用户输入（忽略大小写、标点和空白）
+    TRIVIAL_MESSAGES = ["你好", "您好", "hi", "hello", "谢谢", "多谢", "谢啦", "thanks", "thankyou",
+                        "好的", "好滴", "嗯嗯", "哦哦", "ok", "okay", "收到", "拜拜", "再见", "bye", "晚安", "早安"]
+    # 与最近记忆的相似度超过该值视为没有新信息
+    NOVELTY_THRESHOLD = 0.88
+    # 参与相似度比较的最近记忆条数
+    NOVELTY_RECENT_COUNT = 50
+    # 最多合并到下一次总结中的跳过轮数（超出时丢弃最早的）
+    MAX_MERGED_SKIPPED = 3
+
+
+# API端点池配置
+class EndpointConfig:
+    """多端点路由相关配置（端点列表见.env中的API_ENDPOINTS）"""
+    # 每个密钥的默认最大并发请求数
+    MAX_CONCURRENCY_PER_KEY = 4
+    # 延迟和错误率的指数加权系数
+    EWMA_ALPHA = 0.3
+    # 还没有延迟样本时假定的延迟（秒）
+    INITIAL_LATENCY = 1.0
+    # 错误率对端点得分的惩罚倍数
+    ERROR_PENALTY = 4.0
+    # 连续失败多少次后熔断，以及熔断持续时间（秒）
+    CIRCUIT_FAILURE_THRESHOLD = 3
+    CIRCUIT_RESET_SECONDS = 30
+    # 所有端点都满载时等待空闲名额的最长时间（秒）
+    ACQUIRE_TIMEOUT = 40
+
+
+# 本地记忆服务配置
+class MemoryServerConfig:
+    """记忆服务相关配置（python -m services.memory_server 启动服务）"""
+    # 是否通过记忆服务访问memory/notes数据库（多个桌宠实例共享同一份索引）
+    ENABLED = False
+    # 服务未运行时是否自动在后台启动
+    AUTO_SPAWN = True
+    # 等待自动启动的服务就绪的最长时间（秒）
+    SPAWN_WAIT = 15
+    # 监听地址（只监听本机）
+    HOST = "127.0.0.1"
+    # 服务信息文件（端口、token、进程号）
+    INFO_FILE = "data/memory_server.json"
+    # 连接和请求超时（秒）
+    CONNECT_TIMEOUT = 2
+    REQUEST_TIMEOUT = 30
+
+
+# 视觉模型配置
+class VisionConfig:
+    """图片描述（VLM）相关配置"""
+    MAX_TOKENS = 500
+    TEMPERATURE = 0.3
+    # 上传前的预处理：裁掉纯色边框，缩放到模型能利用的最大边长
+    AUTOCROP_ENABLED = True
+    AUTOCROP_TOLERANCE = 10  # 与边框颜色的最大通道差
+    MAX_IMAGE_SIDE = 1568
+    # 缩略图中不同颜色数超过该值视为照片，使用JPEG；否则视为文字/界面截图，使用PNG
+    PHOTO_COLOR_THRESHOLD = 1024
+    JPEG_QUALITY = 85
+    # 已编码图片的缓存条数（按QPixmap.cacheKey）
+    PREPROCESS_CACHE_SIZE = 16
+    # 图片描述缓存：按图片和用户输入缓存描述。照片按差值哈希匹配，汉明距离不超过阈值视为同一张图；
+    # 文字/界面截图（PNG）只在编码结果完全相同时命中
+    CACHE_ENABLED = True
+    CACHE_FILE = "data/vision_cache.json"
+    CACHE_HAMMING_THRESHOLD = 5
+    CACHE_MAX_ENTRIES = 200
+
+
 # 桌面宠物界面配置
 class PetConfig:
     """桌面宠物界面相关配置"""
@@ -60,9 +197,6 @@ class PetConfig:
     # 默认宠物大小（当图片加载失败时使用）
     DEFAULT_PET_WIDTH = 100
     DEFAULT_PET_HEIGHT = 100
-    
-    # 位置检测间隔（毫秒）
-    POSITION_CHECK_INTERVAL = 50
 
 
 # 宠物装饰配置
@@ -82,6 +216,9 @@ class PetDecorationConfig:
     LOADING_SPINNER_COLOR = (100, 150, 255)  # RGB颜色
     LOADING_SPINNER_LINE_WIDTH = 2  # 线条宽度
     LOADING_SPINNER_DOTS = 8  # 圆点数量
+    
+    # 共享动画时钟的tick间隔（毫秒），所有装饰动画共用
+    ANIMATION_CLOCK_INTERVAL = 40
 
 
 # 消息气泡配置
@@ -98,6 +235,7 @@ class BubbleConfig:
     ARROW_HEIGHT = 15  # 箭头高度
     MIN_WIDTH = 100  # 最小宽度
     MAX_WIDTH = 300  # 最大宽度
+    STREAM_FLUSH_INTERVAL = 33  # 流式文本合并后刷新到气泡的间隔（毫秒），约30帧每秒
     
     # 气泡颜色配置
     BACKGROUND_COLOR = (225, 245, 254, 230)  # 浅蓝色半透明 (R, G, B, A)
@@ -167,6 +305,11 @@ class SystemConfig:
     # 日志文件路径
     LOG_FILE_PATH = "log.txt"
     
+    # 耗时追踪（每轮对话各阶段的耗时，python -m services.tracing 查看统计）
+    # 追踪文件只追加不轮转，默认关闭，排查性能问题时再打开
+    TRACE_ENABLED = False
+    TRACE_FILE_PATH = "data/traces.jsonl"
+    
     # 环境变量文件路径
     ENV_FILE_PATH = ".env"
     
@@ -225,6 +368,9 @@ RAG_CONFIG = {
 # 导出所有配置类，方便导入食用
 __all__ = [
     'ChatConfig',
+    'EndpointConfig',
+    'MemoryServerConfig',
+    'VisionConfig',
     'PetConfig', 
     'PetDecorationConfig',
     'BubbleConfig',
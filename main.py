@@ -1,10 +1,11 @@
 import sys
 import os
 import signal
+import socket
 import zipfile
 from pathlib import Path
 from PyQt5.QtWidgets import QApplication
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QSocketNotifier
 from widgets.desktop_pet import DesktopPet
 
 # Windows 控制台标题设置
@@ -107,6 +108,30 @@ def signal_handler(signum, frame):
     print(f"接收到信号 {signum}，正在退出...")
     QApplication.instance().quit()
 
+def install_signal_wakeup(app):
+    """
+    让Qt事件循环在收到系统信号时立即唤醒，以执行Python的信号处理函数
+    
+    信号到达时解释器向socket写入一个字节，QSocketNotifier随即触发，不需要定时器轮询
+    """
+    reader, writer = socket.socketpair()
+    reader.setblocking(False)
+    writer.setblocking(False)
+    signal.set_wakeup_fd(writer.fileno())
+    
+    def drain():
+        try:
+            while reader.recv(4096):
+                pass
+        except OSError:
+            pass
+    
+    notifier = QSocketNotifier(reader.fileno(), QSocketNotifier.Read, app)
+    notifier.activated.connect(drain)
+    # 保持引用，避免socket被回收
+    app._signal_wakeup = (reader, writer, notifier)
+    return notifier
+
 def initialize_rag_system():
     """初始化RAG系统"""
     try:
@@ -161,10 +186,8 @@ def main():
             signal.signal(signal.SIGINT, signal_handler)
             signal.signal(signal.SIGTERM, signal_handler)
         
-        # 创建定时器来处理Python信号（PyQt需要这样做）
-        timer = QTimer()
-        timer.start(500)  # 每500ms检查一次信号
-        timer.timeout.connect(lambda: None)  # 空操作，只是为了让Python信号能被处理
+        # 收到信号时唤醒事件循环来处理Python信号（代替定时轮询）
+        install_signal_wakeup(app)
         
         print("正在创建桌面宠物...")
         pet = DesktopPet()
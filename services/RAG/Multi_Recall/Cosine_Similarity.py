@@ -2,19 +2,42 @@ from .Retriever import *
 from typing import List, Literal, Dict, Union
 import traceback
 import os
+import threading
+from collections import OrderedDict
+from services.endpoint_pool import get_endpoint_pool, EndpointPool, Endpoint
+from services.tracing import span
 
 try:
     from openai import OpenAI
     class Embedding_API:
+        # 文本嵌入缓存（所有实例共享，按(模型, 文本)索引）
+        # 同一句用户输入会被记忆库、笔记库和回复缓存各嵌入一次，缓存后只需请求一次API
+        _cache = OrderedDict()
+        _cache_lock = threading.Lock()
+        CACHE_MAX_SIZE = 256
+
         def __init__(self, base_url, api_key: str, model: str):
             logger.info('初始化Embedding_API: %s', model)
             self.base_url = base_url
             self.api_key = api_key
             self.model = model
-            self.client = OpenAI(
-                api_key=self.api_key,
-                base_url=self.base_url
-            )
+            # 请求经端点池路由；没有配置端点池时使用传入的base_url/api_key
+            self.pool = get_endpoint_pool()
+            if not self.pool.endpoints and api_key:
+                self.pool = EndpointPool([Endpoint(base_url, api_key)])
+            # 每个端点一个OpenAI客户端
+            self._clients = {}
+        
+        def _client_for(self, endpoint):
+            """获取端点对应的OpenAI客户端（重试交给端点池，切换到其他端点）"""
+            key = (endpoint.base_url, endpoint.api_key)
+            if key not in self._clients:
+                self._clients[key] = OpenAI(
+                    api_key=endpoint.api_key,
+                    base_url=endpoint.base_url,
+                    max_retries=0
+                )
+            return self._clients[key]
         
         def embed(self, texts: Union[List[str], str]) -> List[List[float]]:
             """
@@ -23,20 +46,35 @@ try:
             if isinstance(texts, str):
                 texts = [texts]
                 
-            if not self.client:  # 检查客户端是否可用
-                print("OpenAI客户端未初始化")
+            if not self.pool.endpoints:  # 检查是否有可用端点
+                print("没有可用的嵌入API端点")
                 return None
             
             try:
                 ans = []
-                for text in tqdm(texts, desc='API嵌入文本'):
-                    # 使用 OpenAI 库调用嵌入API
-                    response = self.client.embeddings.create(
-                        model=self.model,
-                        input=text
-                    )
-                    res = response.data[0].embedding
-                    ans.append(res)
+                with span("embed", texts=len(texts)) as s:
+                    cached = 0
+                    for text in tqdm(texts, desc='API嵌入文本'):
+                        key = (self.model, text)
+                        with self._cache_lock:
+                            res = self._cache.get(key)
+                            if res is not None:
+                                self._cache.move_to_end(key)
+                        if res is None:
+                            # 使用 OpenAI 库调用嵌入API
+                            response = self.pool.call(lambda endpoint: self._client_for(endpoint).embeddings.create(
+                                model=self.model,
+                                input=text
+                            ))
+                            res = response.data[0].embedding
+                            with self._cache_lock:
+                                self._cache[key] = res
+                                while len(self._cache) > self.CACHE_MAX_SIZE:
+                                    self._cache.popitem(last=False)
+                        else:
+                            cached += 1
+                        ans.append(res)
+                    s.set(cached=cached)
                 return ans
             except Exception as e:
                 print(f"获取嵌入时发生异常: {e}")
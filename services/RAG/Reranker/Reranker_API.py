@@ -1,9 +1,14 @@
-import requests
+from services.endpoint_pool import get_endpoint_pool, EndpointPool, Endpoint
+from services.tracing import span
 class Reranker_API:
     def __init__(self, base_url, api_key, model):
         self.api_key = api_key
         self.model = model
         self.api_base = base_url.rstrip("/")
+        # 请求经端点池路由；没有配置端点池时使用传入的base_url/api_key
+        self.pool = get_endpoint_pool()
+        if not self.pool.endpoints and api_key:
+            self.pool = EndpointPool([Endpoint(base_url, api_key)])
 
     def rerank(self, docs, query, k=5):
         docs_ = []
@@ -13,11 +18,6 @@ class Reranker_API:
             else:
                 docs_.append(item.page_content)
         docs = list(set(docs_))
-        url = f"{self.api_base}/rerank"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
         data = {
             "model": self.model,
             "query": query,
@@ -25,8 +25,9 @@ class Reranker_API:
             "top_n": k,
             "return_documents": False
         }
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
+        with span("rerank", docs=len(docs)):
+            response = self.pool.post("/rerank", json=data)
+            response.raise_for_status()
         results = response.json()["results"]
         # 按得分排序并返回文档索引
         idx_score = [(r["index"], r["relevance_score"]) for r in results]
@@ -1,6 +1,37 @@
 from PyQt5.QtWidgets import QWidget, QApplication
-from PyQt5.QtCore import Qt, QRect,QRectF
-from PyQt5.QtGui import QPainter, QColor, QPen,QPainterPath 
+from PyQt5.QtCore import Qt, QRect, QRectF
+from PyQt5.QtGui import QPainter, QColor, QPen, QPixmap, QRegion
+
+
+def grab_virtual_desktop():
+    """
+    冻结所有屏幕的画面，合成为一张覆盖整个虚拟桌面的图像
+
+    返回:
+        (图像, 虚拟桌面的逻辑坐标范围)；图像的设备像素比取各屏幕中的最大值，保证高分屏不丢细节
+    """
+    screens = QApplication.screens()
+    if len(screens) == 1:
+        screen = screens[0]
+        return screen.grabWindow(0), screen.geometry()
+
+    geometry = QRect()
+    for screen in screens:
+        geometry = geometry.united(screen.geometry())
+    ratio = max(screen.devicePixelRatio() for screen in screens)
+
+    composite = QPixmap(int(geometry.width() * ratio), int(geometry.height() * ratio))
+    composite.setDevicePixelRatio(ratio)
+    composite.fill(Qt.black)
+    painter = QPainter(composite)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    for screen in screens:
+        pixmap = screen.grabWindow(0)
+        target = screen.geometry().translated(-geometry.topLeft())
+        painter.drawPixmap(QRectF(target), pixmap, QRectF(pixmap.rect()))
+    painter.end()
+    return composite, geometry
+
 
 class ScreenshotSelector(QWidget):
     def __init__(self):
@@ -8,46 +39,55 @@ class ScreenshotSelector(QWidget):
         self.setWindowFlags(
             Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool
         )
-        self.setAttribute(Qt.WA_TranslucentBackground)
         self.setAttribute(Qt.WA_DeleteOnClose, False)  # 防止关闭时删除对象
-        self.setWindowState(Qt.WindowFullScreen)  # 全屏覆盖
-        
-        # 框选变量
-        self.start_pos = None
-        self.end_pos = None
-        self.selection_rect = QRect()
-        
+        self.setAttribute(Qt.WA_OpaquePaintEvent)  # 每次重绘都完整覆盖脏区域，不需要先擦除背景
+
         # 界面样式
         self.mask_color = QColor(0, 0, 0, 100)  # 半透明黑色遮罩
         self.border_color = QColor(255, 255, 255)  # 白色边框
         self.border_width = 2
-        
+
+        # 打开时冻结一次所有屏幕的画面，之后的显示和裁剪都基于它
+        self.frozen_pixmap, virtual_geometry = grab_virtual_desktop()
+        self.pixel_ratio = self.frozen_pixmap.devicePixelRatio()
+        # 预先叠加好遮罩的画面，拖动时只需要按区域贴图
+        self.masked_pixmap = QPixmap(self.frozen_pixmap)
+        painter = QPainter(self.masked_pixmap)
+        painter.fillRect(self.masked_pixmap.rect(), self.mask_color)
+        painter.end()
+        self.setGeometry(virtual_geometry)  # 覆盖所有屏幕
+
+        # 框选变量
+        self.start_pos = None
+        self.end_pos = None
+        self.selection_rect = QRect()
+
+    def _source_rect(self, rect):
+        """窗口逻辑坐标转换为冻结图像中的物理像素坐标"""
+        ratio = self.pixel_ratio
+        return QRectF(rect.x() * ratio, rect.y() * ratio, rect.width() * ratio, rect.height() * ratio)
+
+    def _border_region(self, rect):
+        """选择框边框覆盖的区域"""
+        if rect.isNull():
+            return QRegion()
+        width = self.border_width
+        outer = QRegion(rect.adjusted(-width, -width, width, width))
+        return outer.subtracted(QRegion(rect.adjusted(width, width, -width, -width)))
+
     def paintEvent(self, event):
-        """绘制半透明遮罩和选择框"""
+        """只重绘脏区域：选区外贴带遮罩的画面，选区内贴原始画面，再画边框"""
         painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
-        
-        # 绘制全屏半透明遮罩
-        painter.fillRect(self.rect(), self.mask_color)
-        
-        # 如果有选择区域，绘制透明区域和边框
+        dirty = event.region()
+        selection = QRegion(self.selection_rect) if not self.selection_rect.isNull() else QRegion()
+
+        for rect in dirty.subtracted(selection).rects():
+            painter.drawPixmap(QRectF(rect), self.masked_pixmap, self._source_rect(rect))
+        for rect in dirty.intersected(selection).rects():
+            painter.drawPixmap(QRectF(rect), self.frozen_pixmap, self._source_rect(rect))
+
+        # 绘制边框
         if not self.selection_rect.isNull():
-            # 创建一个全屏路径，并减去选区
-            full_path = QPainterPath()
-            full_path.addRect(QRectF(self.rect()))
-            
-            selection_path = QPainterPath()
-            selection_path.addRect(QRectF(self.selection_rect))
-            
-            # 使用 subtracted() 方法得到遮罩路径（全屏 - 选区）
-            mask_path = full_path.subtracted(selection_path)
-            
-            # 绘制遮罩（只保留选区外的部分）
-            painter.setPen(Qt.NoPen)
-            painter.setBrush(self.mask_color)
-            painter.drawPath(mask_path)
-            
-            # 绘制边框
             painter.setPen(QPen(self.border_color, self.border_width))
             painter.setBrush(Qt.NoBrush)  # 确保边框内不填充
             painter.drawRect(self.selection_rect)
@@ -57,11 +97,11 @@ class ScreenshotSelector(QWidget):
         if event.button() == Qt.LeftButton:
             self.start_pos = event.pos()
             self.end_pos = event.pos()
-            self.update()
 
     def mouseMoveEvent(self, event):
-        """鼠标移动更新选择框"""
+        """鼠标移动更新选择框，只重绘新旧选区的差异和边框"""
         if self.start_pos:
+            old_rect = self.selection_rect
             self.end_pos = event.pos()
             self.selection_rect = QRect(
                 min(self.start_pos.x(), self.end_pos.x()),
@@ -69,28 +109,22 @@ class ScreenshotSelector(QWidget):
                 abs(self.start_pos.x() - self.end_pos.x()),
                 abs(self.start_pos.y() - self.end_pos.y())
             )
-            self.update()
+            dirty = QRegion(old_rect).xored(QRegion(self.selection_rect))
+            dirty = dirty.united(self._border_region(old_rect)).united(self._border_region(self.selection_rect))
+            self.update(dirty)
 
     def mouseReleaseEvent(self, event):
         """鼠标释放完成截图"""
         if event.button() == Qt.LeftButton and self.start_pos:
-            # 先隐藏窗口确保截图无遮罩
-            self.hide()  # 关键修改：先隐藏界面
-            QApplication.processEvents()  # 确保界面立即隐藏
-            
-            # 获取屏幕截图（此时窗口已隐藏）
-            screen = QApplication.primaryScreen()
-            full_pixmap = screen.grabWindow(0)
-            
-            # 截取选定区域（使用窗口隐藏前记录的坐标）
-            selected_pixmap = full_pixmap.copy(self.selection_rect)
-            
+            self.hide()
+
+            # 直接从冻结的画面中裁剪选区
+            selected_pixmap = self.frozen_pixmap.copy(self._source_rect(self.selection_rect).toRect())
+            selected_pixmap.setDevicePixelRatio(self.pixel_ratio)
+
             # 返回截图（通过信号或直接处理）
             self.on_screenshot_captured(selected_pixmap)
-            
-            # 隐藏窗口而不是关闭，避免影响主程序
-            self.hide()
 
     def on_screenshot_captured(self, pixmap):
         """子类需重写此方法处理截图"""
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+取消机制
+在对话流程、流式请求和工具执行之间传递取消令牌，
+取消时关闭正在进行的HTTP流并结束正在运行的子进程
+"""
+
+import os
+import time
+import threading
+import subprocess
+from typing import Callable, List, Optional
+
+
+class CancelledError(Exception):
+    """操作已被取消"""
+    pass
+
+
+class CancellationToken:
+    """取消令牌，可以注册取消时执行的回调（关闭连接、结束进程等）"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        # 调用cancel()时的时间戳（perf_counter），用于统计取消延迟
+        self.cancelled_at: Optional[float] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """取消并执行所有已注册的回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.cancelled_at = time.perf_counter()
+            self._event.set()
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"执行取消回调时出错: {e}")
+
+    def register(self, callback: Callable[[], None]):
+        """注册取消回调；如果已经取消则立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def unregister(self, callback: Callable[[], None]):
+        """移除取消回调"""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        """已取消时抛出CancelledError"""
+        if self._event.is_set():
+            raise CancelledError("操作已被取消")
+
+    def wait(self, timeout: float) -> bool:
+        """等待取消，返回是否已取消"""
+        return self._event.wait(timeout)
+
+    def elapsed_since_cancel(self) -> Optional[float]:
+        """距离调用cancel()经过的秒数"""
+        if self.cancelled_at is None:
+            return None
+        return time.perf_counter() - self.cancelled_at
+
+
+def kill_process_tree(process: subprocess.Popen):
+    """结束子进程及其子进程（shell=True时真正的命令是cmd的子进程）"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == 'nt':
+            subprocess.run(
+                ['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        else:
+            process.kill()
+    except Exception as e:
+        print(f"结束子进程失败: {e}")
+
+
+def run_subprocess(args, timeout: float, cancel_token: Optional[CancellationToken] = None,
+                   **popen_kwargs) -> subprocess.CompletedProcess:
+    """
+    执行子进程并收集输出，行为与subprocess.run(capture_output=True, text=True)一致
+
+    额外支持取消令牌：取消时立即结束子进程并抛出CancelledError
+
+    异常:
+        subprocess.TimeoutExpired: 超时
+        CancelledError: 被取消
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    process = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        **popen_kwargs
+    )
+
+    def _kill():
+        kill_process_tree(process)
+
+    if cancel_token is not None:
+        cancel_token.register(_kill)
+    try:
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(process)
+            process.communicate()
+            raise
+    finally:
+        if cancel_token is not None:
+            cancel_token.unregister(_kill)
+
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
@@ -3,12 +3,24 @@ import requests
 import re
 import sys
 import os
-import importlib.util
+import time
+import threading
 from datetime import datetime
 from typing import List, Dict, Any, Optional, Iterator
-from config import ChatConfig
+from config import ChatConfig, SystemConfig
 from .summarize import summarize_conversation_async
 from .context_builder import get_context_builder
+from .token_counter import estimate_tokens, estimate_message_tokens, estimate_tools_tokens
+from .tool_result_store import budget_tool_output
+from .tool_registry import ToolRegistry, ToolImportError
+from .response_cache import get_response_cache, context_hash
+from .hedging import RollingHistogram, open_stream
+from .endpoint_pool import get_endpoint_pool
+from .tracing import Span, span, use_trace
+from .speculative_tools import SpeculativeToolRunner
+from .history_index import get_history_index
+from .chat_events import ChatEvent, TextDelta, ToolStarted, ToolFinished, RoundBoundary, Usage, iter_text
+from .cancellation import CancellationToken, CancelledError
 
 
 class ChatService:
@@ -19,10 +31,16 @@ class ChatService:
         self.base_url = base_url
         self.model = model
         self.conversation_history: List[Dict[str, str]] = []
+        # 与conversation_history一一对应的token估算缓存
+        self._history_tokens: List[int] = []
+        # 同一时间只处理一轮对话
+        self._turn_lock = threading.Lock()
         
         # 历史记录文件
         self.history_file = "data/history.jsonl"
         self._ensure_history_file()
+        # 历史记录的行偏移索引，追加记录时同步更新
+        self.history_index = get_history_index(self.history_file)
         
         # 当前对话的临时记录
         self.current_conversation = {
@@ -33,15 +51,25 @@ class ChatService:
             "tool_responses": []
         }
         
+        # 请求前缀稳定性统计（用于评估服务商前缀缓存的命中情况）
+        self._last_request_serialized = ""
+        self.prefix_cache_stats = {"requests": 0, "reused_chars": 0, "total_chars": 0}
+        
+        # 最近的首字节时间分布，用于决定何时发出对冲请求
+        self.ttft_histogram = RollingHistogram()
+        
         # 动态注册tools/目录下的所有工具
         self.available_tools = {}
         self.tools = []
+        self.tool_registry = None
+        self._tools_lock = threading.Lock()
         print("开始加载工具...")
         self._load_tools_from_directory()
+        self._tools_tokens = estimate_tools_tokens(self.tools)
         print(f"工具加载完成，共加载 {len(self.available_tools)} 个工具")
     
     def _load_tools_from_directory(self):
-        """从tools/目录动态加载所有工具"""
+        """从tools/目录注册所有工具（延迟导入）"""
         if getattr(sys, 'frozen', False):
             # 打包后的情况 - 使用 _MEIPASS 路径
             base_path = sys._MEIPASS
@@ -49,57 +77,17 @@ class ChatService:
         else:
             # 开发时的情况
             tools_dir = "tools"
-        successful_tools = []
-        failed_tools = []
-        
         print(f"检查工具目录: {tools_dir}")
         if not os.path.exists(tools_dir):
             print(f"工具目录 {tools_dir} 不存在")
             self._log_tool_info(f"工具目录 {tools_dir} 不存在")
             return
         
-        print(f"工具目录存在，开始扫描.py文件...")
+        print(f"工具目录存在，读取工具清单...")
         
-        # 遍历tools目录下的所有.py文件
-        all_files = os.listdir(tools_dir)
-        print(f"目录中的所有文件: {all_files}")
-        
-        for filename in all_files:
-            print(f"检查文件: {filename}")
-            if filename.endswith('.py') and not filename.startswith('__'):
-                tool_name = filename[:-3]  # 去掉.py扩展名
-                file_path = os.path.join(tools_dir, filename)
-                print(f"尝试加载工具: {tool_name} from {file_path}")
-                
-                try:
-                    # 动态导入模块
-                    spec = importlib.util.spec_from_file_location(tool_name, file_path)
-                    if spec is None or spec.loader is None:
-                        failed_tools.append(f"{tool_name}: 无法创建模块规范")
-                        continue
-                    
-                    module = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(module)
-                    
-                    # 检查模块是否有对应的函数和tool_definition
-                    if hasattr(module, tool_name):
-                        tool_func = getattr(module, tool_name)
-                        
-                        # 检查函数是否有tool_definition属性
-                        if hasattr(tool_func, 'tool_definition'):
-                            self.available_tools[tool_name] = tool_func
-                            self.tools.append(tool_func.tool_definition)
-                            successful_tools.append(tool_name)
-                        else:
-                            failed_tools.append(f"{tool_name}: 缺少tool_definition属性")
-                            print("取消加载，因为缺少tool_definition属性")
-                    else:
-                        failed_tools.append(f"{tool_name}: 模块中没有找到同名函数")
-                        print("取消加载，因为模块中没有找到同名函数")
-                        
-                except Exception as e:
-                    failed_tools.append(f"{tool_name}: 加载失败 - {str(e)}")
-                    print(f"取消加载，因为{str(e)}")
+        # 工具定义来自清单缓存，模块在第一次调用时才导入
+        self.tool_registry = ToolRegistry(tools_dir)
+        self.available_tools, self.tools, successful_tools, failed_tools = self.tool_registry.load()
         
         # 记录工具注册结果到日志
         self._log_tool_registration_result(successful_tools, failed_tools)
@@ -137,11 +125,38 @@ class ChatService:
     
     def add_message(self, role: str, content: str):
         """添加消息到对话历史"""
-        self.conversation_history.append({"role": role, "content": content})
+        message = {"role": role, "content": content}
+        self.conversation_history.append(message)
+        self._history_tokens.append(estimate_message_tokens(message))
+    
+    def _trim_history_to_budget(self, reserved_tokens: int):
+        """
+        按token预算裁剪对话历史
+        
+        从最旧的一端整轮（以用户消息开头）删除，直到历史总量不超过
+        MAX_PROMPT_TOKENS扣除reserved_tokens后的预算。最新一轮始终保留。
+        
+        参数:
+            reserved_tokens: 系统提示词、工具定义等需要预留的token数
+        """
+        budget = ChatConfig.MAX_PROMPT_TOKENS - reserved_tokens
+        total = sum(self._history_tokens)
+        
+        # 找出每一轮的起点（用户消息的位置）
+        turn_starts = [i for i, msg in enumerate(self.conversation_history) if msg.get("role") == "user"]
         
-        # 限制历史记录长度，避免过长
-        if len(self.conversation_history) > ChatConfig.MAX_CONVERSATION_HISTORY:
-            self.conversation_history = self.conversation_history[-ChatConfig.MAX_CONVERSATION_HISTORY:]
+        cut = 0
+        for next_start in turn_starts:
+            if total <= budget:
+                break
+            if next_start == 0:
+                continue
+            total -= sum(self._history_tokens[cut:next_start])
+            cut = next_start
+        
+        if cut:
+            self.conversation_history = self.conversation_history[cut:]
+            self._history_tokens = self._history_tokens[cut:]
     
     def log_request_response(self, request_data: Dict[str, Any], response_data: str, parsed_response: Optional[Dict[str, Any]] = None):
         """记录请求和响应到日志文件"""
@@ -181,13 +196,47 @@ class ChatService:
         except Exception as e:
             print(f"日志记录失败: {e}")
 
-    def call_ai_api_stream(self, messages: List[Dict[str, str]], max_tokens: int = 512) -> Iterator[Dict[str, Any]]:
-        """调用AI API流式响应"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def call_ai_api_stream(self, messages: List[Dict[str, str]], max_tokens: int = ChatConfig.MAX_TOKENS,
+                           cancel_token: Optional[CancellationToken] = None,
+                           usage: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        调用AI API流式响应，取消时关闭流式连接并抛出CancelledError
+        
+        参数:
+            usage: 传入字典时，流结束后填入ttft_ms、duration_ms、output_tokens、tokens_per_s
+        """
+        with span("chat_stream", messages=len(messages)) as s:
+            ttft = None
+            output = ""
+            for data in self._stream_chat_completion(messages, max_tokens, cancel_token, s):
+                if ttft is None:
+                    ttft = s.elapsed()
+                    s.set(ttft_ms=round(ttft * 1000, 1))
+                for choice in data.get('choices') or []:
+                    delta = choice.get('delta') or {}
+                    output += delta.get('content') or ''
+                    for tool_call in delta.get('tool_calls') or []:
+                        output += (tool_call.get('function') or {}).get('arguments') or ''
+                yield data
+            
+            # 生成速度：首字节之后的输出token数/秒
+            if ttft is not None:
+                tokens = estimate_tokens(output)
+                generation = s.elapsed() - ttft
+                s.set(output_tokens=tokens, tokens_per_s=round(tokens / generation, 1) if generation > 0 else 0.0)
+                if usage is not None:
+                    usage.update(ttft_ms=s.attrs["ttft_ms"], duration_ms=round(s.elapsed() * 1000, 1),
+                                 output_tokens=tokens, tokens_per_s=s.attrs["tokens_per_s"])
+    
+    def _stream_chat_completion(self, messages: List[Dict[str, str]], max_tokens: int,
+                                cancel_token: Optional[CancellationToken] = None,
+                                trace_span: Optional[Span] = None) -> Iterator[Dict[str, Any]]:
+        """
+        发送流式请求并逐个返回解析后的SSE数据块
         
+        参数:
+            trace_span: 当前请求的span，启用缓存友好布局和追踪时附加前缀复用统计
+        """
         payload = {
             "model": self.model,
             "messages": messages,
@@ -201,20 +250,37 @@ class ChatService:
         if self.tools:
             payload["tools"] = self.tools
         
-        try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
+        # 前缀复用统计要重新序列化整个请求，只在使用缓存友好布局且开启追踪时计算
+        if trace_span is not None and ChatConfig.PROMPT_CACHE_LAYOUT and SystemConfig.TRACE_ENABLED:
+            trace_span.set(**self._measure_prefix_stability(payload))
+        
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        
+        def send():
+            # 每次发送（包括对冲和重试）都由端点池重新选择端点
+            return get_endpoint_pool().post(
+                "/chat/completions",
                 json=payload,
                 timeout=ChatConfig.API_TIMEOUT,
                 stream=True
             )
-            response.raise_for_status()
+        
+        response = None
+        try:
+            # 首字节过慢时对冲，暂时性错误自动重试
+            stream = open_stream(send, self.ttft_histogram, cancel_token)
+            response = stream.response
+            # 取消时直接关闭连接，iter_lines会立即结束
+            if cancel_token is not None:
+                cancel_token.register(response.close)
             
             # 收集完整响应用于日志和解析
             parsed_response = {"content": "", "tool_calls": []}
             
-            for line in response.iter_lines():
+            for line in stream.iter_lines():
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
                 if line:
                     line_str = line.decode('utf-8')
                     
@@ -260,33 +326,178 @@ class ChatService:
                         except json.JSONDecodeError:
                             continue
             
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            
             # 记录请求和解析后的响应
             self.log_request_response(payload, "", parsed_response)
             
+        except CancelledError:
+            raise
         except requests.exceptions.RequestException as e:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise CancelledError("请求已被取消")
             error_msg = f"API调用失败: {str(e)}"
             self.log_request_response(payload, error_msg)
             raise Exception(error_msg)
+        except Exception:
+            # 连接被取消回调关闭时，底层可能抛出各种异常
+            if cancel_token is not None and cancel_token.cancelled:
+                raise CancelledError("请求已被取消")
+            raise
+        finally:
+            if response is not None:
+                if cancel_token is not None:
+                    cancel_token.unregister(response.close)
+                response.close()
 
-    def execute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
-        """执行工具函数"""
+    def _tool_display_name(self, tool_name: str) -> str:
+        """从配置中获取工具的友好显示名称，如果没有则使用默认格式"""
+        return ChatConfig.TOOL_CALL_DISPLAY_NAMES.get(tool_name, f"工具调用：{tool_name}")
+
+    def execute_tool(self, tool_name: str, parameters: Dict[str, Any],
+                     cancel_token: Optional[CancellationToken] = None) -> Dict[str, Any]:
+        """执行工具函数，支持取消的工具（声明了cancel_token参数）会收到取消令牌"""
         if tool_name not in self.available_tools:
             return {
                 "status": "error",
                 "message": f"工具 '{tool_name}' 不存在"
             }
         
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        
         try:
             tool_func = self.available_tools[tool_name]
-            return tool_func(**parameters)
+            # 模型生成的参数中不应包含cancel_token，只由这里注入
+            parameters = {k: v for k, v in parameters.items() if k != "cancel_token"}
+            if cancel_token is not None and tool_func.accepts_argument("cancel_token"):
+                parameters["cancel_token"] = cancel_token
+            with span("tool", tool=tool_name) as s:
+                result = tool_func(**parameters)
+                if isinstance(result, dict) and "status" in result:
+                    s.set(status=str(result["status"]))
+            return result
+        except CancelledError:
+            raise
+        except ToolImportError as e:
+            self._disable_tool(tool_name, e)
+            return {
+                "status": "error",
+                "message": f"工具 '{tool_name}' 在当前环境中不可用: {str(e)}"
+            }
         except Exception as e:
             return {
                 "status": "error",
                 "message": f"执行工具时出错: {str(e)}"
             }
+    
+    def _disable_tool(self, tool_name: str, error: Exception):
+        """导入失败的工具不再提供给模型，并记录到工具清单"""
+        with self._tools_lock:
+            if self.available_tools.pop(tool_name, None) is None:
+                return
+            # 替换而不是原地修改，正在发送的请求仍使用旧列表
+            self.tools = [t for t in self.tools if t.get("function", {}).get("name") != tool_name]
+            self._tools_tokens = estimate_tools_tokens(self.tools)
+        print(f"工具 {tool_name} 导入失败，已停用: {error}")
+        self._log_tool_info(f"{tool_name} 导入失败，已停用 - {error}")
+        if self.tool_registry is not None:
+            self.tool_registry.mark_import_failed(tool_name, error)
 
-    def process_message_stream(self, user_message: str) -> Iterator[str]:
-        """处理用户消息并返回流式AI回复"""
+    def _build_request_messages(self, user_message: str, retrieved: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        """
+        构建发送给模型的消息列表
+        
+        默认布局：系统消息 = 人设提示词 + 当前时间 + 相关记忆/笔记，之后是对话历史。
+        缓存友好布局（ChatConfig.PROMPT_CACHE_LAYOUT）：系统消息只包含人设提示词，
+        易变的上下文附加在本轮用户消息前，前面的历史保持字节级不变。
+        
+        参数:
+            user_message: 用户消息
+            retrieved: ContextBuilder.retrieve_context的返回值
+        """
+        with span("build_prompt") as s:
+            messages = self._layout_request_messages(user_message, retrieved)
+            s.set(history_messages=len(self.conversation_history))
+        return messages
+    
+    def _layout_request_messages(self, user_message: str, retrieved: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        """按配置的布局生成消息列表"""
+        context_builder = get_context_builder()
+        static_prompt = context_builder.build_static_prompt()
+        volatile_context = context_builder.build_volatile_context(retrieved)
+        
+        # 按token预算裁剪对话历史，为系统提示词、工具定义和回复预留空间
+        reserved_tokens = (estimate_tokens(static_prompt) + estimate_tokens(volatile_context)
+                           + self._tools_tokens + ChatConfig.MAX_TOKENS)
+        self._trim_history_to_budget(reserved_tokens)
+        
+        if not ChatConfig.PROMPT_CACHE_LAYOUT:
+            return [
+                {
+                    "role": "system",
+                    "content": static_prompt + "\n" + volatile_context
+                }
+            ] + self.conversation_history
+        
+        # 最后一条历史就是本轮的用户消息，只在请求中附加上下文，不修改历史本身
+        current_message = {
+            "role": "user",
+            "content": ChatConfig.VOLATILE_CONTEXT_TEMPLATE.format(context=volatile_context, message=user_message)
+        }
+        return [
+            {
+                "role": "system",
+                "content": static_prompt
+            }
+        ] + self.conversation_history[:-1] + [current_message]
+    
+    def _measure_prefix_stability(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        统计本次请求与上一次请求的公共前缀长度
+        
+        服务商的前缀缓存只对完全相同的前缀生效，这里按序列化后的
+        工具定义+消息列表逐字符比较，累计前缀复用率。
+        
+        返回:
+            写入追踪的属性：prefix_reused_chars、prefix_total_chars、prefix_reuse_ratio（累计）
+        """
+        serialized = json.dumps(payload.get("tools", []), ensure_ascii=False) + \
+            json.dumps(payload["messages"], ensure_ascii=False)
+        reused = len(os.path.commonprefix([self._last_request_serialized, serialized]))
+        self._last_request_serialized = serialized
+        
+        stats = self.prefix_cache_stats
+        stats["requests"] += 1
+        stats["reused_chars"] += reused
+        stats["total_chars"] += len(serialized)
+        ratio = stats["reused_chars"] / stats["total_chars"] if stats["total_chars"] else 0.0
+        return {"prefix_reused_chars": reused, "prefix_total_chars": len(serialized),
+                "prefix_reuse_ratio": round(ratio, 4)}
+
+    def process_message_stream(self, user_message: str, cancel_token: Optional[CancellationToken] = None,
+                               retrieval_query: Optional[str] = None) -> Iterator[ChatEvent]:
+        """
+        处理用户消息并以事件流返回AI回复
+        
+        产出的事件见services/chat_events.py：回复文本(TextDelta)、工具开始/完成(ToolStarted/ToolFinished)、
+        工具轮次边界(RoundBoundary)以及每次模型请求的用量(Usage)
+        
+        参数:
+            user_message: 用户消息
+            cancel_token: 取消令牌。取消后关闭流式连接、结束正在运行的工具，
+                本轮不再输出内容，也不进行总结
+            retrieval_query: 检索记忆和笔记用的查询，默认为user_message。
+                带图片的消息传入用户的原始输入，与等待图片描述时提前发起的检索对应
+        """
+        # 被取消的一轮在收尾（写入历史）时，新的一轮需要等待它完成
+        with self._turn_lock, use_trace(), span("turn"):
+            yield from self._process_turn(user_message, cancel_token, retrieval_query)
+    
+    def _process_turn(self, user_message: str, cancel_token: Optional[CancellationToken] = None,
+                      retrieval_query: Optional[str] = None) -> Iterator[ChatEvent]:
+        """处理一轮对话"""
         # 初始化当前对话记录
         self.current_conversation = {
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -299,175 +510,289 @@ class ChatService:
         # 添加用户消息到历史
         self.add_message("user", user_message)
         
-        # 使用上下文构建器构建增强的系统提示词
+        # 检索上下文并构建本次请求的消息列表
         context_builder = get_context_builder()
-        enhanced_system_prompt = context_builder.build_enhanced_system_prompt(user_message)
+        retrieved = context_builder.retrieve_context(retrieval_query or user_message)
+        messages = self._build_request_messages(user_message, retrieved)
         
-        # 构建消息列表，包含增强的系统提示和对话历史
-        messages = [
-            {
-                "role": "system",
-                "content": enhanced_system_prompt
-            }
-        ] + self.conversation_history
+        # 查询语义回复缓存
+        cache_key = self._response_cache_key(user_message, retrieved)
+        
+        try:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if cache_key is not None:
+                cached = get_response_cache().lookup(*cache_key)
+                if cached is not None:
+                    yield from self._replay_cached_response(cached, cancel_token)
+                    return
+            started = time.perf_counter()
+            yield from self._run_tool_loop(messages, cancel_token)
+        except CancelledError:
+            self._handle_cancelled_turn(cancel_token)
+            return
+        
+        # 只缓存没有调用工具的完整回复
+        answer = self.current_conversation['ai_response']
+        if cache_key is not None and answer and not self.current_conversation['tool_calls']:
+            get_response_cache().store(*cache_key, user_message, answer, time.perf_counter() - started)
+        
+        # 对话完成后，保存历史记录
+        self._save_conversation_history()
         
+        # 对话完成后，异步调用总结功能
+        # 获取最终的助手回复（可能包含多轮工具调用的结果）和本轮的工具调用
+        final_assistant_message = self._get_final_assistant_message()
+        all_tool_calls = self._get_all_tool_calls_from_history()
+        self._summarize_conversation_async(user_message, final_assistant_message, all_tool_calls)
+
+    def _response_cache_key(self, user_message: str, retrieved: Dict[str, List[str]]):
+        """
+        计算语义回复缓存的键
+        
+        返回:
+            (用户输入的嵌入向量, 人设、检索上下文与最近对话的哈希)，未启用缓存或嵌入失败时返回None
+        """
+        if not ChatConfig.RESPONSE_CACHE_ENABLED:
+            return None
+        context_builder = get_context_builder()
+        embedding = context_builder.embed_query(user_message)
+        if embedding is None:
+            return None
+        # 历史的最后一条是本轮的用户输入，不计入上文
+        count = ChatConfig.RESPONSE_CACHE_HISTORY_MESSAGES
+        history = self.conversation_history[:-1][-count:] if count > 0 else []
+        return embedding, context_hash(context_builder.build_static_prompt(), retrieved, history)
+    
+    def _replay_cached_response(self, cached: Dict[str, Any], cancel_token: Optional[CancellationToken] = None) -> Iterator[ChatEvent]:
+        """以流式方式回放缓存的回答，并像正常回复一样写入历史"""
+        started = time.perf_counter()
+        answer = cached["answer"]
+        chunk_size = ChatConfig.RESPONSE_CACHE_REPLAY_CHUNK
+        for i in range(0, len(answer), chunk_size):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            chunk = answer[i:i + chunk_size]
+            self.current_conversation['ai_response'] += chunk
+            yield TextDelta(chunk)
+        
+        duration = time.perf_counter() - started
+        tokens = estimate_tokens(answer)
+        yield Usage(ttft_ms=0.0, duration_ms=round(duration * 1000, 1), output_tokens=tokens,
+                    tokens_per_s=round(tokens / duration, 1) if duration > 0 else 0.0, cached=True)
+        
+        self.add_message("assistant", answer)
+        self.current_conversation['cached'] = True
+        self._save_conversation_history()
+        
+        # 缓存的回答没有新信息，不进行总结
+        message = (f"命中回复缓存（相似度 {cached['similarity']:.3f}，原问题: {cached['query'][:30]}），"
+                   + get_response_cache().describe_stats())
+        print(message)
+        self._log_tool_info(message)
+    
+    def _timed_execute_tool(self, tool_name: str, parameters: Dict[str, Any],
+                            cancel_token: Optional[CancellationToken] = None):
+        """执行工具并返回(结果, 耗时秒数)"""
+        started = time.perf_counter()
+        result = self.execute_tool(tool_name, parameters, cancel_token)
+        return result, time.perf_counter() - started
+
+    def _run_tool_loop(self, messages: List[Dict[str, Any]], cancel_token: Optional[CancellationToken] = None) -> Iterator[ChatEvent]:
+        """流式请求模型并循环执行工具调用，直到模型给出最终回复"""
         # 最大工具调用轮次，防止无限循环
         max_tool_calls = ChatConfig.MAX_TOOL_CALLS
         tool_call_count = 0
         
-        while tool_call_count < max_tool_calls:
-            # 用于收集完整回复内容
-            full_content = ""
-            # 用于收集工具调用
-            tool_calls = {}
-            # 用于跟踪已显示的工具调用
-            displayed_tool_calls = set()
+        # 本轮（包括取消和出错时）结束前取消并等待所有未被取用的提前执行
+        speculative = None
+        try:
+            while tool_call_count < max_tool_calls:
+                # 用于收集完整回复内容
+                full_content = ""
+                # 用于收集工具调用
+                tool_calls = {}
+                # 用于跟踪已通知开始的工具调用
+                displayed_tool_calls = set()
+                # 参数完整的只读工具在流结束前就开始执行，上一轮未被取用的提前执行先取消并等待退出
+                if speculative is not None:
+                    speculative.close()
+                speculative = SpeculativeToolRunner(self._timed_execute_tool, cancel_token)
+                usage = {}
             
-            # 流式调用AI API
-            for chunk in self.call_ai_api_stream(messages):
-                if 'choices' not in chunk or len(chunk['choices']) == 0:
-                    continue
+                # 流式调用AI API
+                for chunk in self.call_ai_api_stream(messages, cancel_token=cancel_token, usage=usage):
+                    if 'choices' not in chunk or len(chunk['choices']) == 0:
+                        continue
                     
-                choice = chunk['choices'][0]
+                    choice = chunk['choices'][0]
                 
-                # 处理文本内容
-                if 'delta' in choice and 'content' in choice['delta'] and choice['delta']['content']:
-                    content = choice['delta']['content']
-                    full_content += content
-                    self.current_conversation['ai_response'] += content
-                    yield content
+                    # 处理文本内容
+                    if 'delta' in choice and 'content' in choice['delta'] and choice['delta']['content']:
+                        content = choice['delta']['content']
+                        full_content += content
+                        self.current_conversation['ai_response'] += content
+                        yield TextDelta(content)
                 
-                # 处理工具调用
-                if 'delta' in choice and 'tool_calls' in choice['delta'] and choice['delta']['tool_calls']:
-                    for tool_call in choice['delta']['tool_calls']:
-                        index = tool_call['index']
+                    # 处理工具调用
+                    if 'delta' in choice and 'tool_calls' in choice['delta'] and choice['delta']['tool_calls']:
+                        for tool_call in choice['delta']['tool_calls']:
+                            index = tool_call['index']
                         
-                        # 初始化工具调用结构
-                        if index not in tool_calls:
-                            tool_calls[index] = {
-                                'id': tool_call.get('id', f'call_{index}_{tool_call_count}'),
-                                'type': tool_call.get('type', 'function'),
-                                'function': {
-                                    'name': tool_call['function'].get('name', ''),
-                                    'arguments': tool_call['function'].get('arguments', '')
+                            # 初始化工具调用结构
+                            if index not in tool_calls:
+                                tool_calls[index] = {
+                                    'id': tool_call.get('id', f'call_{index}_{tool_call_count}'),
+                                    'type': tool_call.get('type', 'function'),
+                                    'function': {
+                                        'name': tool_call['function'].get('name', ''),
+                                        'arguments': tool_call['function'].get('arguments', '')
+                                    }
                                 }
-                            }
                             
-                            # 当工具名称首次出现时，显示工具调用信息
-                            if tool_call['function'].get('name') and index not in displayed_tool_calls:
-                                function_name = tool_call['function']['name']
-                                
-                                # 从配置中获取友好显示名称，如果没有则使用默认格式
-                                display_name = ChatConfig.TOOL_CALL_DISPLAY_NAMES.get(
-                                    function_name, 
-                                    f"工具调用：{function_name}"
-                                )
-                                if full_content:
-                                    yield f"\n> {display_name}\n"
-                                else:
-                                    yield f"> {display_name}\n"
-                                displayed_tool_calls.add(index)
-                        else:
-                            # 累加参数
-                            if 'arguments' in tool_call['function']:
-                                tool_calls[index]['function']['arguments'] += tool_call['function']['arguments']
+                                # 当工具名称首次出现时，通知工具调用开始
+                                if tool_call['function'].get('name') and index not in displayed_tool_calls:
+                                    function_name = tool_call['function']['name']
+                                    yield ToolStarted(index, function_name, self._tool_display_name(function_name),
+                                                      tool_call_count + 1)
+                                    displayed_tool_calls.add(index)
+                            else:
+                                # 累加参数
+                                if 'arguments' in tool_call['function']:
+                                    tool_calls[index]['function']['arguments'] += tool_call['function']['arguments']
+                        
+                            function = tool_calls[index]['function']
+                            speculative.feed(index, function['name'], tool_call['function'].get('arguments') or '',
+                                             function['arguments'])
+            
+                if usage:
+                    yield Usage(**usage)
             
-            # 如果有工具调用，执行工具
-            if tool_calls:
-                tool_call_count += 1
+                # 如果有工具调用，执行工具
+                if tool_calls:
+                    tool_call_count += 1
                 
-                # 将工具调用转换为列表
-                tool_calls_list = [tool_calls[i] for i in sorted(tool_calls.keys())]
+                    # 将工具调用转换为列表
+                    tool_calls_list = [tool_calls[i] for i in sorted(tool_calls.keys())]
                 
-                # 记录工具调用
-                self.current_conversation['tool_calls'].extend(tool_calls_list)
+                    # 记录工具调用
+                    self.current_conversation['tool_calls'].extend(tool_calls_list)
                 
-                # 添加助手消息到历史（包含工具调用）
-                tool_call_message = {
-                    "role": "assistant",
-                    "content": full_content,
-                    "tool_calls": tool_calls_list
-                }
-                messages.append(tool_call_message)
+                    # 添加助手消息到历史（包含工具调用）
+                    tool_call_message = {
+                        "role": "assistant",
+                        "content": full_content,
+                        "tool_calls": tool_calls_list
+                    }
+                    messages.append(tool_call_message)
                 
-                # 执行所有工具调用
-                tool_responses = []
-                for tool_call in tool_calls_list:
-                    function_name = tool_call['function']['name']
-                    try:
-                        function_args = json.loads(tool_call['function']['arguments'])
-                    except json.JSONDecodeError:
-                        function_args = {}
+                    # 执行所有工具调用
+                    tool_responses = []
+                    for index, tool_call in zip(sorted(tool_calls.keys()), tool_calls_list):
+                        function_name = tool_call['function']['name']
+                        try:
+                            function_args = json.loads(tool_call['function']['arguments'])
+                        except json.JSONDecodeError:
+                            function_args = {}
                     
-                    # 执行工具
-                    tool_result = self.execute_tool(function_name, function_args)
+                        # 执行工具（已提前执行的只读工具直接取结果）
+                        future = speculative.take(index, function_name, tool_call['function']['arguments'])
+                        if future is not None:
+                            tool_result, duration = future.result()
+                        else:
+                            tool_result, duration = self._timed_execute_tool(function_name, function_args, cancel_token)
+                        status = str(tool_result.get("status", "")) if isinstance(tool_result, dict) else ""
+                        yield ToolFinished(index, function_name, self._tool_display_name(function_name),
+                                           tool_call_count, duration, status, speculative=future is not None)
 
-                    # 确保工具返回的是字典，然后正确编码
-                    if isinstance(tool_result, dict):
-                        # 如果工具执行失败，将错误信息放入content中
-                        if tool_result.get("status") == "error":
-                            # 创建包含错误信息的字典
-                            error_content = {
-                                "status": "error",
-                                "message": tool_result.get("message", "工具执行失败")
-                            }
-                            content = json.dumps(error_content, ensure_ascii=False)
+                        # 确保工具返回的是字典，然后正确编码
+                        if isinstance(tool_result, dict):
+                            # 如果工具执行失败，将错误信息放入content中
+                            if tool_result.get("status") == "error":
+                                # 创建包含错误信息的字典
+                                error_content = {
+                                    "status": "error",
+                                    "message": tool_result.get("message", "工具执行失败")
+                                }
+                                content = json.dumps(error_content, ensure_ascii=False)
+                            else:
+                                content = json.dumps(tool_result, ensure_ascii=False)
                         else:
-                            content = json.dumps(tool_result, ensure_ascii=False)
-                    else:
-                        # 如果工具返回的不是字典，转换为字符串
-                        content = str(tool_result)
+                            # 如果工具返回的不是字典，转换为字符串
+                            content = str(tool_result)
                     
-                    tool_response = {
-                        "role": "tool",
-                        "tool_call_id": tool_call['id'],
-                        "content": content
-                    }
-                    tool_responses.append(tool_response)
+                        # 超出token预算的输出只发送摘要，完整内容可通过read_tool_result查看
+                        if function_name != "read_tool_result":
+                            content = budget_tool_output(tool_result, content)
+                    
+                        tool_response = {
+                            "role": "tool",
+                            "tool_call_id": tool_call['id'],
+                            "content": content
+                        }
+                        tool_responses.append(tool_response)
                 
-                # 记录工具响应
-                self.current_conversation['tool_responses'].extend(tool_responses)
+                    # 记录工具响应
+                    self.current_conversation['tool_responses'].extend(tool_responses)
                 
-                # 添加工具响应到消息列表
-                messages.extend(tool_responses)
+                    # 添加工具响应到消息列表
+                    messages.extend(tool_responses)
                 
-                # 记录工具调用和响应的详细日志
-                self._log_tool_execution(tool_calls_list, tool_responses)
+                    # 记录工具调用和响应的详细日志
+                    self._log_tool_execution(tool_calls_list, tool_responses)
                 
-                # 显示工具执行完成提示
-                #yield "正在处理工具结果...\n"
+                    yield RoundBoundary(tool_call_count, len(tool_calls_list))
                 
-                # 如果有工具调用，继续循环处理
-                continue
-            else:
-                # 没有工具调用，添加助手消息到历史并退出循环
-                if full_content:
-                    self.add_message("assistant", full_content)
-                break
+                    # 如果有工具调用，继续循环处理
+                    continue
+                else:
+                    # 没有工具调用，添加助手消息到历史并退出循环
+                    if full_content:
+                        self.add_message("assistant", full_content)
+                    break
         
+        finally:
+            if speculative is not None:
+                speculative.close()
+
         # 如果达到最大工具调用次数，返回提示
         if tool_call_count >= max_tool_calls:
-            yield "\n已达到最大工具调用次数，对话结束。"
+            yield TextDelta("\n已达到最大工具调用次数，对话结束。")
+
+    def _handle_cancelled_turn(self, cancel_token: CancellationToken):
+        """
+        处理被取消的一轮对话
         
-        # 对话完成后，保存历史记录
+        已输出的部分回复写入对话历史和历史记录文件（标记为被打断），
+        没有任何回复时移除本轮的用户消息；被取消的对话不进行总结。
+        """
+        partial_response = self.current_conversation.get('ai_response', '')
+        if self.conversation_history and self.conversation_history[-1].get("role") == "user":
+            if partial_response:
+                self.add_message("assistant", partial_response)
+            else:
+                self.conversation_history.pop()
+                self._history_tokens.pop()
+        
+        self.current_conversation['interrupted'] = True
         self._save_conversation_history()
         
-        # 对话完成后，异步调用总结功能
-        # 获取最终的助手回复（可能包含多轮工具调用的结果）
-        final_assistant_message = self._get_final_assistant_message()
-        all_tool_calls = self._get_all_tool_calls_from_history()
-        self._summarize_conversation_async(user_message, final_assistant_message, all_tool_calls)
-
+        latency = cancel_token.elapsed_since_cancel() if cancel_token is not None else None
+        if latency is not None:
+            message = f"对话已取消，取消延迟 {latency * 1000:.0f} ms"
+        else:
+            message = "对话已取消"
+        print(message)
+        self._log_tool_info(message)
+    
     def process_message(self, user_message: str) -> str:
         """处理用户消息并返回AI回复（非流式，保持兼容性）"""
-        result = ""
-        for chunk in self.process_message_stream(user_message):
-            result += chunk
-        return result
+        return "".join(iter_text(self.process_message_stream(user_message)))
     
     def clear_history(self):
         """清空对话历史"""
         self.conversation_history = []
+        self._history_tokens = []
     
     def _get_final_assistant_message(self) -> str:
         """获取最终的助手回复消息"""
@@ -478,16 +803,10 @@ class ChatService:
         return ""
     
     def _get_all_tool_calls_from_history(self) -> List[Dict[str, Any]]:
-        """从对话历史中获取本轮对话的所有工具调用"""
-        tool_calls = []
-        # 从最后开始查找，直到遇到用户消息为止
-        for message in reversed(self.conversation_history):
-            if message.get("role") == "user":
-                break
-            elif message.get("role") == "assistant" and "tool_calls" in message:
-                # 将工具调用添加到列表开头，保持正确的顺序
-                tool_calls = message["tool_calls"] + tool_calls
-        return tool_calls
+        """获取本轮对话的所有工具调用"""
+        # 带工具调用的助手消息只在本轮请求的消息列表中，不会写入对话历史，
+        # 所以从当前对话记录中获取
+        return list(self.current_conversation.get('tool_calls', []))
     
     def _log_tool_execution(self, tool_calls: List[Dict[str, Any]], tool_responses: List[Dict[str, Any]]):
         """记录工具执行的详细日志"""
@@ -566,8 +885,6 @@ class ChatService:
             if not self.current_conversation.get('user_input') or not self.current_conversation.get('ai_response'):
                 return
             
-            with open(self.history_file, 'a', encoding='utf-8') as f:
-                json.dump(self.current_conversation, f, ensure_ascii=False)
-                f.write('\n')
+            self.history_index.append(self.current_conversation)
         except Exception as e:
             print(f"保存历史记录失败: {e}")
\ No newline at end of file
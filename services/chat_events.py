@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+对话流事件
+ChatService.process_message_stream逐个产出以下类型的事件，
+界面、命令行等消费方按类型处理，不需要再从文本中解析工具调用提示
+"""
+
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+
+class ChatEvent:
+    """对话流事件基类"""
+    pass
+
+
+@dataclass
+class TextDelta(ChatEvent):
+    """新输出的回复文本"""
+    text: str
+
+
+@dataclass
+class ToolStarted(ChatEvent):
+    """模型发起了一次工具调用（工具名首次出现在流中时产出）"""
+    index: int  # 本轮请求中的工具调用序号
+    name: str
+    display_name: str  # 界面上显示的友好名称
+    round: int  # 第几轮工具调用，从1开始
+
+
+@dataclass
+class ToolFinished(ChatEvent):
+    """工具执行完成"""
+    index: int
+    name: str
+    display_name: str
+    round: int
+    duration: float  # 工具执行耗时（秒）
+    status: str  # 工具返回的status，非字典结果为空字符串
+    speculative: bool = False  # 是否在流式输出过程中提前执行
+
+
+@dataclass
+class RoundBoundary(ChatEvent):
+    """一轮工具调用结束，接下来带着工具结果重新请求模型"""
+    round: int
+    tool_calls: int  # 本轮执行的工具数量
+
+
+@dataclass
+class Usage(ChatEvent):
+    """一次模型请求（或一次缓存回放）的用量和耗时"""
+    ttft_ms: float  # 首个数据块的延迟
+    duration_ms: float  # 请求总耗时
+    output_tokens: int  # 估算的输出token数
+    tokens_per_s: float
+    cached: bool = False  # 是否为回复缓存的回放
+
+
+def iter_text(events: Iterable[ChatEvent]) -> Iterator[str]:
+    """只取出事件流中的回复文本"""
+    for event in events:
+        if isinstance(event, TextDelta):
+            yield event.text
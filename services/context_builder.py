@@ -5,10 +5,14 @@
 """
 
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from .memory import ChatHistoryVectorDB
-from config import RAG_CONFIG, ChatConfig
+from .memory_server import create_vector_db
+from config import ChatConfig
 from datetime import datetime
+from .tracing import span
 
 class ContextBuilder:
     """上下文构建器，负责检索记忆和笔记，构建完整的系统提示词"""
@@ -21,14 +25,15 @@ class ContextBuilder:
         
         # 加载现有数据库
         self._load_databases()
+        
+        # 提前发起的检索：(查询, Future)，只保留最近一次
+        self._prefetched = None
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_executor = None
     
     def _create_custom_db(self, db_name: str) -> ChatHistoryVectorDB:
-        """创建自定义的向量数据库实例"""
-        db = ChatHistoryVectorDB(
-            RAG_config=RAG_CONFIG,
-            db_name=db_name  # 修改参数名
-        )
-        return db
+        """创建自定义的向量数据库实例（启用记忆服务时为服务客户端）"""
+        return create_vector_db(db_name)
     
     def _load_databases(self):
         """加载现有的向量数据库"""
@@ -66,46 +71,94 @@ class ContextBuilder:
             print(f"搜索笔记时出错: {e}")
             return []
     
-    def build_enhanced_system_prompt(self, user_message: str) -> str:
+    def _search(self, query: str):
+        """检索记忆和笔记，返回(记忆列表, 笔记列表)"""
+        return self._search_memory(query), self._search_notes(query)
+    
+    def prefetch_context(self, query: str):
         """
-        构建增强的系统提示词
+        在后台提前检索（例如等待图片描述的同时），之后以相同的查询调用retrieve_context时直接使用结果
         
         参数:
-            user_message: 用户输入消息，用作检索查询
+            query: 检索查询，通常是用户输入
+        """
+        with self._prefetch_lock:
+            if self._prefetched is not None and self._prefetched[0] == query:
+                return
+            if self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context_prefetch")
+            self._prefetched = (query, self._prefetch_executor.submit(self._search, query))
+    
+    def _take_prefetched(self, query: str):
+        """取出与查询对应的提前检索，没有时返回None"""
+        with self._prefetch_lock:
+            if self._prefetched is None or self._prefetched[0] != query:
+                return None
+            future = self._prefetched[1]
+            self._prefetched = None
+            return future
+    
+    def retrieve_context(self, query: str) -> dict:
+        """
+        检索与查询相关的记忆和笔记
+        
+        参数:
+            query: 检索查询，通常是用户输入
             
         返回:
-            增强后的系统提示词
+            {"memories": [...], "notes": [...]}
         """
-        # 基础系统提示词
-        enhanced_prompt = ChatConfig.system_prompt
-        
-        # 搜索相关记忆
-        relevant_memories = self._search_memory(user_message)
-        
-        # 搜索相关笔记
-        relevant_notes = self._search_notes(user_message)
+        future = self._take_prefetched(query)
+        with span("retrieve_context", prefetched=future is not None) as s:
+            result = None
+            if future is not None:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"提前检索失败，重新检索: {e}")
+            if result is None:
+                result = self._search(query)
+            relevant_memories, relevant_notes = result
+            s.set(memories=len(relevant_memories), notes=len(relevant_notes))
         
         # 保存相关笔记供总结时使用
         set_current_relevant_notes(relevant_notes)
-
+        
+        return {"memories": relevant_memories, "notes": relevant_notes}
+    
+    def embed_query(self, query: str):
+        """计算查询的归一化嵌入向量，失败时返回None（与检索共用嵌入缓存）"""
+        return self.memory_db.embed(query)
+    
+    def build_static_prompt(self) -> str:
+        """构建每轮都不变的系统提示词（人设部分）"""
+        return ChatConfig.system_prompt
+    
+    def build_volatile_context(self, retrieved: dict) -> str:
+        """
+        构建每轮都会变化的上下文（当前时间、相关记忆和笔记）
+        
+        参数:
+            retrieved: retrieve_context的返回值
+        """
         # 获取当前时间并格式化
         current_time = datetime.now()
         formatted_time = current_time.strftime("[%Y-%m-%d %H:%M:%S]")
-        enhanced_prompt+="\n现在的时间："+formatted_time
-
+        context = "现在的时间：" + formatted_time
+        
         # 添加相关记忆
-        if relevant_memories:
-            enhanced_prompt += "\n\n以下是相关的记忆（如有）：\n```\n"
-            enhanced_prompt += "\n".join(relevant_memories)
-            enhanced_prompt += "\n```"
+        if retrieved.get("memories"):
+            context += "\n\n以下是相关的记忆（如有）：\n```\n"
+            context += "\n".join(retrieved["memories"])
+            context += "\n```"
         
         # 添加相关笔记
-        if relevant_notes:
-            enhanced_prompt += "\n\n以下是相关笔记（如有）：\n```\n"
-            enhanced_prompt += "\n".join(relevant_notes)
-            enhanced_prompt += "\n```"
+        if retrieved.get("notes"):
+            context += "\n\n以下是相关笔记（如有）：\n```\n"
+            context += "\n".join(retrieved["notes"])
+            context += "\n```"
         
-        return enhanced_prompt
+        return context
 
 
 # 全局上下文构建器实例
@@ -137,8 +190,10 @@ if __name__ == "__main__":
     # 测试上下文构建功能
     builder = ContextBuilder()
     
-    # 测试构建增强提示词
+    # 测试构建提示词：人设部分和检索到的上下文
     user_input = "帮我查看文件"
-    enhanced_prompt = builder.build_enhanced_system_prompt(user_input)
-    print("增强后的系统提示词:")
-    print(enhanced_prompt)
\ No newline at end of file
+    retrieved = builder.retrieve_context(user_input)
+    print("系统提示词:")
+    print(builder.build_static_prompt())
+    print("检索到的上下文:")
+    print(builder.build_volatile_context(retrieved))
\ No newline at end of file
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+API端点池
+管理多组BASE_URL/API_KEY，按观测到的延迟和错误率为每个请求选择端点，
+每个密钥有并发上限和熔断器，端点出错时自动切换到下一个端点
+
+端点通过环境变量API_ENDPOINTS配置，多个端点用逗号分隔，每个端点格式为
+    base_url|api_key[|最大并发数]
+未配置时使用BASE_URL和API_KEY作为唯一端点
+"""
+
+import os
+import time
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+import requests
+from dotenv import load_dotenv
+from config import EndpointConfig
+
+
+# 这些状态码说明是端点本身的问题（限流、密钥失效、服务异常），换一个端点可能成功
+FAILOVER_STATUS_CODES = {401, 402, 403, 408, 429, 500, 502, 503, 504}
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """判断异常是否应计为端点故障（并触发切换）"""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if status in FAILOVER_STATUS_CODES:
+        return True
+    # openai库的连接/超时异常没有状态码
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+
+class Endpoint:
+    """单个API端点（一组base_url和api_key）及其统计信息"""
+
+    def __init__(self, base_url: str, api_key: str, max_concurrency: int = EndpointConfig.MAX_CONCURRENCY_PER_KEY):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        # 指数加权的延迟（秒）和错误率
+        self.latency = None
+        self.error_rate = 0.0
+        # 熔断器状态
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.half_open_trial = False
+
+    @property
+    def name(self) -> str:
+        """用于日志的名称（隐藏大部分密钥）"""
+        key = self.api_key or ''
+        return f"{self.base_url} ({key[:5]}…{key[-4:]})" if len(key) > 12 else self.base_url
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def is_available(self, now: float) -> bool:
+        """熔断器关闭，或已过冷却时间且没有正在进行的半开试探"""
+        if self.open_until <= now and not self.half_open_trial:
+            return self.in_flight < self.max_concurrency
+        return False
+
+    def score(self) -> float:
+        """越小越优先：延迟 ×（1 + 错误惩罚）×（1 + 当前负载）"""
+        latency = self.latency if self.latency is not None else EndpointConfig.INITIAL_LATENCY
+        return (latency * (1 + EndpointConfig.ERROR_PENALTY * self.error_rate)
+                * (1 + self.in_flight / self.max_concurrency))
+
+    def record_success(self, latency: Optional[float], trial: bool = False):
+        alpha = EndpointConfig.EWMA_ALPHA
+        if latency is not None:
+            self.latency = latency if self.latency is None else alpha * latency + (1 - alpha) * self.latency
+        self.error_rate = (1 - alpha) * self.error_rate
+        self.consecutive_failures = 0
+        # 只有半开试探成功才关闭熔断器，熔断前发出的请求迟到的成功不算
+        if trial:
+            self.open_until = 0.0
+
+    def record_failure(self, trial: bool = False):
+        alpha = EndpointConfig.EWMA_ALPHA
+        self.error_rate = alpha + (1 - alpha) * self.error_rate
+        self.consecutive_failures += 1
+        if trial or self.consecutive_failures >= EndpointConfig.CIRCUIT_FAILURE_THRESHOLD:
+            self.open_until = time.monotonic() + EndpointConfig.CIRCUIT_RESET_SECONDS
+            print(f"端点 {self.name} 熔断 {EndpointConfig.CIRCUIT_RESET_SECONDS} 秒")
+
+
+class EndpointPool:
+    """按延迟和错误率路由请求的端点池"""
+
+    def __init__(self, endpoints: List[Endpoint]):
+        self.endpoints = endpoints
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls) -> 'EndpointPool':
+        """从环境变量API_ENDPOINTS（或BASE_URL/API_KEY）创建端点池"""
+        load_dotenv()
+        endpoints = []
+        for item in os.getenv('API_ENDPOINTS', '').split(','):
+            parts = [part.strip() for part in item.split('|')]
+            if len(parts) < 2 or not parts[0] or not parts[1]:
+                continue
+            try:
+                max_concurrency = int(parts[2]) if len(parts) > 2 and parts[2] else EndpointConfig.MAX_CONCURRENCY_PER_KEY
+            except ValueError:
+                max_concurrency = EndpointConfig.MAX_CONCURRENCY_PER_KEY
+            endpoints.append(Endpoint(parts[0], parts[1], max(1, max_concurrency)))
+
+        if not endpoints and os.getenv('API_KEY'):
+            endpoints.append(Endpoint(os.getenv('BASE_URL', 'https://api.siliconflow.cn/v1'), os.getenv('API_KEY')))
+        return cls(endpoints)
+
+    def acquire(self, exclude: List[Endpoint] = (),
+                timeout: float = EndpointConfig.ACQUIRE_TIMEOUT) -> Optional[Tuple[Endpoint, bool]]:
+        """
+        选择得分最优的可用端点并占用一个并发名额
+
+        所有端点都在并发上限或都已熔断时等待，直到有端点空出名额或过了冷却时间；
+        冷却结束后只放行一个遵守并发上限的半开试探请求。
+
+        返回:
+            (端点, 是否为半开试探)，没有可选端点（都已被排除）或等待超时时返回None
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                candidates = [e for e in self.endpoints if e not in exclude]
+                if not candidates:
+                    return None
+                now = time.monotonic()
+                available = [e for e in candidates if e.is_available(now)]
+                if available:
+                    endpoint = min(available, key=lambda e: e.score())
+                    trial = endpoint.open_until > 0
+                    endpoint.half_open_trial = trial
+                    endpoint.in_flight += 1
+                    return endpoint, trial
+                remaining = deadline - now
+                if remaining <= 0:
+                    return None
+                wait = min(remaining, 0.5)
+                # 全部熔断时等到最早恢复的端点冷却结束
+                recovering = [e.open_until - now for e in candidates if e.open_until > now]
+                if recovering:
+                    wait = min(wait, max(min(recovering), 0.01))
+                self._condition.wait(wait)
+
+    def release(self, endpoint: Endpoint, latency: Optional[float] = None, failed: bool = False,
+                trial: bool = False):
+        """
+        归还并发名额并记录结果
+
+        参数:
+            endpoint: acquire返回的端点
+            latency: 成功时的延迟（秒）
+            failed: 是否计为端点故障
+            trial: acquire返回的是否为半开试探
+        """
+        with self._condition:
+            endpoint.in_flight -= 1
+            if failed:
+                endpoint.record_failure(trial)
+            else:
+                endpoint.record_success(latency, trial)
+            if trial:
+                endpoint.half_open_trial = False
+            self._condition.notify_all()
+
+    def call(self, func: Callable[[Endpoint], Any]) -> Any:
+        """
+        在选出的端点上执行func(endpoint)，端点故障时切换到下一个端点重试
+
+        异常:
+            func抛出的非端点故障异常原样抛出；所有端点都失败时抛出最后一个异常
+        """
+        tried = []
+        last_error = RuntimeError("没有可用的API端点")
+        while True:
+            acquired = self.acquire(exclude=tried)
+            if acquired is None:
+                raise last_error
+            endpoint, trial = acquired
+            tried.append(endpoint)
+            started = time.perf_counter()
+            try:
+                result = func(endpoint)
+            except Exception as e:
+                failed = is_endpoint_failure(e)
+                self.release(endpoint, failed=failed, trial=trial)
+                if not failed:
+                    raise
+                last_error = e
+                print(f"端点 {endpoint.name} 请求失败，切换端点: {e}")
+                continue
+            self.release(endpoint, latency=time.perf_counter() - started, trial=trial)
+            return result
+
+    def post(self, path: str, stream: bool = False, **kwargs) -> requests.Response:
+        """
+        向选出的端点发送POST请求，自动添加认证头
+
+        端点返回限流/服务异常等状态码时切换到下一个端点；最后一个端点的响应原样返回，
+        由调用方raise_for_status。stream=True时并发名额在响应关闭时才归还。
+
+        参数:
+            path: 相对base_url的路径，例如"/chat/completions"
+            stream: 是否为流式请求
+            **kwargs: 传给requests.post的其他参数（json、timeout等）
+        """
+        tried = []
+        last_response = None
+        last_error = RuntimeError("没有可用的API端点")
+        while True:
+            acquired = self.acquire(exclude=tried)
+            if acquired is None:
+                if last_response is not None:
+                    return last_response
+                raise last_error
+            endpoint, trial = acquired
+            tried.append(endpoint)
+            if last_response is not None:
+                last_response.close()
+                last_response = None
+
+            started = time.perf_counter()
+            try:
+                response = requests.post(endpoint.base_url + path, headers=endpoint.headers,
+                                         stream=stream, **kwargs)
+            except Exception as e:
+                failed = is_endpoint_failure(e)
+                self.release(endpoint, failed=failed, trial=trial)
+                if not failed:
+                    raise
+                last_error = e
+                print(f"端点 {endpoint.name} 请求失败，切换端点: {e}")
+                continue
+
+            if response.status_code in FAILOVER_STATUS_CODES:
+                self.release(endpoint, failed=True, trial=trial)
+                print(f"端点 {endpoint.name} 返回 {response.status_code}，切换端点")
+                last_response = response
+                continue
+
+            # 流式响应：收到响应头的时间作为延迟，连接关闭时才归还并发名额
+            latency = time.perf_counter() - started
+            if stream:
+                self._release_on_close(response, endpoint, latency, trial)
+            else:
+                self.release(endpoint, latency=latency, trial=trial)
+            return response
+
+    def _release_on_close(self, response: requests.Response, endpoint: Endpoint, latency: float, trial: bool):
+        """响应关闭时归还端点的并发名额（只归还一次）"""
+        original_close = response.close
+        released = threading.Event()
+
+        def close():
+            try:
+                original_close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self.release(endpoint, latency=latency, trial=trial)
+
+        response.close = close
+
+    def describe(self) -> str:
+        """各端点状态文本"""
+        lines = []
+        now = time.monotonic()
+        for e in self.endpoints:
+            latency = f"{e.latency:.2f}s" if e.latency is not None else "-"
+            state = "熔断" if e.open_until > now else "正常"
+            lines.append(f"{e.name}: 延迟 {latency}，错误率 {e.error_rate:.1%}，"
+                         f"并发 {e.in_flight}/{e.max_concurrency}，{state}")
+        return "\n".join(lines)
+
+
+# 全局端点池实例
+_endpoint_pool = None
+_endpoint_pool_lock = threading.Lock()
+
+def get_endpoint_pool() -> EndpointPool:
+    """获取全局端点池实例"""
+    global _endpoint_pool
+    if _endpoint_pool is None:
+        with _endpoint_pool_lock:
+            if _endpoint_pool is None:
+                _endpoint_pool = EndpointPool.from_env()
+    return _endpoint_pool
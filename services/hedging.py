@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+流式请求的对冲与重试
+首字节（第一行SSE数据）迟迟不到时，按最近TTFT分布的分位数发出一个重复请求，
+先出数据的一方胜出，另一方的连接立即关闭；429/5xx等暂时性错误按带抖动的指数退避重试
+"""
+
+import math
+import time
+import queue
+import random
+import threading
+from collections import deque
+from typing import Callable, Iterator, Optional
+import requests
+from config import ChatConfig
+from .cancellation import CancellationToken, CancelledError
+
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class RollingHistogram:
+    """
+    滚动窗口内的延迟直方图
+
+    桶按对数间隔划分（每个数量级BUCKETS_PER_DECADE个桶），只保留最近window个样本，
+    分位数返回所在桶的上界
+    """
+
+    BUCKETS_PER_DECADE = 10
+    MIN_VALUE = 0.01  # 秒
+    MAX_VALUE = 600.0
+
+    def __init__(self, window: int = ChatConfig.TTFT_WINDOW):
+        decades = math.log10(self.MAX_VALUE / self.MIN_VALUE)
+        self.bucket_count = int(math.ceil(decades * self.BUCKETS_PER_DECADE)) + 1
+        self.counts = [0] * self.bucket_count
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _bucket(self, value: float) -> int:
+        value = min(max(value, self.MIN_VALUE), self.MAX_VALUE)
+        index = int(math.log10(value / self.MIN_VALUE) * self.BUCKETS_PER_DECADE)
+        return min(index, self.bucket_count - 1)
+
+    def _upper_bound(self, bucket: int) -> float:
+        return self.MIN_VALUE * 10 ** ((bucket + 1) / self.BUCKETS_PER_DECADE)
+
+    def record(self, value: float):
+        """记录一个样本（秒），超出窗口的最旧样本会被移出"""
+        bucket = self._bucket(value)
+        with self._lock:
+            if len(self.samples) == self.samples.maxlen:
+                self.counts[self.samples[0]] -= 1
+            self.samples.append(bucket)
+            self.counts[bucket] += 1
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        计算分位数
+
+        参数:
+            p: 0~1之间的分位
+
+        返回:
+            分位数（秒），没有样本时返回None
+        """
+        with self._lock:
+            total = len(self.samples)
+            if total == 0:
+                return None
+            target = max(1, math.ceil(p * total))
+            seen = 0
+            for bucket, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return self._upper_bound(bucket)
+        return self.MAX_VALUE
+
+
+class HedgedStream:
+    """胜出的流式响应，第一行数据已经读出"""
+
+    def __init__(self, response: requests.Response, first_line: Optional[bytes], lines: Iterator[bytes],
+                 ttft: float, hedged: bool):
+        self.response = response
+        self.ttft = ttft
+        self.hedged = hedged
+        self._first_line = first_line
+        self._lines = lines
+
+    def iter_lines(self) -> Iterator[bytes]:
+        """依次返回响应中的各行（包括已经读出的第一行）"""
+        if self._first_line is not None:
+            yield self._first_line
+        yield from self._lines
+
+    def close(self):
+        self.response.close()
+
+
+def hedge_delay(histogram: RollingHistogram) -> float:
+    """根据最近的TTFT分布计算发出对冲请求前的等待时间"""
+    delay = None
+    if len(histogram) >= ChatConfig.HEDGE_MIN_SAMPLES:
+        delay = histogram.percentile(ChatConfig.HEDGE_PERCENTILE)
+    if delay is None:
+        delay = ChatConfig.HEDGE_INITIAL_DELAY
+    return min(max(delay, ChatConfig.HEDGE_MIN_DELAY), ChatConfig.HEDGE_MAX_DELAY)
+
+
+def retry_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """
+    计算第attempt次重试前的等待时间
+
+    优先使用响应的Retry-After（秒数形式），否则按指数退避并加入±50%的随机抖动
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), ChatConfig.RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+    delay = min(ChatConfig.RETRY_MAX_DELAY, ChatConfig.RETRY_BASE_DELAY * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _race(send: Callable[[], requests.Response], histogram: RollingHistogram,
+          cancel_token: Optional[CancellationToken]) -> HedgedStream:
+    """发出请求，超过对冲等待时间仍无首字节时再发一个，返回先出数据的流"""
+    results = queue.Queue()
+    responses = []
+    lock = threading.Lock()
+    state = {"finished": False}
+
+    def close_all():
+        with lock:
+            state["finished"] = True
+            pending_responses = list(responses)
+        for response in pending_responses:
+            response.close()
+
+    def attempt(hedged: bool):
+        started = time.perf_counter()
+        try:
+            response = send()
+            with lock:
+                if state["finished"]:
+                    # 比赛已经结束，这个连接不再需要
+                    response.close()
+                    return
+                responses.append(response)
+            response.raise_for_status()
+            lines = response.iter_lines()
+            first_line = None
+            for line in lines:
+                if line:
+                    first_line = line
+                    break
+            results.put((response, first_line, lines, time.perf_counter() - started, hedged, None))
+        except Exception as e:
+            results.put((None, None, None, 0.0, hedged, e))
+
+    def start(hedged: bool):
+        threading.Thread(target=attempt, args=(hedged,), daemon=True).start()
+
+    delay = hedge_delay(histogram) if ChatConfig.HEDGE_ENABLED else None
+    deadline = time.perf_counter() + delay if delay is not None else None
+    hedged = False
+    pending = 1
+    error = None
+
+    if cancel_token is not None:
+        cancel_token.register(close_all)
+    start(False)
+    try:
+        while pending:
+            try:
+                item = results.get(timeout=0.05)
+            except queue.Empty:
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise CancelledError("请求已被取消")
+                if not hedged and deadline is not None and time.perf_counter() >= deadline:
+                    print(f"{delay:.1f}秒内没有收到首字节，发出对冲请求")
+                    hedged = True
+                    pending += 1
+                    start(True)
+                continue
+
+            pending -= 1
+            response, first_line, lines, ttft, is_hedge, error = item
+            if error is not None:
+                continue
+
+            # 胜出：关闭其余连接
+            with lock:
+                state["finished"] = True
+                losers = [r for r in responses if r is not response]
+            for loser in losers:
+                loser.close()
+            histogram.record(ttft)
+            if is_hedge:
+                print(f"对冲请求胜出，TTFT {ttft:.2f}秒")
+            return HedgedStream(response, first_line, lines, ttft, is_hedge)
+
+        if cancel_token is not None and cancel_token.cancelled:
+            raise CancelledError("请求已被取消")
+        raise error
+    except BaseException:
+        close_all()
+        raise
+    finally:
+        if cancel_token is not None:
+            cancel_token.unregister(close_all)
+
+
+def open_stream(send: Callable[[], requests.Response], histogram: RollingHistogram,
+                cancel_token: Optional[CancellationToken] = None) -> HedgedStream:
+    """
+    打开流式响应：对冲首字节过慢的请求，暂时性错误按指数退避重试
+
+    参数:
+        send: 发出一次请求并返回requests.Response（stream=True）的函数，可能被并发调用
+        histogram: TTFT直方图，胜出请求的TTFT会记录进去
+        cancel_token: 取消令牌，取消时关闭所有连接并抛出CancelledError
+
+    异常:
+        requests.RequestException: 重试次数用尽或遇到不可重试的错误
+        CancelledError: 被取消
+    """
+    max_attempts = ChatConfig.RETRY_MAX_ATTEMPTS
+    for attempt in range(max_attempts + 1):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        try:
+            return _race(send, histogram, cancel_token)
+        except requests.HTTPError as e:
+            response = e.response
+            if response is None or response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_attempts:
+                raise
+            delay = retry_delay(attempt, response)
+            reason = f"HTTP {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_attempts:
+                raise
+            delay = retry_delay(attempt)
+            reason = type(e).__name__
+
+        print(f"请求失败（{reason}），{delay:.1f}秒后第{attempt + 1}次重试")
+        if cancel_token is not None:
+            if cancel_token.wait(delay):
+                raise CancelledError("请求已被取消")
+        else:
+            time.sleep(delay)
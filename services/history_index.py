@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+历史记录偏移索引
+为data/history.jsonl维护一个旁路索引文件（.idx），记录每一行的起始字节偏移，
+从而可以按行号直接定位，从最新的记录开始倒序分页读取，打开历史记录的耗时与总条数无关
+
+索引文件格式（小端序uint64）：
+    [已索引到的历史文件字节数][第0行偏移][第1行偏移]...
+"""
+
+import os
+import json
+import struct
+import threading
+from typing import Any, Dict, List, Optional
+
+
+_UINT64 = struct.Struct('<Q')
+
+
+class HistoryIndex:
+    """history.jsonl的行偏移索引"""
+
+    def __init__(self, history_file: str, index_file: Optional[str] = None):
+        self.history_file = history_file
+        self.index_file = index_file or history_file + ".idx"
+        self._lock = threading.Lock()
+
+    def _read_covered(self, index) -> int:
+        index.seek(0)
+        data = index.read(_UINT64.size)
+        return _UINT64.unpack(data)[0] if len(data) == _UINT64.size else -1
+
+    def _write_covered(self, index, covered: int):
+        index.seek(0)
+        index.write(_UINT64.pack(covered))
+
+    def _scan(self, index, start: int) -> int:
+        """从历史文件的start位置开始扫描完整的行并追加到索引，返回新的已索引字节数"""
+        covered = start
+        offsets = []
+        with open(self.history_file, 'rb') as history:
+            history.seek(start)
+            position = start
+            for line in history:
+                if not line.endswith(b'\n'):
+                    break  # 最后一行还没写完，下次再索引
+                if line.strip():
+                    offsets.append(position)
+                position += len(line)
+                covered = position
+
+        index.seek(0, os.SEEK_END)
+        index.write(b''.join(_UINT64.pack(offset) for offset in offsets))
+        self._write_covered(index, covered)
+        return covered
+
+    def refresh(self) -> int:
+        """
+        使索引与历史文件同步
+
+        历史文件有新增内容时只扫描新增部分；历史文件被截断或改写、索引损坏时重建索引
+
+        返回:
+            记录条数
+        """
+        with self._lock:
+            if not os.path.exists(self.history_file):
+                return 0
+            size = os.path.getsize(self.history_file)
+            mode = 'r+b' if os.path.exists(self.index_file) else 'w+b'
+            with open(self.index_file, mode) as index:
+                covered = self._read_covered(index)
+                index_size = index.seek(0, os.SEEK_END)
+                if covered < 0 or covered > size or (index_size - _UINT64.size) % _UINT64.size:
+                    # 索引过期或损坏，重建
+                    index.seek(0)
+                    index.truncate()
+                    self._write_covered(index, 0)
+                    covered = 0
+                if covered < size:
+                    self._scan(index, covered)
+                return (index.seek(0, os.SEEK_END) - _UINT64.size) // _UINT64.size
+
+    def append(self, record: Dict[str, Any]):
+        """追加一条记录到历史文件并更新索引"""
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        with self._lock:
+            os.makedirs(os.path.dirname(self.history_file) or '.', exist_ok=True)
+            with open(self.history_file, 'ab') as history:
+                offset = history.seek(0, os.SEEK_END)
+                history.write(line)
+
+            if not os.path.exists(self.index_file):
+                return  # 下次读取时会完整建立索引
+            with open(self.index_file, 'r+b') as index:
+                if self._read_covered(index) != offset:
+                    return  # 索引落后于历史文件，下次读取时补齐
+                index.seek(0, os.SEEK_END)
+                index.write(_UINT64.pack(offset))
+                self._write_covered(index, offset + len(line))
+
+    def _read_offsets(self, first: int, count: int) -> List[int]:
+        """读取第first行开始的count个偏移"""
+        with open(self.index_file, 'rb') as index:
+            index.seek(_UINT64.size * (first + 1))
+            data = index.read(_UINT64.size * count)
+        return [_UINT64.unpack_from(data, i)[0] for i in range(0, len(data) - _UINT64.size + 1, _UINT64.size)]
+
+    def read_lines(self, first: int, count: int) -> List[bytes]:
+        """读取第first行开始的count行原始内容（不解码）"""
+        if count <= 0:
+            return []
+        with self._lock:
+            offsets = self._read_offsets(first, count)
+            lines = []
+            with open(self.history_file, 'rb') as history:
+                for offset in offsets:
+                    history.seek(offset)
+                    lines.append(history.readline())
+        return lines
+
+    def read_reverse(self, skip: int, count: int, total: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        从最新的记录开始倒序分页读取
+
+        参数:
+            skip: 跳过最新的多少条
+            count: 读取条数
+            total: 记录总数（refresh的返回值），为None时重新获取
+
+        返回:
+            记录列表，最新的在前；无法解析的行会被跳过
+        """
+        if total is None:
+            total = self.refresh()
+        end = total - skip
+        first = max(0, end - count)
+        records = []
+        for line in reversed(self.read_lines(first, end - first)):
+            try:
+                records.append(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+        return records
+
+
+# 每个历史文件一个索引实例，保证同一进程内的读写共用一把锁
+_indexes: Dict[str, HistoryIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_history_index(history_file: str = "data/history.jsonl") -> HistoryIndex:
+    """获取历史文件对应的全局索引实例"""
+    key = os.path.abspath(history_file)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = HistoryIndex(history_file)
+        return _indexes[key]
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+VLM上传前的图片预处理
+裁掉纯色边框、缩放到模型能利用的最大分辨率，并按内容选择编码：
+照片类图片用JPEG，文字/界面截图用PNG。编码结果按QPixmap.cacheKey缓存，重复发送同一张图不再重新编码；
+同时计算处理后图片的64位差值哈希(dHash)和编码结果的摘要，用于图片描述缓存的匹配
+
+只使用QImage（可以在非UI线程中处理），安装了Pillow时用Pillow做裁剪、缩放和编码，否则退回Qt实现
+"""
+
+import io
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+from PyQt5.QtCore import Qt, QBuffer, QIODevice
+from PyQt5.QtGui import QImage, qGray
+from config import VisionConfig
+
+try:
+    from PIL import Image, ImageChops
+except ImportError:
+    Image = None
+
+
+class PreprocessedImage:
+    """预处理后的图片"""
+
+    def __init__(self, data: bytes, mime_type: str, width: int, height: int, original_size: tuple, dhash: int):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.original_size = original_size
+        self.dhash = dhash  # 64位差值哈希
+        self.digest = hashlib.sha1(data).hexdigest()  # 编码结果的摘要
+
+    @property
+    def is_photo(self) -> bool:
+        """照片类图片（JPEG编码）；文字/界面截图用PNG编码"""
+        return self.mime_type == "image/jpeg"
+
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode('utf-8')
+
+    def data_url(self) -> str:
+        """用于image_url的data URL"""
+        return f"data:{self.mime_type};base64,{self.base64()}"
+
+    def describe(self) -> str:
+        return (f"{self.original_size[0]}x{self.original_size[1]} -> {self.width}x{self.height} "
+                f"{self.mime_type}, {len(self.data) / 1024:.1f} KB")
+
+
+def _dhash_from_pixels(pixels) -> int:
+    """由9x8的灰度像素（按行排列）计算差值哈希：每行相邻像素比较得到8位"""
+    value = 0
+    for y in range(8):
+        row = pixels[y * 9:(y + 1) * 9]
+        for x in range(8):
+            value = (value << 1) | (1 if row[x] > row[x + 1] else 0)
+    return value
+
+
+# ---------------- Pillow实现 ----------------
+
+def _qimage_to_pil(image: QImage):
+    image = image.convertToFormat(QImage.Format_RGBA8888)
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    pil = Image.frombuffer("RGBA", (image.width(), image.height()), bytes(bits),
+                           "raw", "RGBA", image.bytesPerLine(), 1)
+    return pil.convert("RGB")
+
+
+def _preprocess_pil(image: QImage) -> PreprocessedImage:
+    pil = _qimage_to_pil(image)
+    original_size = pil.size
+
+    if VisionConfig.AUTOCROP_ENABLED:
+        background = Image.new(pil.mode, pil.size, pil.getpixel((0, 0)))
+        tolerance = VisionConfig.AUTOCROP_TOLERANCE
+        diff = ImageChops.difference(pil, background).convert("L").point(lambda v: 255 if v > tolerance else 0)
+        bbox = diff.getbbox()
+        if bbox and bbox != (0, 0) + pil.size:
+            pil = pil.crop(bbox)
+
+    max_side = VisionConfig.MAX_IMAGE_SIDE
+    if max(pil.size) > max_side:
+        pil.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    thumbnail = pil.copy()
+    thumbnail.thumbnail((64, 64))
+    is_photo = thumbnail.getcolors(VisionConfig.PHOTO_COLOR_THRESHOLD) is None
+
+    dhash = _dhash_from_pixels(list(pil.convert("L").resize((9, 8), Image.LANCZOS).getdata()))
+
+    buffer = io.BytesIO()
+    if is_photo:
+        pil.save(buffer, "JPEG", quality=VisionConfig.JPEG_QUALITY, optimize=True)
+        mime_type = "image/jpeg"
+    else:
+        pil.save(buffer, "PNG", optimize=True)
+        mime_type = "image/png"
+    return PreprocessedImage(buffer.getvalue(), mime_type, pil.width, pil.height, original_size, dhash)
+
+
+# ---------------- Qt实现 ----------------
+
+def _channel_distance(a: int, b: int) -> int:
+    """两个ARGB像素的最大通道差"""
+    return max(abs(((a >> shift) & 0xFF) - ((b >> shift) & 0xFF)) for shift in (0, 8, 16))
+
+
+def _autocrop_qt(image: QImage) -> QImage:
+    """在缩小的图上找出非边框内容的范围，再映射回原图裁剪"""
+    small = image.scaled(200, 200, Qt.KeepAspectRatio, Qt.FastTransformation)
+    background = image.pixel(0, 0)
+    tolerance = VisionConfig.AUTOCROP_TOLERANCE
+    left, top, right, bottom = small.width(), small.height(), -1, -1
+    for y in range(small.height()):
+        for x in range(small.width()):
+            if _channel_distance(small.pixel(x, y), background) > tolerance:
+                left, right = min(left, x), max(right, x)
+                top, bottom = min(top, y), max(bottom, y)
+    if right < 0:
+        return image
+
+    # 向外多留一个缩略像素，避免缩放误差裁掉内容
+    scale_x = image.width() / small.width()
+    scale_y = image.height() / small.height()
+    x0 = max(0, int((left - 1) * scale_x))
+    y0 = max(0, int((top - 1) * scale_y))
+    x1 = min(image.width(), int((right + 2) * scale_x))
+    y1 = min(image.height(), int((bottom + 2) * scale_y))
+    if (x0, y0, x1, y1) == (0, 0, image.width(), image.height()):
+        return image
+    return image.copy(x0, y0, x1 - x0, y1 - y0)
+
+
+def _preprocess_qt(image: QImage) -> PreprocessedImage:
+    original_size = (image.width(), image.height())
+
+    if VisionConfig.AUTOCROP_ENABLED:
+        image = _autocrop_qt(image)
+
+    max_side = VisionConfig.MAX_IMAGE_SIDE
+    if max(image.width(), image.height()) > max_side:
+        image = image.scaled(max_side, max_side, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    thumbnail = image.scaled(64, 64, Qt.KeepAspectRatio, Qt.FastTransformation)
+    colors = {thumbnail.pixel(x, y) for y in range(thumbnail.height()) for x in range(thumbnail.width())}
+    is_photo = len(colors) > VisionConfig.PHOTO_COLOR_THRESHOLD
+
+    small = image.scaled(9, 8, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    dhash = _dhash_from_pixels([qGray(small.pixel(x, y)) for y in range(8) for x in range(9)])
+
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    if is_photo:
+        image.save(buffer, "JPG", VisionConfig.JPEG_QUALITY)
+        mime_type = "image/jpeg"
+    else:
+        image.save(buffer, "PNG")
+        mime_type = "image/png"
+    data = bytes(buffer.data())
+    buffer.close()
+    return PreprocessedImage(data, mime_type, image.width(), image.height(), original_size, dhash)
+
+
+# ---------------- 入口 ----------------
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def preprocess_image(image: QImage, cache_key: Optional[int] = None) -> PreprocessedImage:
+    """
+    预处理图片（可以在非UI线程中调用）
+
+    参数:
+        image: 原始图片（QPixmap请在UI线程中先调用toImage）
+        cache_key: 缓存键，通常是原QPixmap的cacheKey()；为None时不缓存
+
+    返回:
+        PreprocessedImage
+    """
+    if cache_key is not None:
+        with _cache_lock:
+            if cache_key in _cache:
+                _cache.move_to_end(cache_key)
+                return _cache[cache_key]
+
+    result = _preprocess_pil(image) if Image is not None else _preprocess_qt(image)
+
+    if cache_key is not None:
+        with _cache_lock:
+            _cache[cache_key] = result
+            while len(_cache) > VisionConfig.PREPROCESS_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return result
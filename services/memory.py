@@ -2,6 +2,7 @@ import json
 import os
 import signal
 import logging
+import threading
 from datetime import datetime
 import traceback
 from dotenv import load_dotenv
@@ -74,6 +75,50 @@ class ChatHistoryVectorDB:
         """
         self.rag.add(text)
     
+    def embed(self, text: str):
+        """
+        计算文本的归一化嵌入向量
+        
+        参数:
+            text: 要嵌入的文本
+            
+        返回:
+            归一化后的向量（list），嵌入模块不可用或失败时返回None
+        """
+        recall = self.rag.retriever.recall_dict.get('Cosine_Similarity')
+        if recall is None:
+            return None
+        try:
+            vectors = recall.embed(text)
+            if not vectors:
+                return None
+            vector = vectors[0]
+            norm = sum(x * x for x in vector) ** 0.5
+            return [x / norm for x in vector] if norm else None
+        except Exception as e:
+            self.logger.error(f"计算嵌入向量失败: {e}")
+            return None
+    
+    def max_recent_similarity(self, text: str, recent: int = 50):
+        """
+        计算文本与最近添加的若干条记录的最大余弦相似度
+        
+        参数:
+            text: 要比较的文本
+            recent: 参与比较的最近记录数量
+            
+        返回:
+            最大相似度，数据库为空或嵌入失败时返回None
+        """
+        recall = self.rag.retriever.recall_dict.get('Cosine_Similarity')
+        if recall is None or not recall.vectors:
+            return None
+        vector = self.embed(text)
+        if vector is None:
+            return None
+        # 库中的向量已归一化，点积即余弦相似度
+        return max(sum(a * b for a, b in zip(vector, stored)) for stored in recall.vectors[-recent:])
+    
     def search(self, query: str, top_k: int = 5, timeout: int = 10):
         """
         搜索与查询文本最相似的文本（带超时）
@@ -90,8 +135,9 @@ class ChatHistoryVectorDB:
             TimeoutError: 当操作超时时
         """
         
-        # 设置超时处理（仅在非Windows系统上）
-        if os.name != 'nt':  # 非Windows系统
+        # 设置超时处理（仅在非Windows系统的主线程上，信号只能在主线程设置）
+        use_alarm = os.name != 'nt' and threading.current_thread() is threading.main_thread()
+        if use_alarm:
             signal.signal(signal.SIGALRM, timeout_handler)
             signal.alarm(timeout)
         
@@ -121,11 +167,11 @@ class ChatHistoryVectorDB:
             self.logger.warning(f"记忆检索超时 ({timeout}秒)")
             return []
         finally:
-            # 取消超时设置（仅在非Windows系统上）
-            if os.name != 'nt':
+            # 取消超时设置
+            if use_alarm:
                 signal.alarm(0)
 
-    def remove_by_query(self, query: str, threshold: float = None, max_remove_count: int = None) -> int:
+    def remove_by_query(self, query: str, threshold: float = None, max_remove_count: int = None, save: bool = True) -> int:
         """
         根据查询删除高于阈值的记录
         
@@ -133,6 +179,7 @@ class ChatHistoryVectorDB:
             query: 查询文本
             threshold: 相似度阈值，如果为None则使用配置中的值
             max_remove_count: 最大删除数量，如果为None则使用配置中的值
+            save: 删除后是否立即保存到文件（批量操作时可由调用方统一保存）
             
         返回:
             被删除的记录数量
@@ -144,7 +191,8 @@ class ChatHistoryVectorDB:
             if removed_count > 0:
                 self.logger.info(f"根据查询 '{query}' 删除了 {removed_count} 条记录")
                 # 保存更新后的数据库
-                self.save_to_file()
+                if save:
+                    self.save_to_file()
             else:
                 self.logger.info(f"根据查询 '{query}' 未找到需要删除的记录")
                 
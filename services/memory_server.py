@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+本地记忆服务
+独立进程持有data/memory和data/notes向量数据库，通过本机TCP端口提供增删查服务，
+多个桌宠进程共享同一份内存索引，嵌入和向量计算不再占用UI进程的GIL
+
+启动服务：
+    python -m services.memory_server
+
+协议（网络字节序）：
+    请求：op(1字节) + 长度(4字节) + 正文（UTF-8 JSON）
+    响应：status(1字节，0成功/1失败) + 长度(4字节) + 正文
+          EMBED成功时正文为float32数组，其余为UTF-8 JSON
+    连接建立后第一个请求必须是AUTH，正文为服务信息文件中的token
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import socket
+import secrets
+import threading
+import subprocess
+import socketserver
+from typing import Any, Dict, List, Optional
+from config import MemoryServerConfig, RAG_CONFIG
+from .memory import ChatHistoryVectorDB
+
+
+# 操作码
+OP_AUTH = 1
+OP_PING = 2
+OP_SEARCH = 3
+OP_ADD = 4
+OP_REMOVE = 5
+OP_SAVE = 6
+OP_EMBED = 7
+OP_MAX_SIMILARITY = 8
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_HEADER = struct.Struct('!BI')
+# 服务管理的数据库
+DB_NAMES = ("memory", "notes")
+
+
+class MemoryServerError(Exception):
+    """记忆服务返回错误或连接失败"""
+    pass
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """读取指定长度的数据，连接关闭时抛出ConnectionError"""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _send_frame(sock: socket.socket, code: int, body: bytes):
+    sock.sendall(_HEADER.pack(code, len(body)) + body)
+
+
+def _recv_frame(sock: socket.socket):
+    code, length = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return code, _recv_exact(sock, length)
+
+
+def _pack_vector(vector: List[float]) -> bytes:
+    return struct.pack(f'!{len(vector)}f', *vector)
+
+
+def _unpack_vector(data: bytes) -> List[float]:
+    return list(struct.unpack(f'!{len(data) // 4}f', data))
+
+
+def _read_server_info() -> Optional[Dict[str, Any]]:
+    """读取服务信息文件（端口和token）"""
+    try:
+        with open(MemoryServerConfig.INFO_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ---------------- 服务端 ----------------
+
+class MemoryServer(socketserver.ThreadingTCPServer):
+    """持有向量数据库的本地服务"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = MemoryServerConfig.HOST, port: int = 0):
+        self.token = secrets.token_hex(16)
+        self.dbs: Dict[str, ChatHistoryVectorDB] = {}
+        self.locks: Dict[str, threading.RLock] = {}
+        for db_name in DB_NAMES:
+            db = ChatHistoryVectorDB(RAG_config=RAG_CONFIG, db_name=db_name)
+            db.load_from_file(os.path.join('data', f'{db_name}.json'))
+            self.dbs[db_name] = db
+            self.locks[db_name] = threading.RLock()
+        super().__init__((host, port), _RequestHandler)
+
+    def write_info_file(self):
+        """写入端口和token，供客户端连接"""
+        path = MemoryServerConfig.INFO_FILE
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"port": self.server_address[1], "token": self.token, "pid": os.getpid()}, f)
+
+    def handle_op(self, op: int, args: Dict[str, Any]):
+        """执行一个操作，返回(是否为向量, 结果)"""
+        if op == OP_PING:
+            return False, "pong"
+
+        db_name = args.get("db")
+        if db_name not in self.dbs:
+            raise ValueError(f"未知的数据库: {db_name}")
+        db = self.dbs[db_name]
+
+        with self.locks[db_name]:
+            if op == OP_SEARCH:
+                return False, db.search(args["query"], top_k=args.get("top_k", 5))
+            if op == OP_ADD:
+                for text in args["texts"]:
+                    db.add_text(text)
+                if args.get("save", True):
+                    db.save_to_file()
+                return False, len(args["texts"])
+            if op == OP_REMOVE:
+                return False, db.remove_by_query(args["query"], args.get("threshold"),
+                                                 args.get("max_remove_count"), save=args.get("save", True))
+            if op == OP_SAVE:
+                db.save_to_file()
+                return False, True
+            if op == OP_EMBED:
+                return True, db.embed(args["text"])
+            if op == OP_MAX_SIMILARITY:
+                return False, db.max_recent_similarity(args["text"], args.get("recent", 50))
+        raise ValueError(f"未知的操作: {op}")
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """一个客户端连接：先认证，然后循环处理请求"""
+
+    def handle(self):
+        server: MemoryServer = self.server
+        sock = self.request
+        try:
+            op, body = _recv_frame(sock)
+            if op != OP_AUTH or not secrets.compare_digest(body, server.token.encode('utf-8')):
+                _send_frame(sock, STATUS_ERROR, "认证失败".encode('utf-8'))
+                return
+            _send_frame(sock, STATUS_OK, b'')
+
+            while True:
+                op, body = _recv_frame(sock)
+                try:
+                    args = json.loads(body) if body else {}
+                    is_vector, result = server.handle_op(op, args)
+                    if is_vector and result is not None:
+                        payload = _pack_vector(result)
+                    else:
+                        payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                    _send_frame(sock, STATUS_OK, payload)
+                except Exception as e:
+                    _send_frame(sock, STATUS_ERROR, str(e).encode('utf-8'))
+        except ConnectionError:
+            pass
+
+
+# ---------------- 客户端 ----------------
+
+class RemoteVectorDB:
+    """
+    记忆服务的客户端，接口与ChatHistoryVectorDB一致
+
+    数据由服务进程持有，load_from_file不做任何事情
+    """
+
+    def __init__(self, db_name: str, port: int, token: str):
+        self.db_name = db_name
+        self._address = (MemoryServerConfig.HOST, port)
+        self._token = token
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection(self._address, timeout=MemoryServerConfig.CONNECT_TIMEOUT)
+        sock.settimeout(MemoryServerConfig.REQUEST_TIMEOUT)
+        _send_frame(sock, OP_AUTH, self._token.encode('utf-8'))
+        status, body = _recv_frame(sock)
+        if status != STATUS_OK:
+            sock.close()
+            raise MemoryServerError(body.decode('utf-8', 'replace'))
+        self._sock = sock
+
+    def _request(self, op: int, args: Dict[str, Any], vector: bool = False):
+        """发送请求并返回结果，连接断开时重连一次"""
+        body = json.dumps(dict(args, db=self.db_name), ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    _send_frame(self._sock, op, body)
+                    status, payload = _recv_frame(self._sock)
+                    break
+                except OSError as e:
+                    if self._sock is not None:
+                        self._sock.close()
+                        self._sock = None
+                    if attempt:
+                        raise MemoryServerError(f"记忆服务连接失败: {e}")
+        if status != STATUS_OK:
+            raise MemoryServerError(payload.decode('utf-8', 'replace'))
+        if vector:
+            return _unpack_vector(payload) if payload != b'null' else None
+        return json.loads(payload)
+
+    def ping(self) -> bool:
+        try:
+            return self._request(OP_PING, {}) == "pong"
+        except MemoryServerError:
+            return False
+
+    def load_from_file(self, file_path: str = None):
+        """数据由服务进程加载，这里不需要做任何事"""
+        pass
+
+    def save_to_file(self, file_path: str = None):
+        self._request(OP_SAVE, {})
+
+    def add_text(self, text: str, save: bool = False):
+        """添加文本（与本地数据库一致，默认不立即保存）"""
+        self._request(OP_ADD, {"texts": [text], "save": save})
+
+    def search(self, query: str, top_k: int = 5, timeout: int = 10):
+        try:
+            return self._request(OP_SEARCH, {"query": query, "top_k": top_k})
+        except MemoryServerError as e:
+            print(f"记忆服务检索失败: {e}")
+            return []
+
+    def remove_by_query(self, query: str, threshold: float = None, max_remove_count: int = None, save: bool = True) -> int:
+        try:
+            return self._request(OP_REMOVE, {"query": query, "threshold": threshold,
+                                             "max_remove_count": max_remove_count, "save": save})
+        except MemoryServerError as e:
+            print(f"记忆服务删除失败: {e}")
+            return 0
+
+    def embed(self, text: str):
+        try:
+            return self._request(OP_EMBED, {"text": text}, vector=True)
+        except MemoryServerError as e:
+            print(f"记忆服务嵌入失败: {e}")
+            return None
+
+    def max_recent_similarity(self, text: str, recent: int = 50):
+        try:
+            return self._request(OP_MAX_SIMILARITY, {"text": text, "recent": recent})
+        except MemoryServerError as e:
+            print(f"记忆服务相似度计算失败: {e}")
+            return None
+
+
+def _connect_existing(db_name: str) -> Optional[RemoteVectorDB]:
+    """连接已经运行的记忆服务，不可用时返回None"""
+    info = _read_server_info()
+    if not info:
+        return None
+    client = RemoteVectorDB(db_name, info["port"], info["token"])
+    return client if client.ping() else None
+
+
+def _spawn_server():
+    """在后台启动记忆服务进程"""
+    kwargs = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "stdin": subprocess.DEVNULL}
+    if os.name == 'nt':
+        kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW | subprocess.DETACHED_PROCESS
+    else:
+        kwargs["start_new_session"] = True
+    subprocess.Popen([sys.executable, "-m", "services.memory_server"], **kwargs)
+
+
+_spawn_lock = threading.Lock()
+
+def create_vector_db(db_name: str):
+    """
+    创建向量数据库实例
+
+    启用记忆服务（MemoryServerConfig.ENABLED）时返回连接服务的客户端，必要时自动启动服务；
+    服务不可用或未启用时返回本地的ChatHistoryVectorDB（需要调用方自行load_from_file）
+
+    参数:
+        db_name: 数据库名称（memory或notes）
+    """
+    if MemoryServerConfig.ENABLED and db_name in DB_NAMES:
+        client = _connect_existing(db_name)
+        if client is None and MemoryServerConfig.AUTO_SPAWN and not getattr(sys, 'frozen', False):
+            with _spawn_lock:
+                client = _connect_existing(db_name)
+                if client is None:
+                    print("启动本地记忆服务...")
+                    _spawn_server()
+                    deadline = time.monotonic() + MemoryServerConfig.SPAWN_WAIT
+                    while client is None and time.monotonic() < deadline:
+                        time.sleep(0.3)
+                        client = _connect_existing(db_name)
+        if client is not None:
+            print(f"使用本地记忆服务: {db_name}")
+            return client
+        print("记忆服务不可用，使用进程内数据库")
+
+    return ChatHistoryVectorDB(RAG_config=RAG_CONFIG, db_name=db_name)
+
+
+def main():
+    # 已有服务在运行时不重复启动
+    if _connect_existing(DB_NAMES[0]) is not None:
+        print("记忆服务已在运行")
+        return
+
+    server = MemoryServer()
+    server.write_info_file()
+    print(f"记忆服务已启动: {MemoryServerConfig.HOST}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for db_name, db in server.dbs.items():
+            with server.locks[db_name]:
+                db.save_to_file()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+语义回复缓存
+对没有调用工具的回复按「用户输入的嵌入向量 + 人设和检索上下文的哈希」缓存，
+相似的问题在上下文相同的情况下直接回放缓存的回答，省去一次流式LLM调用
+"""
+
+import time
+import hashlib
+import threading
+from typing import Dict, Any, List, Optional
+from config import ChatConfig
+
+
+def context_hash(static_prompt: str, retrieved: Dict[str, List[str]],
+                 history: List[Dict[str, Any]] = ()) -> str:
+    """
+    计算人设提示词、检索到的记忆/笔记和最近对话的哈希（不包含当前时间）
+
+    参数:
+        static_prompt: 人设提示词
+        retrieved: ContextBuilder.retrieve_context的返回值
+        history: 当前输入之前的最近几条消息。"为什么？"、"继续"这类追问的答案取决于上文，
+            上文不同时不能命中
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(static_prompt.encode('utf-8'))
+    for key in ("memories", "notes"):
+        sha1.update(b"\x00" + key.encode('utf-8'))
+        for text in retrieved.get(key, []):
+            sha1.update(b"\x01" + text.encode('utf-8'))
+    sha1.update(b"\x00history")
+    for message in history:
+        sha1.update(b"\x01" + (message.get("role") or "").encode('utf-8'))
+        sha1.update(b"\x02" + (message.get("content") or "").encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def _dot(a: List[float], b: List[float]) -> float:
+    """两个归一化向量的点积即余弦相似度"""
+    return sum(x * y for x, y in zip(a, b))
+
+
+class ResponseCache:
+    """语义回复缓存，按TTL和相似度阈值淘汰"""
+
+    def __init__(self,
+                 ttl: float = ChatConfig.RESPONSE_CACHE_TTL,
+                 threshold: float = ChatConfig.RESPONSE_CACHE_SIMILARITY,
+                 max_entries: int = ChatConfig.RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "saved_seconds": 0.0}
+
+    def _evict_expired(self, now: float):
+        """移除过期的条目"""
+        self._entries = [e for e in self._entries if now - e["created_at"] < self.ttl]
+
+    def lookup(self, embedding: List[float], ctx_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        查找上下文相同、相似度不低于阈值的缓存回答
+
+        返回:
+            命中的条目（包含answer和latency），未命中返回None
+        """
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            self.stats["lookups"] += 1
+
+            best, best_sim = None, self.threshold
+            for entry in self._entries:
+                if entry["context_hash"] != ctx_hash:
+                    continue
+                sim = _dot(embedding, entry["embedding"])
+                if sim >= best_sim:
+                    best, best_sim = entry, sim
+
+            if best is None:
+                return None
+            self.stats["hits"] += 1
+            self.stats["saved_seconds"] += best["latency"]
+            best["hits"] += 1
+            return dict(best, similarity=best_sim)
+
+    def store(self, embedding: List[float], ctx_hash: str, query: str, answer: str, latency: float):
+        """
+        缓存一条回答
+
+        上下文相同且相似度超过阈值的旧条目会被新条目替换；超出容量时淘汰最旧的条目。
+
+        参数:
+            embedding: 用户输入的归一化嵌入向量
+            ctx_hash: context_hash的返回值
+            query: 用户输入（仅用于日志）
+            answer: 模型的完整回答
+            latency: 生成该回答实际耗时（秒），命中时计入节省的时间
+        """
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            self._entries = [
+                e for e in self._entries
+                if e["context_hash"] != ctx_hash or _dot(embedding, e["embedding"]) < self.threshold
+            ]
+            self._entries.append({
+                "embedding": embedding,
+                "context_hash": ctx_hash,
+                "query": query,
+                "answer": answer,
+                "latency": latency,
+                "created_at": now,
+                "hits": 0
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries = self._entries[-self.max_entries:]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries = []
+
+    def describe_stats(self) -> str:
+        """统计信息文本"""
+        lookups = self.stats["lookups"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return (f"回复缓存命中率 {hit_rate:.1%}（{self.stats['hits']}/{lookups}），"
+                f"累计节省 {self.stats['saved_seconds']:.1f} 秒")
+
+
+# 全局回复缓存实例
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """获取全局回复缓存实例"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
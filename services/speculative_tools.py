@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+只读工具的提前执行
+流式输出过程中逐块检查工具调用的arguments是否已经是完整的JSON，
+只读工具（ChatConfig.READ_ONLY_TOOLS）的参数一旦完整就在后台开始执行，
+流结束时结果通常已经就绪，把工具耗时隐藏在模型生成之后。
+每次提前执行都有自己的取消令牌（随本轮对话一起取消），最终参数不一致或本轮结束时
+未被取用的执行会被取消并等待其退出，不会在对话结束后继续运行
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import ChatConfig
+from .tracing import current_trace_id, use_trace
+from .cancellation import CancellationToken
+
+
+class JsonCompletenessTracker:
+    """增量判断逐块到达的文本是否已构成一个完整的JSON对象"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+        self.invalid = False
+
+    def feed(self, text: str) -> bool:
+        """
+        追加一段文本
+
+        返回:
+            到目前为止的文本是否恰好是一个完整的JSON对象（允许首尾空白）
+        """
+        for ch in text:
+            if self.invalid:
+                break
+            if self.complete:
+                # 对象结束后又出现非空白字符，说明并不完整
+                if not ch.isspace():
+                    self.invalid = True
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if not self.started:
+                if ch == '{':
+                    self.started = True
+                    self.depth = 1
+                elif not ch.isspace():
+                    self.invalid = True
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+        return self.complete and not self.invalid
+
+
+# 执行只读工具的共享线程池
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=ChatConfig.SPECULATIVE_TOOL_WORKERS,
+                                               thread_name_prefix="speculative_tool")
+    return _executor
+
+
+class SpeculativeToolRunner:
+    """一轮流式输出中的只读工具提前执行器"""
+
+    def __init__(self, execute_tool: Callable[[str, Dict[str, Any], CancellationToken], Any],
+                 cancel_token: Optional[CancellationToken] = None):
+        """
+        参数:
+            execute_tool: 执行工具的函数，参数为(工具名, 参数字典, 取消令牌)
+            cancel_token: 本轮对话的取消令牌，取消时一并取消所有提前执行
+        """
+        self.execute_tool = execute_tool
+        self.cancel_token = cancel_token
+        self._trackers: Dict[int, JsonCompletenessTracker] = {}
+        self._started: Dict[int, tuple] = {}
+        # 已放弃（参数不一致）但可能仍在运行的执行，close时等待
+        self._discarded: List[Tuple[CancellationToken, Future]] = []
+
+    def feed(self, index: int, name: str, arguments_delta: str, arguments: str):
+        """
+        记录某个工具调用新到达的参数片段，参数完整且工具为只读时开始执行
+
+        参数:
+            index: 工具调用序号
+            name: 工具名
+            arguments_delta: 新到达的参数片段
+            arguments: 到目前为止累计的完整参数文本
+        """
+        if index in self._started or name not in ChatConfig.READ_ONLY_TOOLS:
+            return
+        tracker = self._trackers.setdefault(index, JsonCompletenessTracker())
+        if not tracker.feed(arguments_delta):
+            return
+        try:
+            parsed = json.loads(arguments)
+        except json.JSONDecodeError:
+            return
+        if not isinstance(parsed, dict):
+            return
+
+        trace_id = current_trace_id()
+        token = CancellationToken()
+        if self.cancel_token is not None:
+            self.cancel_token.register(token.cancel)
+
+        def run():
+            with use_trace(trace_id):
+                return self.execute_tool(name, parsed, token)
+
+        print(f"参数已完整，提前执行只读工具: {name}")
+        self._started[index] = (name, arguments, token, _get_executor().submit(run))
+
+    def take(self, index: int, name: str, arguments: str) -> Optional[Future]:
+        """
+        取出提前执行的结果
+
+        返回:
+            工具名和最终参数与提前执行时一致则返回对应的Future，否则返回None
+        """
+        started = self._started.pop(index, None)
+        if started is None:
+            return None
+        started_name, started_arguments, token, future = started
+        if started_name != name or started_arguments.strip() != arguments.strip():
+            self._discard(token, future)
+            return None
+        return future
+
+    def _discard(self, token: CancellationToken, future: Future):
+        """取消一次提前执行（还没开始的直接撤销），close时等待其退出"""
+        future.cancel()
+        token.cancel()
+        if self.cancel_token is not None:
+            self.cancel_token.unregister(token.cancel)
+        self._discarded.append((token, future))
+
+    def close(self):
+        """取消所有未被取用的提前执行并等待它们退出（可重复调用）"""
+        for _, _, token, future in self._started.values():
+            self._discard(token, future)
+        self._started.clear()
+        futures = [future for _, future in self._discarded]
+        self._discarded = []
+        if futures:
+            wait(futures)
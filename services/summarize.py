@@ -7,16 +7,19 @@
 import json
 import os
 import re
-import requests
+import time
 import asyncio
 import threading
+from collections import deque
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
 from config import SummaryConfig
 from .memory import ChatHistoryVectorDB
-from config import RAG_CONFIG
+from .memory_server import create_vector_db
 from .context_builder import get_current_relevant_notes
+from .endpoint_pool import get_endpoint_pool
+from .tracing import span, use_trace, current_trace_id
 
 
 class ConversationSummarizer:
@@ -27,9 +30,7 @@ class ConversationSummarizer:
         # 加载环境变量
         load_dotenv()
         
-        # API配置
-        self.api_key = os.getenv('API_KEY')
-        self.base_url = os.getenv('BASE_URL')
+        # API配置（端点由端点池选择）
         self.model = os.getenv('SUMMURY_MODEL')  # 注意：环境变量中是SUMMURY_MODEL
         
         # 确保data目录存在
@@ -44,15 +45,19 @@ class ConversationSummarizer:
         
         # 清理不必要的目录结构
         self._cleanup_unnecessary_dirs()
+        
+        # 总结队列和后台工作线程（所有数据库写入都在这个线程中进行）
+        self._queue = deque()
+        self._queue_condition = threading.Condition()
+        self._worker = None
+        self.stats = {"processed": 0, "batches": 0, "dropped": 0, "skipped": 0}
+        # 被筛选跳过、等待合并到下一次总结的对话
+        self._skipped_jobs = []
     
    # 在 summarize.py 和 context_builder.py 中修改
     def _create_custom_db(self, db_name: str) -> ChatHistoryVectorDB:
-        """创建自定义的向量数据库实例"""
-        db = ChatHistoryVectorDB(
-            RAG_config=RAG_CONFIG,
-            db_name=db_name  # 修改参数名
-        )
-        return db
+        """创建自定义的向量数据库实例（启用记忆服务时为服务客户端）"""
+        return create_vector_db(db_name)
     
     def _cleanup_unnecessary_dirs(self):
         """清理不必要的目录结构"""
@@ -100,16 +105,18 @@ class ConversationSummarizer:
         except Exception as e:
             print(f"加载数据库时出错: {e}")
     
-    def _call_summary_api(self, conversation_text: str) -> Optional[Dict[str, Any]]:
-        """调用总结模型API"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def _call_summary_api(self, conversation_text: str, relevant_notes: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        调用总结模型API
         
+        参数:
+            conversation_text: 格式化后的对话内容
+            relevant_notes: 已经记录的相关笔记，为None时使用当前对话的相关笔记
+        """
         # 构建增强的系统提示词，包含相关笔记
         system_prompt = SummaryConfig.summary_prompt
-        relevant_notes = get_current_relevant_notes()
+        if relevant_notes is None:
+            relevant_notes = get_current_relevant_notes()
         
         if relevant_notes:
             system_prompt += f"\n\n这是已经记录的笔记：```\n"
@@ -135,9 +142,8 @@ class ConversationSummarizer:
         }
         
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
+            response = get_endpoint_pool().post(
+                "/chat/completions",
                 json=payload,
                 timeout=30
             )
@@ -207,7 +213,7 @@ class ConversationSummarizer:
         
         return conversation
     
-    def _save_to_memory_db(self, summary: str, timestamp: str):
+    def _save_to_memory_db(self, summary: str, timestamp: str, save: bool = True):
         """保存总结到memory向量数据库"""
         try:
             # 添加时间戳信息的总结
@@ -215,13 +221,14 @@ class ConversationSummarizer:
             self.memory_db.add_text(memory_text)
             
             # 保存到data目录，文件名为memory.json
-            self.memory_db.save_to_file()
+            if save:
+                self.memory_db.save_to_file()
             print(f"总结已保存到data/memory.json: {summary[:50]}...")
             
         except Exception as e:
             print(f"保存到memory数据库失败: {e}")
     
-    def _save_to_notes_db(self, notes: List[str]):
+    def _save_to_notes_db(self, notes: List[str], save: bool = True):
         """保存笔记到notes向量数据库"""
         try:
             for note in notes:
@@ -229,19 +236,20 @@ class ConversationSummarizer:
                     self.notes_db.add_text(note.strip())
             
             # 保存到data目录，文件名为notes.json
-            self.notes_db.save_to_file()
+            if save:
+                self.notes_db.save_to_file()
             print(f"已保存 {len(notes)} 条笔记到data/notes.json")
             
         except Exception as e:
             print(f"保存到notes数据库失败: {e}")
 
-    def _remove_from_notes_db(self, remove_queries: List[str]):
-        """根据查询词从notes向量数据库中删除记录"""
+    def _remove_from_notes_db(self, remove_queries: List[str], save: bool = True) -> int:
+        """根据查询词从notes向量数据库中删除记录，返回删除的数量"""
+        total_removed = 0
         try:
-            total_removed = 0
             for query in remove_queries:
                 if query.strip():  # 跳过空查询
-                    removed_count = self.notes_db.remove_by_query(query.strip())
+                    removed_count = self.notes_db.remove_by_query(query.strip(), save=save)
                     total_removed += removed_count
                     print(f"根据查询 '{query}' 删除了 {removed_count} 条笔记")
             
@@ -250,28 +258,152 @@ class ConversationSummarizer:
             
         except Exception as e:
             print(f"从notes数据库删除记录失败: {e}")
+        return total_removed
+    
+    def _make_job(self, user_message: str, assistant_message: str, tool_calls: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """创建总结任务，记录入队时的相关笔记和trace"""
+        return {
+            "user_message": user_message,
+            "assistant_message": assistant_message,
+            "tool_calls": tool_calls,
+            # 入队时就保存相关笔记，之后的对话会覆盖全局的当前笔记
+            "relevant_notes": list(get_current_relevant_notes()),
+            "trace_id": current_trace_id(),
+            "enqueued_at": time.monotonic()
+        }
     
     def summarize_conversation_async(self, user_message: str, assistant_message: str, tool_calls: List[Dict[str, Any]] = None):
-        """异步总结对话（在单独线程中执行）"""
-        def _async_summarize():
+        """异步总结对话（加入总结队列，由后台工作线程批量处理）"""
+        job = self._make_job(user_message, assistant_message, tool_calls)
+        with self._queue_condition:
+            if len(self._queue) >= SummaryConfig.QUEUE_MAX_SIZE:
+                dropped = self._queue.popleft()
+                self.stats["dropped"] += 1
+                print(f"总结队列已满，丢弃最早的对话: {dropped['user_message'][:30]}...")
+            self._queue.append(job)
+            self._queue_condition.notify()
+            
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._worker_loop, name="summarizer", daemon=True)
+                self._worker.start()
+    
+    def _worker_loop(self):
+        """总结工作线程：每次取出所有积压的对话（不超过批量上限）合并总结"""
+        while True:
+            with self._queue_condition:
+                while not self._queue:
+                    self._queue_condition.wait()
+                batch = []
+                while self._queue and len(batch) < SummaryConfig.BATCH_MAX_TURNS:
+                    batch.append(self._queue.popleft())
+            
+            lag = time.monotonic() - batch[0]["enqueued_at"]
             try:
-                self.summarize_conversation(user_message, assistant_message, tool_calls)
+                with use_trace(batch[-1]["trace_id"]):
+                    batch = self._gate_batch(batch)
+                    if batch:
+                        with span("summarize", turns=len(batch), lag_ms=round(lag * 1000, 1)):
+                            self._process_batch(batch)
             except Exception as e:
                 print(f"异步总结对话时出错: {e}")
+                continue
+            
+            if batch:
+                self.stats["processed"] += len(batch)
+                self.stats["batches"] += 1
+                print(f"总结批次完成：{len(batch)} 轮对话，排队 {lag:.1f} 秒，剩余 {self.queue_depth()} 轮")
+    
+    def _should_summarize(self, job: Dict[str, Any]):
+        """
+        本地判断一轮对话是否需要总结
+        
+        返回:
+            (是否需要总结, 原因)
+        """
+        if job["tool_calls"]:
+            return True, "调用了工具"
+        
+        normalized = re.sub(r'[\W_]+', '', job["user_message"]).lower()
+        if len(normalized) <= SummaryConfig.MIN_USER_CHARS:
+            return False, "输入过短"
+        if normalized in SummaryConfig.TRIVIAL_MESSAGES:
+            return False, "寒暄"
         
-        # 在新线程中执行总结
-        thread = threading.Thread(target=_async_summarize, daemon=True)
-        thread.start()
+        similarity = self.memory_db.max_recent_similarity(
+            self._format_conversation(job["user_message"], job["assistant_message"]),
+            SummaryConfig.NOVELTY_RECENT_COUNT
+        )
+        if similarity is not None and similarity >= SummaryConfig.NOVELTY_THRESHOLD:
+            return False, f"与最近记忆相似度 {similarity:.2f}"
+        return True, "有新内容"
+    
+    def _gate_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        筛选需要总结的对话
+        
+        跳过的对话暂存起来，在下一次需要总结时按顺序合并进去；
+        本批没有需要总结的对话时返回空列表。
+        """
+        if not SummaryConfig.GATING_ENABLED:
+            return batch
+        
+        needed = []
+        for job in batch:
+            summarize, reason = self._should_summarize(job)
+            if summarize:
+                needed.append(job)
+                continue
+            self.stats["skipped"] += 1
+            print(f"跳过总结（{reason}）: {job['user_message'][:30]}")
+            self._skipped_jobs.append(job)
+            if len(self._skipped_jobs) > SummaryConfig.MAX_MERGED_SKIPPED:
+                self._skipped_jobs.pop(0)
+        
+        if not needed:
+            return []
+        
+        merged = sorted(self._skipped_jobs + needed, key=lambda job: job["enqueued_at"])
+        self._skipped_jobs = []
+        return merged
+    
+    def queue_depth(self) -> int:
+        """等待总结的对话轮数"""
+        with self._queue_condition:
+            return len(self._queue)
+    
+    def queue_lag(self) -> float:
+        """队列中最早的对话已等待的秒数"""
+        with self._queue_condition:
+            if not self._queue:
+                return 0.0
+            return time.monotonic() - self._queue[0]["enqueued_at"]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """总结队列的统计信息"""
+        return dict(self.stats, queue_depth=self.queue_depth(), lag_seconds=round(self.queue_lag(), 1))
     
     def summarize_conversation(self, user_message: str, assistant_message: str, tool_calls: List[Dict[str, Any]] = None):
-        """总结对话并存储到向量数据库"""
+        """总结对话并存储到向量数据库（同步执行）"""
+        with span("summarize", turns=1):
+            self._process_batch([self._make_job(user_message, assistant_message, tool_calls)])
+    
+    def _process_batch(self, batch: List[Dict[str, Any]]):
+        """总结一批对话并存储到向量数据库，每个数据库最多写入一次文件"""
         try:
-            # Step 1: 格式化对话内容
-            conversation_text = self._format_conversation(user_message, assistant_message, tool_calls)
-            print(f"开始总结对话: {user_message[:30]}...")
+            # Step 1: 格式化对话内容，多轮对话按顺序拼接
+            conversation_text = "\n\n".join(
+                self._format_conversation(job["user_message"], job["assistant_message"], job["tool_calls"])
+                for job in batch
+            )
+            relevant_notes = []
+            for job in batch:
+                for note in job["relevant_notes"]:
+                    if note not in relevant_notes:
+                        relevant_notes.append(note)
+            print(f"开始总结对话（{len(batch)}轮）: {batch[0]['user_message'][:30]}...")
             
             # Step 2: 调用总结模型
-            summary_result = self._call_summary_api(conversation_text)
+            summary_result = self._call_summary_api(conversation_text, relevant_notes)
             if not summary_result:
                 print("总结失败，跳过存储")
                 return
@@ -287,9 +419,10 @@ class ConversationSummarizer:
             if remove_queries:
                 print(f"需要删除的记忆关键词: {remove_queries}")
             
-            # Step 4: 处理删除操作（在添加新记录之前）
+            # Step 4: 处理删除操作（在添加新记录之前），最后统一保存
+            notes_changed = False
             if remove_queries:
-                self._remove_from_notes_db(remove_queries)
+                notes_changed = self._remove_from_notes_db(remove_queries, save=False) > 0
             
             # Step 5: 保存到向量数据库
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -300,7 +433,11 @@ class ConversationSummarizer:
             
             # 保存笔记到notes数据库
             if add_notes:
-                self._save_to_notes_db(add_notes)
+                self._save_to_notes_db(add_notes, save=False)
+                notes_changed = True
+            
+            if notes_changed:
+                self.notes_db.save_to_file()
             
             print("对话总结完成")
             
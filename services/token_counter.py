@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Token估算工具
+不依赖具体模型的分词器，按中日韩字符和其他字符分别估算token数量
+"""
+
+import json
+import math
+import re
+from typing import Dict, Any, List
+
+# 中日韩字符、全角符号：大多数分词器下约1个字符对应1个token
+_CJK_PATTERN = re.compile(
+    r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]'
+)
+
+# 英文、数字、标点等：平均约4个字符对应1个token
+_CHARS_PER_TOKEN = 4
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的token数量"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + math.ceil(other_count / _CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    """估算单条消息（含工具调用）的token数量"""
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "")
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+    return tokens
+
+
+def estimate_tools_tokens(tools: List[Dict[str, Any]]) -> int:
+    """估算工具定义（tools字段）的token数量"""
+    if not tools:
+        return 0
+    return estimate_tokens(json.dumps(tools, ensure_ascii=False))
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+工具注册服务
+启动时只读取工具清单缓存（tool_definition + 文件mtime/大小/哈希），
+工具模块在第一次被调用时才真正导入，避免启动时加载pyautogui、win32、RAG等重量级依赖。
+导入失败（例如当前平台缺少win32）的工具会记录到清单中，之后不再提供给模型，
+直到文件变化或启动时重新导入成功
+"""
+
+import os
+import ast
+import json
+import hashlib
+import inspect
+import threading
+import importlib.util
+from typing import Dict, Any, List, Tuple, Optional
+from config import ChatConfig
+
+
+class ToolImportError(Exception):
+    """工具模块导入失败，或不符合工具约定（同名函数+tool_definition属性）"""
+    pass
+
+
+class LazyTool:
+    """延迟导入的工具函数，第一次调用时才加载所在模块"""
+
+    def __init__(self, name: str, file_path: str, tool_definition: Dict[str, Any], func=None):
+        self.name = name
+        self.file_path = file_path
+        self.tool_definition = tool_definition
+        self.is_tool = True
+        self._func = func
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._func is not None
+
+    def load(self):
+        """
+        导入工具模块并返回真正的工具函数
+
+        异常:
+            ToolImportError: 导入失败或不符合工具约定
+        """
+        if self._func is None:
+            with self._lock:
+                if self._func is None:
+                    print(f"首次调用，导入工具模块: {self.name}")
+                    self._func = _import_tool(self.name, self.file_path)
+        return self._func
+
+    def accepts_argument(self, name: str) -> bool:
+        """工具函数是否声明了指定参数（会触发模块导入）"""
+        try:
+            return name in inspect.signature(self.load()).parameters
+        except (TypeError, ValueError):
+            return False
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+
+def _import_module(tool_name: str, file_path: str):
+    """从文件导入工具模块"""
+    spec = importlib.util.spec_from_file_location(tool_name, file_path)
+    if spec is None or spec.loader is None:
+        raise ImportError("无法创建模块规范")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _import_tool(tool_name: str, file_path: str):
+    """
+    导入工具模块并检查工具约定，返回工具函数
+
+    异常:
+        ToolImportError: 导入失败、没有同名函数或缺少tool_definition属性
+    """
+    try:
+        module = _import_module(tool_name, file_path)
+    except Exception as e:
+        raise ToolImportError(f"导入失败: {e}") from e
+    if not hasattr(module, tool_name):
+        raise ToolImportError("模块中没有找到同名函数")
+    tool_func = getattr(module, tool_name)
+    if not hasattr(tool_func, 'tool_definition'):
+        raise ToolImportError("缺少tool_definition属性")
+    return tool_func
+
+
+def _file_sha1(file_path: str) -> str:
+    """计算文件内容的SHA1"""
+    with open(file_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _read_definition_statically(tool_name: str, file_path: str) -> Optional[Dict[str, Any]]:
+    """
+    不执行模块，直接从源码中解析tool_definition
+
+    要求模块顶层有字面量形式的`tool_definition = {...}`、同名函数和
+    `函数名.tool_definition = ...`（与导入时检查的约定相同），否则返回None
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=file_path)
+    except (SyntaxError, UnicodeDecodeError, OSError):
+        return None
+
+    definition = None
+    has_function = False
+    has_attribute = False
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == tool_name:
+            has_function = True
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id == 'tool_definition':
+                    try:
+                        definition = ast.literal_eval(node.value)
+                    except ValueError:
+                        return None
+                elif (isinstance(target, ast.Attribute) and target.attr == 'tool_definition'
+                      and isinstance(target.value, ast.Name) and target.value.id == tool_name):
+                    has_attribute = True
+
+    if has_function and has_attribute and isinstance(definition, dict):
+        return definition
+    return None
+
+
+class ToolRegistry:
+    """基于清单缓存的工具注册表"""
+
+    def __init__(self, tools_dir: str, manifest_path: str = ChatConfig.TOOL_MANIFEST_PATH):
+        self.tools_dir = tools_dir
+        self.manifest_path = manifest_path
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        """读取清单缓存，不存在或损坏时返回空清单"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get("tools"), dict):
+                return manifest
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"工具清单缓存损坏，将重新生成: {e}")
+        return {"tools": {}}
+
+    def _save_manifest(self):
+        """保存清单缓存"""
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+            with open(self.manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存工具清单缓存失败: {e}")
+
+    def _introspect(self, tool_name: str, file_path: str) -> Tuple[Dict[str, Any], Any]:
+        """
+        获取工具定义：优先静态解析源码，失败时才导入模块
+
+        返回:
+            (tool_definition, 已导入的工具函数或None)
+        """
+        definition = _read_definition_statically(tool_name, file_path)
+        if definition is not None:
+            return definition, None
+
+        tool_func = _import_tool(tool_name, file_path)
+        return tool_func.tool_definition, tool_func
+
+    def mark_import_failed(self, tool_name: str, error: Exception):
+        """记录工具导入失败，下次启动时先重新导入验证，失败则不再提供给模型"""
+        entry = self.manifest["tools"].get(tool_name + '.py')
+        if entry is None:
+            return
+        entry["import_error"] = str(error)
+        self._save_manifest()
+
+    def load(self) -> Tuple[Dict[str, LazyTool], List[Dict[str, Any]], List[str], List[str]]:
+        """
+        扫描工具目录并注册工具
+
+        返回:
+            (available_tools, tools, successful_tools, failed_tools)
+        """
+        available_tools = {}
+        tools = []
+        successful_tools = []
+        failed_tools = []
+        cached_tools = self.manifest["tools"]
+        new_manifest = {}
+        changed = False
+
+        # 排序保证工具定义顺序稳定，利于前缀缓存
+        for filename in sorted(os.listdir(self.tools_dir)):
+            if not filename.endswith('.py') or filename.startswith('__'):
+                continue
+            tool_name = filename[:-3]  # 去掉.py扩展名
+            file_path = os.path.join(self.tools_dir, filename)
+
+            try:
+                stat = os.stat(file_path)
+                entry = cached_tools.get(filename)
+                tool_func = None
+
+                if entry and entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+                    # 文件未变化，直接使用缓存
+                    definition = entry["tool_definition"]
+                else:
+                    sha1 = _file_sha1(file_path)
+                    if entry and entry.get("sha1") == sha1:
+                        # 只有mtime变化，内容相同
+                        definition = entry["tool_definition"]
+                    else:
+                        print(f"工具文件有变化，重新解析: {filename}")
+                        definition, tool_func = self._introspect(tool_name, file_path)
+                    entry = {
+                        "sha1": sha1,
+                        "tool_definition": definition
+                    }
+                    changed = True
+
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+                new_manifest[filename] = entry
+
+                if entry.get("import_error") and tool_func is None:
+                    # 上次导入失败：启动时重新导入验证（例如依赖已经安装），仍失败则不注册
+                    try:
+                        tool_func = _import_tool(tool_name, file_path)
+                    except ToolImportError as e:
+                        entry["import_error"] = str(e)
+                        raise
+                    del entry["import_error"]
+                    changed = True
+
+                available_tools[tool_name] = LazyTool(tool_name, file_path, definition, tool_func)
+                tools.append(definition)
+                successful_tools.append(tool_name)
+
+            except Exception as e:
+                failed_tools.append(f"{tool_name}: 加载失败 - {str(e)}")
+                print(f"取消加载 {tool_name}，因为{str(e)}")
+
+        if changed or set(new_manifest) != set(cached_tools):
+            self.manifest = {"tools": new_manifest}
+            self._save_manifest()
+
+        return available_tools, tools, successful_tools, failed_tools
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+工具结果存储与预算服务
+工具输出超过token预算时，完整结果保存到本地，发给模型的只是去重+首尾截断后的摘要，
+模型可以通过read_tool_result工具分段查看完整输出
+"""
+
+import os
+import json
+import uuid
+import threading
+from typing import Dict, Any, List, Optional
+from config import ChatConfig
+from .token_counter import estimate_tokens
+
+
+def dedup_lines(lines: List[str]) -> List[str]:
+    """合并连续重复的行"""
+    result = []
+    previous = None
+    repeat = 0
+    for line in lines:
+        if line == previous:
+            repeat += 1
+            continue
+        if repeat:
+            result.append(f"…（上一行重复 {repeat} 次）")
+        result.append(line)
+        previous = line
+        repeat = 0
+    if repeat:
+        result.append(f"…（上一行重复 {repeat} 次）")
+    return result
+
+
+def _fit_prefix(text: str, max_tokens: int) -> int:
+    """不超过max_tokens的最长前缀的字符数（二分查找）"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _clip_line(line: str, max_tokens: int) -> str:
+    """截断单个超长的行，保留行首和行尾"""
+    if estimate_tokens(line) <= max_tokens:
+        return line
+    # 省略提示按整行长度估算，保证截断后总量不超过max_tokens
+    marker_tokens = estimate_tokens(f"…（本行省略 {len(line)} 个字符）…")
+    half = max((max_tokens - marker_tokens) // 2, 1)
+    head = line[:_fit_prefix(line, half)]
+    tail = line[len(line) - _fit_prefix(line[::-1], half):]
+    return head + f"…（本行省略 {len(line) - len(head) - len(tail)} 个字符）…" + tail
+
+
+def truncate_head_tail(lines: List[str], max_tokens: int) -> List[str]:
+    """
+    保留开头和结尾的行，省略中间部分，使总量不超过max_tokens
+
+    开头和结尾各占一半预算；单行超过一半预算时会被截断。
+    """
+    half = max(max_tokens // 2, 1)
+
+    head, head_tokens = [], 0
+    for line in lines:
+        line = _clip_line(line, half - 1)
+        cost = estimate_tokens(line) + 1
+        if head_tokens + cost > half:
+            break
+        head.append(line)
+        head_tokens += cost
+
+    tail, tail_tokens = [], 0
+    for line in reversed(lines[len(head):]):
+        line = _clip_line(line, half - 1)
+        cost = estimate_tokens(line) + 1
+        if tail_tokens + cost > half:
+            break
+        tail.append(line)
+        tail_tokens += cost
+    tail.reverse()
+
+    omitted = len(lines) - len(head) - len(tail)
+    if omitted <= 0:
+        return head + tail
+    return head + [f"…（省略中间 {omitted} 行）…"] + tail
+
+
+def tool_result_to_text(tool_result: Any) -> str:
+    """把工具返回值转换为便于阅读和分段的纯文本"""
+    if isinstance(tool_result, dict):
+        content = tool_result.get("content")
+        # MCP格式：{"content": [{"type": "text", "text": "..."}]}
+        if isinstance(content, list):
+            texts = [item.get("text", "") for item in content if isinstance(item, dict)]
+            if any(texts):
+                return "\n".join(texts)
+        if isinstance(content, str) and content:
+            return content
+        return json.dumps(tool_result, ensure_ascii=False, indent=2)
+    return str(tool_result)
+
+
+class ToolResultStore:
+    """工具完整输出的本地存储，按行分段读取，超长的行在行内按字符偏移分段"""
+
+    def __init__(self, store_dir: str = ChatConfig.TOOL_RESULT_STORE_DIR,
+                 max_files: int = ChatConfig.TOOL_RESULT_STORE_MAX_FILES):
+        self.store_dir = store_dir
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def _get_path(self, result_id: str) -> Optional[str]:
+        """获取结果文件路径，result_id不合法时返回None"""
+        if not result_id or not result_id.isalnum():
+            return None
+        return os.path.join(self.store_dir, f"{result_id}.txt")
+
+    def save(self, text: str) -> str:
+        """保存完整输出，返回结果ID"""
+        result_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            with open(self._get_path(result_id), 'w', encoding='utf-8') as f:
+                f.write(text)
+            self._cleanup()
+        return result_id
+
+    def _cleanup(self):
+        """只保留最近的max_files个结果文件"""
+        try:
+            files = [os.path.join(self.store_dir, name) for name in os.listdir(self.store_dir) if name.endswith('.txt')]
+            if len(files) <= self.max_files:
+                return
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_files]:
+                os.remove(path)
+        except Exception as e:
+            print(f"清理工具结果存储失败: {e}")
+
+    def read(self, result_id: str, start_line: int = 1, start_offset: int = 0,
+             max_tokens: int = ChatConfig.TOOL_RESULT_PAGE_TOKENS) -> Dict[str, Any]:
+        """
+        从start_line行的第start_offset个字符开始读取，直到达到max_tokens
+
+        一页放不下的行在行内截断，下一段从该行的字符偏移继续（next_start_offset）
+
+        返回:
+            包含内容、行号范围和下一段起始位置的字典
+        """
+        path = self._get_path(result_id)
+        if path is None or not os.path.exists(path):
+            return {
+                "status": "error",
+                "message": f"工具结果不存在或已过期: {result_id}"
+            }
+
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+
+        total_lines = len(lines)
+        start_line = max(1, min(start_line or 1, total_lines))
+        start_offset = max(0, min(start_offset or 0, len(lines[start_line - 1])))
+
+        selected, used = [], 0
+        index, offset = start_line - 1, start_offset
+        while index < total_lines:
+            rest = lines[index][offset:]
+            cost = estimate_tokens(rest) + 1
+            if used + cost <= max_tokens:
+                selected.append(rest)
+                used += cost
+                index, offset = index + 1, 0
+                continue
+            if not selected or cost > max_tokens:
+                # 单行超过一页：取能放下的部分，下一段从本行的这个字符位置继续
+                taken = _fit_prefix(rest, max_tokens - used - 1)
+                if not selected:
+                    taken = max(taken, 1)
+                if taken:
+                    selected.append(rest[:taken])
+                    offset += taken
+            break
+
+        finished = index >= total_lines
+        return {
+            "status": "success",
+            "result_id": result_id,
+            "start_line": start_line,
+            "start_offset": start_offset,
+            "end_line": index + 1 if offset else index,
+            "total_lines": total_lines,
+            "next_start_line": None if finished else index + 1,
+            "next_start_offset": None if finished else offset,
+            "content": "\n".join(selected)
+        }
+
+
+def budget_tool_output(tool_result: Any, content: str) -> str:
+    """
+    对工具输出应用token预算
+
+    参数:
+        tool_result: 工具原始返回值
+        content: 原本要发送给模型的内容（JSON字符串）
+
+    返回:
+        预算内的内容。未超出预算时原样返回；超出时保存完整输出，返回摘要和结果ID
+    """
+    max_tokens = ChatConfig.TOOL_RESULT_MAX_TOKENS
+    if estimate_tokens(content) <= max_tokens:
+        return content
+
+    text = tool_result_to_text(tool_result)
+    lines = text.split('\n')
+    result_id = get_tool_result_store().save(text)
+
+    reduced = dedup_lines(lines)
+    if estimate_tokens("\n".join(reduced)) > max_tokens:
+        reduced = truncate_head_tail(reduced, max_tokens)
+
+    summary = {
+        "status": "truncated",
+        "message": "输出过长，以下内容已去重并截断。可以调用read_tool_result并传入result_id分段查看完整输出",
+        "result_id": result_id,
+        "total_lines": len(lines),
+        "content": "\n".join(reduced)
+    }
+    # 保留工具返回的其他简单字段（如状态、文件路径、行号等）
+    if isinstance(tool_result, dict):
+        for key, value in tool_result.items():
+            if key not in summary and key != "content" and isinstance(value, (str, int, float, bool)) and len(str(value)) < 200:
+                summary[key] = value
+
+    return json.dumps(summary, ensure_ascii=False)
+
+
+# 全局工具结果存储实例
+_tool_result_store = None
+
+def get_tool_result_store() -> ToolResultStore:
+    """获取全局工具结果存储实例"""
+    global _tool_result_store
+    if _tool_result_store is None:
+        _tool_result_store = ToolResultStore()
+    return _tool_result_store
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+轻量级耗时追踪
+每轮对话是一个trace，检索、嵌入、重排、模型流式输出、工具执行、总结等阶段各记录为span，
+写入本地JSONL文件。命令行查看各阶段耗时的p50/p95：
+
+    python -m services.tracing [traces.jsonl]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from config import SystemConfig
+
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def new_trace_id() -> str:
+    """生成新的trace id"""
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id() -> Optional[str]:
+    """当前线程正在进行的trace id"""
+    return getattr(_local, 'trace_id', None)
+
+
+@contextmanager
+def use_trace(trace_id: Optional[str] = None):
+    """
+    在当前线程中启用一个trace，期间记录的span都归属于它
+
+    参数:
+        trace_id: 已有的trace id（例如把总结线程关联到对应的对话轮次），为None时新建
+    """
+    previous = current_trace_id()
+    _local.trace_id = trace_id or new_trace_id()
+    try:
+        yield _local.trace_id
+    finally:
+        _local.trace_id = previous
+
+
+class Span:
+    """一个计时阶段，可以附加属性"""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = current_trace_id()
+        self.started = time.perf_counter()
+
+    def elapsed(self) -> float:
+        """已经过的秒数"""
+        return time.perf_counter() - self.started
+
+    def set(self, **attrs):
+        """附加属性（数值属性会出现在统计中）"""
+        self.attrs.update(attrs)
+
+
+def _write(record: Dict[str, Any]):
+    """追加一条记录到追踪文件"""
+    path = SystemConfig.TRACE_FILE_PATH
+    try:
+        line = json.dumps(record, ensure_ascii=False)
+        with _write_lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    except Exception as e:
+        print(f"写入追踪记录失败: {e}")
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    记录一个阶段的耗时
+
+    用法:
+        with span("embed", texts=3) as s:
+            ...
+            s.set(cached=1)
+    """
+    current = Span(name, attrs)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        if SystemConfig.TRACE_ENABLED:
+            _write({
+                "trace_id": current.trace_id,
+                "span": name,
+                "time": datetime.now().isoformat(timespec='milliseconds'),
+                "duration_ms": round(current.elapsed() * 1000, 1),
+                **current.attrs
+            })
+
+
+def _percentile(values: List[float], p: float) -> float:
+    """最近秩法分位数"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(p * len(ordered)) - 1))
+    return ordered[index]
+
+
+def load_stats(path: str) -> Dict[str, Dict[str, List[float]]]:
+    """读取追踪文件，按span名称和数值属性归类"""
+    stats = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            metrics = stats.setdefault(record.get("span", "?"), {})
+            for key, value in record.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metrics.setdefault(key, []).append(value)
+    return stats
+
+
+def main(argv: List[str]) -> int:
+    path = argv[1] if len(argv) > 1 else SystemConfig.TRACE_FILE_PATH
+    if not os.path.exists(path):
+        print(f"追踪文件不存在: {path}")
+        return 1
+
+    stats = load_stats(path)
+    print(f"{'阶段':<20}{'指标':<16}{'次数':>8}{'p50':>12}{'p95':>12}")
+    for name in sorted(stats, key=lambda n: -sum(stats[n].get("duration_ms", [0]))):
+        metrics = stats[name]
+        # duration_ms放在最前面
+        for key in sorted(metrics, key=lambda k: (k != "duration_ms", k)):
+            values = metrics[key]
+            print(f"{name:<20}{key:<16}{len(values):>8}"
+                  f"{_percentile(values, 0.5):>12.1f}{_percentile(values, 0.95):>12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -5,65 +5,97 @@
 """
 
 import os
-import base64
+import json
 import requests
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import QBuffer, QIODevice
-from config import ChatConfig
+from config import ChatConfig, VisionConfig
+from .endpoint_pool import get_endpoint_pool
+from .cancellation import CancelledError
+from .image_preprocess import preprocess_image
+from .vision_cache import get_vision_cache
 
 class VisionService:
     """视觉模型服务类"""
     
     def __init__(self):
         # 从环境变量读取配置
-        self.base_url = os.getenv('BASE_URL', 'https://api.siliconflow.cn/v1')
-        self.api_key = os.getenv('API_KEY')
         self.vision_model = os.getenv('VISION_MODEL', '')
+        self.endpoint_pool = get_endpoint_pool()
         
-        if not self.api_key:
+        if not self.endpoint_pool.endpoints:
             raise ValueError("API_KEY not found in environment variables")
     
     def pixmap_to_base64(self, pixmap):
-        """将QPixmap转换为base64编码的字符串"""
-        from PyQt5.QtCore import QBuffer, QIODevice
-        
-        # 创建QBuffer来保存图片数据
-        buffer = QBuffer()
-        buffer.open(QIODevice.WriteOnly)
-        
-        # 保存pixmap到buffer
-        pixmap.save(buffer, "PNG")
-        
-        # 获取字节数据并转换为base64
-        image_data = buffer.data()
-        buffer.close()
-        
-        return base64.b64encode(image_data).decode('utf-8')
+        """将QPixmap预处理后转换为base64编码的字符串（需要在UI线程中调用）"""
+        return preprocess_image(pixmap.toImage(), pixmap.cacheKey()).base64()
+    
+    @staticmethod
+    def _cache_digest(prepared):
+        """文字/界面截图只按编码结果精确匹配缓存，照片返回None（按dHash近似匹配）"""
+        return None if prepared.is_photo else prepared.digest
     
-    def describe_image(self, pixmap, user_input=""):
+    def _read_stream(self, response, on_progress=None):
+        """读取SSE流式响应，返回完整的描述文本"""
+        description = ""
+        for line in response.iter_lines():
+            if not line:
+                continue
+            line_str = line.decode('utf-8')
+            if not line_str.startswith('data: '):
+                continue
+            data_str = line_str[6:].strip()
+            if data_str == '[DONE]':
+                break
+            try:
+                chunk = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            for choice in chunk.get('choices') or []:
+                content = (choice.get('delta') or {}).get('content')
+                if content:
+                    description += content
+                    if on_progress:
+                        on_progress(description)
+        return description
+    
+    def describe_image(self, image, user_input="", cache_key=None, on_progress=None,
+                       cancel_token=None):
         """
-        使用VLM描述图片
+        使用VLM描述图片（流式请求）
         
         Args:
-            pixmap: QPixmap对象
+            image: QImage对象（在工作线程中调用时使用），或QPixmap对象（只能在UI线程中调用）
             user_input: 用户输入文本，作为描述的导向
+            cache_key: 预处理结果的缓存键，通常是原QPixmap的cacheKey()
+            on_progress: 每收到一段描述时调用，参数为到目前为止的描述文本
+            cancel_token: 取消令牌，取消时关闭流式连接（端点池随之归还并发名额）
             
         Returns:
             str: 图片描述文本
+            
+        Raises:
+            CancelledError: 已被取消
         """
         try:
             print("开始VLM图片处理...")
             
-            # 检查pixmap是否有效
-            if not pixmap or pixmap.isNull():
+            # 检查图片是否有效
+            if not image or image.isNull():
                 return "无效的图片"
+            if isinstance(image, QPixmap):
+                cache_key = image.cacheKey()
+                image = image.toImage()
             
-            print(f"图片尺寸: {pixmap.width()}x{pixmap.height()}")
+            # 裁剪、缩放并选择编码格式
+            prepared = preprocess_image(image, cache_key)
+            print(f"图片预处理完成: {prepared.describe()}")
             
-            # 将图片转换为base64
-            print("转换图片为base64...")
-            image_base64 = self.pixmap_to_base64(pixmap)
-            print(f"Base64转换完成，长度: {len(image_base64)}")
+            # 相同或几乎相同的图片配同样的输入，直接使用缓存的描述
+            if VisionConfig.CACHE_ENABLED:
+                cached = get_vision_cache().lookup(prepared.dhash, user_input, self._cache_digest(prepared))
+                if cached is not None:
+                    print(f"命中图片描述缓存（汉明距离 {cached['distance']}）")
+                    return cached["description"]
             
             # 构建请求消息
             messages = [
@@ -77,7 +109,7 @@ class VisionService:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{image_base64}"
+                                "url": prepared.data_url()
                             }
                         },
                         {
@@ -89,43 +121,58 @@ class VisionService:
             ]
             
             # 发送请求
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
-            
             data = {
                 'model': self.vision_model,
                 'messages': messages,
-                'max_tokens': 500,
-                'temperature': 0.3
+                'max_tokens': VisionConfig.MAX_TOKENS,
+                'temperature': VisionConfig.TEMPERATURE,
+                'stream': True
             }
             
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            
             print("发送VLM API请求...")
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
+            response = self.endpoint_pool.post(
+                "/chat/completions",
                 json=data,
-                timeout=ChatConfig.API_TIMEOUT
+                timeout=ChatConfig.API_TIMEOUT,
+                stream=True
             )
             
             print(f"VLM API响应状态: {response.status_code}")
+            if cancel_token is not None:
+                cancel_token.register(response.close)
             
-            if response.status_code == 200:
-                result = response.json()
-                description = result['choices'][0]['message']['content'].strip()
-                print(f"VLM描述: {description}")
-                return description
-            else:
-                error_msg = f"VLM API错误: {response.status_code}"
-                try:
-                    error_detail = response.json()
-                    error_msg += f" - {error_detail}"
-                except:
-                    error_msg += f" - {response.text}"
-                print(error_msg)
-                return error_msg
+            try:
+                if response.status_code == 200:
+                    try:
+                        description = self._read_stream(response, on_progress).strip()
+                    finally:
+                        # 取消时连接被关闭，读取可能以任意异常结束，统一按取消处理
+                        if cancel_token is not None:
+                            cancel_token.raise_if_cancelled()
+                    print(f"VLM描述: {description}")
+                    if VisionConfig.CACHE_ENABLED and description:
+                        get_vision_cache().store(prepared.dhash, user_input, description, self._cache_digest(prepared))
+                    return description
+                else:
+                    error_msg = f"VLM API错误: {response.status_code}"
+                    try:
+                        error_detail = response.json()
+                        error_msg += f" - {error_detail}"
+                    except:
+                        error_msg += f" - {response.text}"
+                    print(error_msg)
+                    return error_msg
+            finally:
+                # 流式响应需要关闭，端点池才会释放并发名额
+                if cancel_token is not None:
+                    cancel_token.unregister(response.close)
+                response.close()
                 
+        except CancelledError:
+            raise
         except requests.exceptions.Timeout:
             error_msg = "VLM请求超时"
             print(error_msg)
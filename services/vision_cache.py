@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+图片描述缓存
+按「预处理后的图片 + 规范化的用户输入」缓存VLM的描述，重复发送的图片直接返回缓存的描述。
+照片按差值哈希(dHash)近似匹配，汉明距离不超过阈值视为同一张；
+文字/界面截图（PNG）的dHash分辨不出同一界面中不同的文字，只按编码结果的摘要精确匹配。
+缓存条数有上限，保存在data/vision_cache.json
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from typing import Any, Dict, List, Optional
+from config import VisionConfig
+
+
+def normalize_text(text: str) -> str:
+    """规范化用户输入：去掉首尾空白、合并连续空白、忽略大小写"""
+    return re.sub(r'\s+', ' ', (text or '').strip()).lower()
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class VisionCache:
+    """图片描述缓存"""
+
+    def __init__(self,
+                 file_path: str = VisionConfig.CACHE_FILE,
+                 threshold: int = VisionConfig.CACHE_HAMMING_THRESHOLD,
+                 max_entries: int = VisionConfig.CACHE_MAX_ENTRIES):
+        self.file_path = file_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)[-self.max_entries:]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"加载图片描述缓存失败: {e}")
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok=True)
+            temp_path = self.file_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.file_path)
+        except OSError as e:
+            print(f"保存图片描述缓存失败: {e}")
+
+    def _distance(self, entry: Dict[str, Any], image_hash: int, text: str, digest: Optional[str]) -> Optional[int]:
+        """条目与图片的汉明距离，用户输入不同或摘要不同（照片条目的摘要为None）时返回None"""
+        if entry["text"] != text or entry.get("digest") != digest:
+            return None
+        return hamming_distance(image_hash, entry["hash"])
+
+    def lookup(self, image_hash: int, text: str, digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        查找用户输入相同、图片哈希足够接近的缓存描述
+
+        参数:
+            digest: 编码结果的摘要，文字/界面截图传入，只匹配摘要相同的条目；照片传None
+
+        返回:
+            命中的条目（包含description和distance），未命中返回None
+        """
+        text = normalize_text(text)
+        with self._lock:
+            best, best_distance = None, self.threshold + 1
+            for entry in self._entries:
+                distance = self._distance(entry, image_hash, text, digest)
+                if distance is None:
+                    continue
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+            if best is None:
+                return None
+            # 命中的条目移到最后，淘汰时最后才被移除
+            self._entries.remove(best)
+            self._entries.append(best)
+            best["hits"] += 1
+            return dict(best, distance=best_distance)
+
+    def store(self, image_hash: int, text: str, description: str, digest: Optional[str] = None):
+        """缓存一条描述，替换会被同样匹配到的旧条目，超出容量时淘汰最久未用的条目"""
+        text = normalize_text(text)
+        with self._lock:
+            kept = []
+            for entry in self._entries:
+                distance = self._distance(entry, image_hash, text, digest)
+                if distance is None or distance > self.threshold:
+                    kept.append(entry)
+            self._entries = kept
+            self._entries.append({
+                "hash": image_hash,
+                "digest": digest,
+                "text": text,
+                "description": description,
+                "created_at": time.time(),
+                "hits": 0
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries = self._entries[-self.max_entries:]
+            self._save()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries = []
+            self._save()
+
+
+# 全局图片描述缓存实例
+_vision_cache = None
+_vision_cache_lock = threading.Lock()
+
+def get_vision_cache() -> VisionCache:
+    """获取全局图片描述缓存实例"""
+    global _vision_cache
+    with _vision_cache_lock:
+        if _vision_cache is None:
+            _vision_cache = VisionCache()
+        return _vision_cache
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""工具结果存储的分段读取测试"""
+
+import json
+from config import ChatConfig
+from services.token_counter import estimate_tokens
+from services.tool_result_store import ToolResultStore, truncate_head_tail
+
+
+def test_read_pages_through_single_long_line(tmp_path):
+    """execute_command把输出转义成一行：超长的单行也要能分段读完"""
+    text = json.dumps("\n".join(f"line {i}: some command output" for i in range(4000)))[1:-1]
+    store = ToolResultStore(str(tmp_path))
+    result_id = store.save(text)
+
+    pages = []
+    start_line, start_offset = 1, 0
+    while start_line is not None:
+        page = store.read(result_id, start_line, start_offset)
+        assert page["status"] == "success"
+        assert estimate_tokens(page["content"]) <= ChatConfig.TOOL_RESULT_PAGE_TOKENS
+        pages.append(page["content"])
+        start_line, start_offset = page["next_start_line"], page["next_start_offset"]
+
+    assert len(pages) > 1
+    assert "".join(pages) == text
+
+
+def test_read_keeps_short_lines_whole(tmp_path):
+    text = "\n".join(["short"] * 10 + ["x" * 20000] + ["tail"])
+    store = ToolResultStore(str(tmp_path))
+    result_id = store.save(text)
+
+    page = store.read(result_id)
+    assert page["content"].split("\n")[:10] == ["short"] * 10
+    assert page["next_start_line"] == 11
+
+    contents = []
+    start_line, start_offset = 1, 0
+    while start_line is not None:
+        page = store.read(result_id, start_line, start_offset)
+        contents.append(page["content"])
+        start_line, start_offset = page["next_start_line"], page["next_start_offset"]
+    # 行内分段之间没有换行，行与行之间保留换行
+    assert "".join(contents).replace("\n", "") == text.replace("\n", "")
+
+
+def test_preview_keeps_head_and_tail_of_long_line():
+    line = "BEGIN" + "a" * 50000 + "END"
+    preview = truncate_head_tail([line], 1500)
+    assert len(preview) == 1
+    assert preview[0].startswith("BEGIN")
+    assert preview[0].endswith("END")
+    assert estimate_tokens(preview[0]) <= 750
@@ -1,6 +1,7 @@
 import subprocess
 import json
 from typing import Dict, Any, List, Union
+from services.cancellation import CancelledError, run_subprocess
 
 # 工具定义
 tool_definition = {
@@ -24,12 +25,13 @@ tool_definition = {
     }
 }
 
-def execute_command(commands: Union[List[str], str]) -> Dict[str, Any]:
+def execute_command(commands: Union[List[str], str], cancel_token=None) -> Dict[str, Any]:
     """
     在cmd中执行一条或多条指令
     
     Args:
         commands: 要执行的一条或多条命令
+        cancel_token: 取消令牌（由ChatService传入），取消时结束正在运行的命令
         
     Returns:
         包含执行结果和状态的字典，符合MCP工具调用返回格式
@@ -65,12 +67,11 @@ def execute_command(commands: Union[List[str], str]) -> Dict[str, Any]:
             
             # 执行命令
             try:
-                result = subprocess.run(
+                result = run_subprocess(
                     command, 
-                    shell=True, 
-                    capture_output=True, 
-                    text=True,
-                    timeout=30  # 设置超时防止长时间运行
+                    timeout=30,  # 设置超时防止长时间运行
+                    cancel_token=cancel_token,
+                    shell=True
                 )
                 
                 # 确保输出内容被正确转义
@@ -101,6 +102,8 @@ def execute_command(commands: Union[List[str], str]) -> Dict[str, Any]:
                 results.append(result)
                 all_success = False
                 
+    except CancelledError:
+        raise
     except Exception as e:
         # 返回MCP标准格式的错误响应
         return {
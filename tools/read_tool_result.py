@@ -0,0 +1,53 @@
+from typing import Dict, Any
+from services.tool_result_store import get_tool_result_store
+
+# 工具定义
+tool_definition = {
+    "type": "function",
+    "function": {
+        "name": "read_tool_result",
+        "description": "分段查看之前被截断的工具完整输出",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "result_id": {
+                    "type": "string",
+                    "description": "被截断的工具结果中给出的result_id"
+                },
+                "start_line": {
+                    "type": "integer",
+                    "description": "从第几行开始查看（从1开始），默认为1；可以使用上次返回的next_start_line继续查看"
+                },
+                "start_offset": {
+                    "type": "integer",
+                    "description": "从该行的第几个字符开始查看（从0开始），默认为0；继续查看时传入上次返回的next_start_offset"
+                }
+            },
+            "required": ["result_id"]
+        }
+    }
+}
+
+def read_tool_result(result_id: str, start_line: int = 1, start_offset: int = 0) -> Dict[str, Any]:
+    """
+    分段读取被截断的工具完整输出
+
+    Args:
+        result_id: 被截断的工具结果中给出的result_id
+        start_line: 起始行号（从1开始）
+        start_offset: 起始行内的字符偏移（从0开始）
+
+    Returns:
+        包含该段内容、行号范围和下一段起始位置的字典
+    """
+    try:
+        return get_tool_result_store().read(result_id, start_line, start_offset)
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"读取工具结果时发生异常: {str(e)}"
+        }
+
+# 标记为工具函数
+read_tool_result.is_tool = True
+read_tool_result.tool_definition = tool_definition
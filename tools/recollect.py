@@ -6,8 +6,7 @@ from typing import Dict, Any, List
 # 添加services目录到路径，以便导入memory模块
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'services'))
 
-from services.memory import ChatHistoryVectorDB
-from config import RAG_CONFIG
+from services.memory_server import create_vector_db
 
 # 工具定义
 tool_definition = {
@@ -42,10 +41,7 @@ def get_notes_db():
     global _notes_db
     if _notes_db is None:
         # 初始化笔记向量数据库
-        _notes_db = ChatHistoryVectorDB(
-            RAG_config=RAG_CONFIG,
-            db_name="memory"
-        )
+        _notes_db = create_vector_db("memory")
         # 加载现有笔记数据
         notes_file = os.path.join('data', 'memory.json')
         if os.path.exists(notes_file):
@@ -3,6 +3,7 @@ import json
 import os
 import tempfile
 from typing import Dict, Any
+from services.cancellation import CancelledError, run_subprocess
 
 # 工具定义
 tool_definition = {
@@ -27,13 +28,14 @@ tool_definition = {
     }
 }
 
-def run_python(file_path: str, file_content: str) -> Dict[str, Any]:
+def run_python(file_path: str, file_content: str, cancel_token=None) -> Dict[str, Any]:
     """
     创建Python程序并执行，等待执行完毕后获取输出
     
     Args:
         file_path: Python文件的路径
         file_content: Python文件的内容
+        cancel_token: 取消令牌（由ChatService传入），取消时结束正在运行的程序
         
     Returns:
         包含执行结果和状态的字典，符合MCP工具调用返回格式
@@ -49,11 +51,10 @@ def run_python(file_path: str, file_content: str) -> Dict[str, Any]:
             f.write(file_content)
         
         # 执行Python程序
-        result = subprocess.run(
+        result = run_subprocess(
             ['python', file_path], 
-            capture_output=True, 
-            text=True,
-            timeout=60  # 设置超时防止长时间运行
+            timeout=60,  # 设置超时防止长时间运行
+            cancel_token=cancel_token
         )
         
         # 构建结果
@@ -94,6 +95,8 @@ def run_python(file_path: str, file_content: str) -> Dict[str, Any]:
                 "text": f"Python程序执行超时: {file_path}"
             }]
         }
+    except CancelledError:
+        raise
     except Exception as e:
         return {
             "content": [{
@@ -0,0 +1,83 @@
+"""
+共享动画时钟
+所有装饰动画由同一个定时器驱动：没有订阅者或宠物隐藏时定时器停止，
+窗口被完全遮挡（未暴露）时跳过对应订阅者的重绘
+"""
+from PyQt5.QtCore import QObject, QTimer, QElapsedTimer
+from config import PetDecorationConfig
+
+
+class AnimationClock(QObject):
+    """共享动画时钟"""
+
+    def __init__(self, interval=PetDecorationConfig.ANIMATION_CLOCK_INTERVAL, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self._tick)
+        self.elapsed_timer = QElapsedTimer()
+        self.elapsed_timer.start()
+        self.subscribers = {}  # 回调 -> 所属窗口
+        self.paused = False
+
+    def elapsed_ms(self):
+        """时钟启动以来的毫秒数，动画按它计算当前帧"""
+        return self.elapsed_timer.elapsed()
+
+    def subscribe(self, callback, widget=None):
+        """
+        订阅时钟
+
+        参数:
+            callback: 每次tick调用，参数为elapsed_ms
+            widget: 所属窗口，隐藏或被遮挡时跳过回调
+        """
+        self.subscribers[callback] = widget
+        self._update_timer()
+
+    def unsubscribe(self, callback):
+        self.subscribers.pop(callback, None)
+        self._update_timer()
+
+    def pause(self):
+        """暂停时钟（宠物隐藏时）"""
+        self.paused = True
+        self._update_timer()
+
+    def resume(self):
+        """恢复时钟"""
+        self.paused = False
+        self._update_timer()
+
+    def _update_timer(self):
+        """只有存在订阅者且未暂停时才运行定时器"""
+        if self.subscribers and not self.paused:
+            if not self.timer.isActive():
+                self.timer.start()
+        else:
+            self.timer.stop()
+
+    @staticmethod
+    def _is_exposed(widget):
+        if widget is None:
+            return True
+        if not widget.isVisible():
+            return False
+        window = widget.windowHandle()
+        return window is None or window.isExposed()
+
+    def _tick(self):
+        elapsed = self.elapsed_ms()
+        for callback, widget in list(self.subscribers.items()):
+            if self._is_exposed(widget):
+                callback(elapsed)
+
+
+_animation_clock = None
+
+def get_animation_clock():
+    """获取全局共享的动画时钟"""
+    global _animation_clock
+    if _animation_clock is None:
+        _animation_clock = AnimationClock()
+    return _animation_clock
@@ -3,7 +3,7 @@
 """
 import random
 import os
-from PyQt5.QtWidgets import QWidget, QLabel, QVBoxLayout, QDesktopWidget
+from PyQt5.QtWidgets import QWidget, QLabel, QVBoxLayout, QDesktopWidget, QApplication
 from PyQt5.QtCore import Qt, QPoint, QTimer, pyqtSignal
 from PyQt5.QtGui import QPixmap
 from dotenv import load_dotenv
@@ -23,6 +23,8 @@ from .options_panel import OptionsPanel
 from services.chat import ChatService
 from services.vision import VisionService
 from services.screenshot_capture import ScreenshotCapture
+from services.chat_events import TextDelta, ToolStarted, ToolFinished
+from services.context_builder import get_context_builder
 
 # 导入配置
 from config import PetConfig, BubbleConfig, SystemConfig
@@ -42,9 +44,19 @@ class DesktopPet(QWidget):
         self.message_bubble = None
         self.bubble_hide_timer = None  # 保存气泡隐藏计时器的引用
         self.ai_thread = None
+        self._cancelled_threads = []  # 已取消、正在收尾的AI和VLM线程
         self.vision_thread = None
         self.screenshot_capture = None
         
+        # 流式事件累积：逐token到达的事件先放入缓冲，按固定帧率合并刷新到气泡
+        self._pending_events = []
+        self._stream_text = ""
+        self._stream_replaceable = True  # 气泡当前只有占位文本或工具调用提示，下一段文本到达时替换
+        self._vision_partial = None  # 尚未刷新到气泡的最新图片描述
+        self.stream_flush_timer = QTimer(self)
+        self.stream_flush_timer.setInterval(BubbleConfig.STREAM_FLUSH_INTERVAL)
+        self.stream_flush_timer.timeout.connect(self._flush_stream_events)
+        
         # 初始化装饰管理器
         self.decoration_manager = PetDecorationManager(self)
         
@@ -170,6 +182,24 @@ class DesktopPet(QWidget):
     def mouseReleaseEvent(self, event):
         """鼠标释放事件"""
         self.event_handler.handle_mouse_release(event)
+        
+    def moveEvent(self, event):
+        """窗口移动事件：由移动驱动跟随窗口更新，不再定时轮询位置"""
+        super().moveEvent(event)
+        self.event_handler.handle_move()
+        
+    def hideEvent(self, event):
+        """隐藏时进入低功耗模式，停止所有周期性定时器"""
+        super().hideEvent(event)
+        self.stream_flush_timer.stop()
+        self.decoration_manager.pause()
+        
+    def showEvent(self, event):
+        """重新显示时恢复定时器，并把隐藏期间缓冲的回复刷新到气泡"""
+        super().showEvent(event)
+        self.decoration_manager.resume()
+        if self._pending_events or self._vision_partial is not None:
+            self.stream_flush_timer.start()
                 
     def update_following_windows(self):
         """更新所有跟随窗口的位置"""
@@ -209,11 +239,8 @@ class DesktopPet(QWidget):
         # 停止思考定时器和加载圈
         self.decoration_manager.stop_thinking_timer()
         
-        # 停止AI线程
-        if self.ai_thread and self.ai_thread.isRunning():
-            self.ai_thread.terminate()
-            self.ai_thread.wait()
-            self.ai_thread = None
+        # 取消AI线程（关闭流式连接、结束正在运行的工具）
+        self._cancel_ai_thread()
             
         # 隐藏消息气泡
         if self.message_bubble:
@@ -285,13 +312,16 @@ class DesktopPet(QWidget):
                 self.message_bubble.set_text("查看图片中...")
                 self.message_bubble.update_position()
             
-            # 如果已有VLM线程在运行，先停止它
-            if self.vision_thread and self.vision_thread.isRunning():
-                self.vision_thread.terminate()
-                self.vision_thread.wait()
+            # 如果已有VLM线程在运行，先取消它
+            self._cancel_vision_thread()
+            
+            # 等待图片描述的同时，用用户的文字提前检索记忆和笔记
+            if message.strip():
+                get_context_builder().prefetch_context(message)
             
             # 创建并启动VLM处理线程
             self.vision_thread = VisionProcessThread(self.vision_service, image, message)
+            self.vision_thread.vision_progress.connect(self.on_vision_progress)
             self.vision_thread.vision_completed.connect(self.on_vision_completed)
             self.vision_thread.vision_failed.connect(self.on_vision_failed)
             self.vision_thread.start()
@@ -300,10 +330,17 @@ class DesktopPet(QWidget):
             print(f"启动VLM线程失败: {e}")
             self.on_vision_failed(str(e), message)
     
+    def on_vision_progress(self, partial_description):
+        """记录正在生成的图片描述，和对话流一样由定时器按帧率刷新到气泡"""
+        self._vision_partial = partial_description
+        if self.isVisible() and not self.stream_flush_timer.isActive():
+            self.stream_flush_timer.start()
+    
     def on_vision_completed(self, final_message, original_message):
         """VLM处理完成回调"""
         try:
             print(f"VLM处理完成: {final_message[:100]}...")
+            self._vision_partial = None
             
             # 更新提示为"思考中..."并重新启动思考定时器
             if self.message_bubble:
@@ -312,8 +349,8 @@ class DesktopPet(QWidget):
                 # 重新启动思考定时器，因为现在开始真正的AI思考
                 self.decoration_manager.start_thinking_timer()
             
-            # 发送给LLM处理
-            self.process_ai_response_stream(final_message)
+            # 发送给LLM处理，检索使用用户的原始输入（已提前检索）
+            self.process_ai_response_stream(final_message, original_message if original_message.strip() else None)
             
         except Exception as e:
             print(f"VLM完成回调处理失败: {e}")
@@ -329,6 +366,7 @@ class DesktopPet(QWidget):
         """VLM处理失败回调"""
         try:
             print(f"VLM处理失败: {error_message}")
+            self._vision_partial = None
             
             # 停止思考定时器
             self.decoration_manager.stop_thinking_timer()
@@ -389,7 +427,21 @@ class DesktopPet(QWidget):
                     self.screenshot_capture.deleteLater()
                 except:
                     pass
+                self.screenshot_capture = None
             
+            # 截图选择器创建时就会冻结屏幕画面：先处理完隐藏产生的事件，
+            # 再在下一轮事件循环中创建，避免面板被截进去
+            QApplication.processEvents()
+            QTimer.singleShot(0, self._show_screenshot_selector)
+            
+        except Exception as e:
+            print(f"启动截图失败: {e}")
+            # 如果截图失败，重新显示面板
+            self.show_input_window()
+    
+    def _show_screenshot_selector(self):
+        """创建并显示截图选择器"""
+        try:
             # 创建截图捕获器，设置父窗口
             self.screenshot_capture = ScreenshotCapture(self)
             self.screenshot_capture.screenshot_captured.connect(self.on_screenshot_captured)
@@ -481,17 +533,66 @@ class DesktopPet(QWidget):
 
     def append_ai_response(self, text_chunk):
         """追加AI回复文本块"""
-        # AI开始响应时，停止思考定时器和加载圈
-        self.decoration_manager.stop_thinking_timer()
-        
-        if self.message_bubble:
-            current_text = self.message_bubble.get_current_text()
-            # 如果当前文本是"思考中..."或者只包含工具调用信息（以">"开头），则清空
-            if current_text == "思考中..." or (current_text.strip().startswith(">") and not any(c.isalnum() and not c.isascii() for c in current_text.replace(">", "").replace("工具调用", "").replace("：", ""))):
-                current_text = ""
-            new_text = current_text + text_chunk
-            print(text_chunk, end="")
-            self.message_bubble.set_text(new_text)
+        self.on_chat_event(TextDelta(text_chunk))
+
+    def on_chat_event(self, event):
+        """接收对话流事件（只放入缓冲，由定时器按帧率合并刷新；隐藏时只缓冲）"""
+        if not self._pending_events and not self.stream_flush_timer.isActive():
+            # AI开始响应时，停止思考定时器和加载圈
+            self.decoration_manager.stop_thinking_timer()
+            if self.isVisible():
+                self.stream_flush_timer.start()
+        self._pending_events.append(event)
+
+    def _reset_stream_state(self):
+        """开始新一轮流式输出前清空累积状态"""
+        self.stream_flush_timer.stop()
+        self._pending_events = []
+        self._stream_text = ""
+        self._stream_replaceable = True
+        self._vision_partial = None
+
+    def _flush_stream_events(self):
+        """把缓冲中的事件合并刷新到气泡，只处理新到达的部分"""
+        if self._vision_partial is not None:
+            partial, self._vision_partial = self._vision_partial, None
+            if self.message_bubble:
+                self.message_bubble.set_text(f"查看图片中...\n{partial}")
+                self.message_bubble.update_position()
+        if not self._pending_events:
+            self.stream_flush_timer.stop()
+            return
+        events = self._pending_events
+        self._pending_events = []
+
+        changed = False
+        printed = []
+        for event in events:
+            if isinstance(event, TextDelta):
+                # 气泡里只有"思考中..."或工具调用提示时，用回复文本替换
+                if self._stream_replaceable:
+                    self._stream_text = event.text
+                    self._stream_replaceable = False
+                else:
+                    self._stream_text += event.text
+                printed.append(event.text)
+                changed = True
+            elif isinstance(event, ToolStarted):
+                # 第一个提示替换"思考中..."（此时累积文本为空），之后的提示依次追加，多个工具都能看到
+                marker = f"> {event.display_name}\n"
+                if self._stream_text and not self._stream_text.endswith("\n"):
+                    self._stream_text += "\n"
+                self._stream_text += marker
+                printed.append(marker)
+                changed = True
+            elif isinstance(event, ToolFinished):
+                source = "，提前执行" if event.speculative else ""
+                printed.append(f"[{event.name} 完成，耗时 {event.duration:.2f}s{source}]\n")
+        if printed:
+            print("".join(printed), end="", flush=True)
+
+        if changed and self.message_bubble:
+            self.message_bubble.set_text(self._stream_text)
             self.message_bubble.update_position()
 
     def show_ai_response(self, response):
@@ -531,22 +632,69 @@ class DesktopPet(QWidget):
             self.message_bubble.close()
             self.message_bubble = None
     
-    def process_ai_response_stream(self, message):
-        """处理AI流式回复（使用QThread）"""
-        # 如果已有线程在运行，先停止它
-        if self.ai_thread and self.ai_thread.isRunning():
-            self.ai_thread.terminate()
-            self.ai_thread.wait()
+    def process_ai_response_stream(self, message, retrieval_query=None):
+        """
+        处理AI流式回复（使用QThread）
+        
+        参数:
+            message: 发送给模型的消息
+            retrieval_query: 检索记忆和笔记用的查询，默认为message
+        """
+        # 如果已有线程在运行，先取消它
+        self._cancel_ai_thread()
+        self._reset_stream_state()
         
         # 创建并启动新线程
-        self.ai_thread = AIResponseThread(self.chat_service, message)
-        self.ai_thread.response_chunk.connect(self.append_ai_response)
-        self.ai_thread.finished.connect(self.on_ai_response_finished)
+        self.ai_thread = AIResponseThread(self.chat_service, message, retrieval_query)
+        self.ai_thread.chat_event.connect(self.on_chat_event)
+        self.ai_thread.response_finished.connect(self.on_ai_response_finished)
         self.ai_thread.start()
 
+    def _cancel_ai_thread(self):
+        """取消当前AI线程，不阻塞界面；线程收尾后自行清理"""
+        thread = self.ai_thread
+        self.ai_thread = None
+        if thread and thread.isRunning():
+            self._retire_thread(thread, [thread.chat_event, thread.response_finished])
+    
+    def _cancel_vision_thread(self):
+        """取消当前VLM线程（关闭流式连接，归还端点池的并发名额），不阻塞界面"""
+        thread = self.vision_thread
+        self.vision_thread = None
+        self._vision_partial = None
+        if thread and thread.isRunning():
+            self._retire_thread(thread, [thread.vision_progress, thread.vision_completed, thread.vision_failed])
+    
+    def _retire_thread(self, thread, signals):
+        """断开线程的界面信号并取消它，线程退出后自行清理"""
+        # 断开界面信号，避免旧线程的内容继续显示
+        for signal in signals:
+            try:
+                signal.disconnect()
+            except TypeError:
+                pass
+        
+        # 保留引用直到线程真正退出，避免QThread在运行中被销毁；
+        # QThread.finished在线程以任何方式退出后都会发出，排队到UI线程中清理
+        self._cancelled_threads.append(thread)
+        thread.finished.connect(lambda: self._cleanup_cancelled_thread(thread), Qt.QueuedConnection)
+        thread.cancel()
+        if thread.isFinished():
+            # 连接信号前线程已经退出
+            self._cleanup_cancelled_thread(thread)
+        
+    def _cleanup_cancelled_thread(self, thread):
+        """清理已取消的线程"""
+        thread.wait()
+        if thread in self._cancelled_threads:
+            self._cancelled_threads.remove(thread)
 
     def on_ai_response_finished(self):
         """AI响应完成后的处理"""
+        # 把还在缓冲中的文本刷新到气泡
+        self._flush_stream_events()
+        self.stream_flush_timer.stop()
+        
         # 停止思考定时器和加载圈
         self.decoration_manager.stop_thinking_timer()
         
@@ -734,13 +882,13 @@ class DesktopPet(QWidget):
         # 清理装饰
         self.decoration_manager.cleanup()
         
-        # 停止AI线程和VLM线程
-        if self.ai_thread and self.ai_thread.isRunning():
-            self.ai_thread.terminate()
-            self.ai_thread.wait()
-        if self.vision_thread and self.vision_thread.isRunning():
-            self.vision_thread.terminate()
-            self.vision_thread.wait()
+        # 取消AI和VLM线程，超时未退出时强制结束
+        for thread in [self.ai_thread, self.vision_thread] + self._cancelled_threads:
+            if thread and thread.isRunning():
+                thread.cancel()
+                if not thread.wait(2000):
+                    thread.terminate()
+                    thread.wait()
         
         # 关闭子窗口
         if self.input_window:
@@ -4,7 +4,6 @@
 """
 from PyQt5.QtCore import Qt, QPoint, QTimer, QObject, pyqtSignal
 from PyQt5.QtGui import QMouseEvent
-from config import PetConfig
 
 
 class EventHandler(QObject):
@@ -25,11 +24,6 @@ class EventHandler(QObject):
         self.right_click_timer.timeout.connect(self.right_click_detected.emit)
         self.debounce_delay = 200  # 200ms防抖延迟
         
-        # 定时器用于检测位置变化
-        self.move_timer = QTimer()
-        self.move_timer.timeout.connect(self._check_position_change)
-        self.move_timer.start(PetConfig.POSITION_CHECK_INTERVAL)
-        
     def handle_mouse_press(self, event: QMouseEvent):
         """处理鼠标按下事件"""
         if event.button() == Qt.LeftButton:
@@ -46,6 +40,7 @@ class EventHandler(QObject):
         if event.buttons() == Qt.LeftButton and not self.drag_position.isNull():
             self.parent_widget.move(event.globalPos() - self.drag_position)
             # 实时更新跟随窗口位置
+            self.last_position = self.parent_widget.pos()
             self.position_changed.emit()
             event.accept()
             
@@ -56,13 +51,13 @@ class EventHandler(QObject):
             self.last_position = self.parent_widget.pos()
             event.accept()
             
-    def _check_position_change(self):
-        """检查位置变化并发出信号"""
-        if not self.is_dragging and self.parent_widget:
+    def handle_move(self):
+        """处理窗口移动事件（moveEvent），位置确实变化时发出信号"""
+        if self.parent_widget:
             current_pos = self.parent_widget.pos()
             if current_pos != self.last_position:
-                self.position_changed.emit()
                 self.last_position = current_pos
+                self.position_changed.emit()
                 
     def update_last_position(self):
         """更新最后位置"""
@@ -71,7 +66,5 @@ class EventHandler(QObject):
             
     def stop_timers(self):
         """停止所有定时器"""
-        if self.move_timer:
-            self.move_timer.stop()
         if self.right_click_timer:
             self.right_click_timer.stop()
\ No newline at end of file
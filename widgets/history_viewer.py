@@ -1,349 +1,361 @@
 # -*- coding: utf-8 -*-
 """
 历史记录查看器
-支持懒加载和用户友好的显示
+基于模型/视图的虚拟化列表：记录按需分页读取，只绘制可见的行，
+行高按宽度缓存，工具调用详情在展开时才格式化。
+过长的文本只显示前几行并标出已折叠，点击后在可选择文本的窗口中查看全文
 """
 import json
-import os
-from datetime import datetime
-from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QScrollArea, QLabel, 
-                             QPushButton, QFrame, QHBoxLayout, QTextEdit, QToolButton)
-from PyQt5.QtCore import Qt, pyqtSignal, QTimer
-from PyQt5.QtGui import QFont, QTextCursor
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QLabel, QListView, QDialog, QTextEdit,
+                             QStyledItemDelegate, QAbstractItemView, QApplication)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QRect, QEvent
+from PyQt5.QtGui import QFont, QColor, QFontMetrics, QPen, QPainter
+from services.history_index import get_history_index
+
+
+class HistoryListModel(QAbstractListModel):
+    """历史记录列表模型，最新的记录在最前，滚动到底部时分页加载"""
+
+    RecordRole = Qt.UserRole + 1
+
+    def __init__(self, history_index, batch_size: int = 20, parent=None):
+        super().__init__(parent)
+        self.history_index = history_index
+        self.batch_size = batch_size
+        self.total_count = 0  # 索引中的记录总数
+        self.consumed = 0  # 已读取的索引行数（包括无法解析而被跳过的行）
+        self.records = []
+        self.expanded = {}  # 行号 -> 已展开的工具调用序号集合
+
+    def reload(self):
+        """重新同步索引并清空已加载的记录"""
+        self.beginResetModel()
+        self.total_count = self.history_index.refresh()
+        self.consumed = 0
+        self.records = []
+        self.expanded = {}
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.records[index.row()]
+        if role == self.RecordRole:
+            return record
+        if role == Qt.DisplayRole:
+            return record.get('user_input', '')
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.consumed < self.total_count
+
+    def fetchMore(self, parent=QModelIndex()):
+        """从最新的记录开始倒序读取下一页"""
+        if parent.isValid():
+            return
+        count = min(self.batch_size, self.total_count - self.consumed)
+        if count <= 0:
+            return
+        page = self.history_index.read_reverse(self.consumed, count, self.total_count)
+        self.consumed += count
+        if not page:
+            return
+        start = len(self.records)
+        self.beginInsertRows(QModelIndex(), start, start + len(page) - 1)
+        self.records.extend(page)
+        self.endInsertRows()
+
+    def is_expanded(self, row: int, tool_index: int) -> bool:
+        return tool_index in self.expanded.get(row, ())
+
+    def toggle_tool(self, row: int, tool_index: int):
+        """展开/折叠某条记录中的一个工具调用"""
+        expanded = self.expanded.setdefault(row, set())
+        expanded ^= {tool_index}
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+def _format_json(value) -> str:
+    """尽量把JSON字符串格式化为缩进形式"""
+    try:
+        parsed = json.loads(value) if isinstance(value, str) else value
+        return json.dumps(parsed, indent=2, ensure_ascii=False)
+    except Exception:
+        return str(value)
+
+
+class HistoryTextDialog(QDialog):
+    """查看一段历史文本的全文（可选择、可滚动）"""
+
+    def __init__(self, title: str, text: str, font: QFont, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        self.resize(560, 480)
+        layout = QVBoxLayout(self)
+        editor = QTextEdit()
+        editor.setReadOnly(True)
+        editor.setFont(font)
+        editor.setPlainText(text)
+        layout.addWidget(editor)
+
+
+class HistoryItemDelegate(QStyledItemDelegate):
+    """绘制单条历史记录，布局按(行, 宽度, 展开状态)缓存"""
+
+    MARGIN = 5  # 记录之间的间距的一半
+    PADDING = 10  # 记录内边距
+    SPACING = 6  # 块之间的间距
+    BOX_PADDING = 5  # 文本框内边距
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.time_font = QFont("Arial", 9)
+        self.label_font = QFont("Arial", 10, QFont.Bold)
+        self.text_font = QFont("Arial", 9)
+        self.tool_title_font = QFont("Arial", 9, QFont.Bold)
+        self.detail_font = QFont("Consolas", 8)
+        self.detail_font.setStyleHint(QFont.Monospace)
+        self._layout_cache = {}
+
+    def clear_cache(self):
+        self._layout_cache = {}
+
+    def _view_width(self, option) -> int:
+        view = self.parent()
+        if view is not None:
+            return view.viewport().width()
+        return option.rect.width()
+
+    def _layout(self, index, width: int):
+        """
+        计算记录的布局
+
+        返回:
+            (高度, 块列表)，块为(类型, 相对矩形, 文本, 字体, 颜色, 附加数据)。
+            附加数据对'toggle'是工具序号，对被折叠的文本和'more'提示是(标题, 全文, 字体)
+        """
+        model = index.model()
+        row = index.row()
+        expanded = frozenset(model.expanded.get(row, ()))
+        key = (row, width, expanded)
+        cached = self._layout_cache.get(key)
+        if cached is not None:
+            return cached
+
+        record = model.data(index, HistoryListModel.RecordRole)
+        left = self.MARGIN + self.PADDING
+        inner = max(50, width - 2 * left)
+        blocks = []
+        y = self.MARGIN + self.PADDING
+
+        def add(kind, text, font, color, indent=0, max_lines=None, tool=None, title=None):
+            nonlocal y
+            box = self.BOX_PADDING if kind in ('box', 'detail') else 0
+            text_width = inner - indent - 2 * box
+            metrics = QFontMetrics(font)
+            height = metrics.boundingRect(QRect(0, 0, text_width, 100000), Qt.TextWordWrap, text).height()
+            folded = bool(max_lines) and height > metrics.lineSpacing() * max_lines
+            if folded:
+                height = metrics.lineSpacing() * max_lines
+                tool = (title, text, font)
+            rect = QRect(left + indent + box, y + box, text_width, height)
+            blocks.append((kind, rect, text, font, color, tool))
+            y += height + 2 * box + self.SPACING
+            if folded:
+                # 折叠提示紧贴在文本框下方
+                y -= self.SPACING
+                more_height = QFontMetrics(self.time_font).lineSpacing()
+                blocks.append(('more', QRect(left + indent, y, text_width, more_height),
+                               "… 已折叠，点击查看全文", self.time_font, QColor("#2196F3"), tool))
+                y += more_height + self.SPACING
+
+        timestamp = record.get('timestamp', '')
+        if timestamp:
+            add('text', f"🕐 {timestamp}", self.time_font, QColor("#666666"))
+
+        if record.get('user_input'):
+            add('text', "你:", self.label_font, QColor("#2196F3"))
+            add('box', record['user_input'], self.text_font, QColor("#000000"), max_lines=6, title="你")
+
+        if record.get('ai_response'):
+            add('text', "银狼:", self.label_font, QColor("#9c27b0"))
+            add('box', record['ai_response'], self.text_font, QColor("#000000"), max_lines=10, title="银狼")
+
+        tool_calls = record.get('tool_calls') or []
+        if tool_calls:
+            add('text', f"🔧 工具调用 ({len(tool_calls)}次):", self.tool_title_font, QColor("#FF9800"))
+            responses = {resp.get('tool_call_id'): resp for resp in record.get('tool_responses', [])}
+            for i, tool_call in enumerate(tool_calls):
+                name = tool_call.get('function', {}).get('name', '未知')
+                is_open = i in expanded
+                arrow = "▾" if is_open else "▸"
+                add('toggle', f"  {arrow}  {name}", self.text_font,
+                    QColor("#FF9800") if is_open else QColor("#666666"), indent=10, tool=i)
+                if not is_open:
+                    continue
+                # 只有展开时才格式化详情
+                arguments = tool_call.get('function', {}).get('arguments', '')
+                if arguments:
+                    add('text', "📥 输入:", self.tool_title_font, QColor("#666666"), indent=30)
+                    add('detail', _format_json(arguments), self.detail_font, QColor("#000000"),
+                        indent=30, max_lines=8, title=f"{name} 输入")
+                response = responses.get(tool_call.get('id', ''))
+                if response:
+                    add('text', "📤 输出:", self.tool_title_font, QColor("#666666"), indent=30)
+                    add('detail', _format_json(response.get('content', '')), self.detail_font,
+                        QColor("#000000"), indent=30, max_lines=12, title=f"{name} 输出")
+
+        height = y - self.SPACING + self.PADDING + self.MARGIN
+        result = (height, blocks)
+        self._layout_cache[key] = result
+        return result
+
+    def sizeHint(self, option, index):
+        width = self._view_width(option)
+        height, _ = self._layout(index, width)
+        return QSize(width, height)
+
+    def paint(self, painter, option, index):
+        height, blocks = self._layout(index, option.rect.width())
+        origin = option.rect.topLeft()
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        # 记录背景
+        frame = option.rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor("#f5f5f5"))
+        painter.drawRoundedRect(frame, 8, 8)
+
+        for kind, rect, text, font, color, _ in blocks:
+            rect = rect.translated(origin)
+            if kind in ('box', 'detail'):
+                box = rect.adjusted(-self.BOX_PADDING, -self.BOX_PADDING, self.BOX_PADDING, self.BOX_PADDING)
+                painter.setPen(QPen(QColor("#dddddd" if kind == 'box' else "#E0E0E0")))
+                painter.setBrush(QColor("#ffffff" if kind == 'box' else "#FAFAFA"))
+                painter.drawRoundedRect(box, 4, 4)
+            painter.setFont(font)
+            painter.setPen(color)
+            painter.save()
+            painter.setClipRect(rect)
+            painter.drawText(rect, Qt.TextWordWrap, text)
+            painter.restore()
+
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        """点击工具调用行时展开/折叠，点击被折叠的文本时查看全文，双击复制记录内容"""
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            _, blocks = self._layout(index, option.rect.width())
+            position = event.pos() - option.rect.topLeft()
+            for kind, rect, _, _, _, data in blocks:
+                if not rect.contains(position):
+                    continue
+                if kind == 'toggle':
+                    model.toggle_tool(index.row(), data)
+                    self.sizeHintChanged.emit(index)
+                    return True
+                if isinstance(data, tuple):
+                    title, text, font = data
+                    parent = self.parent().window() if self.parent() is not None else None
+                    HistoryTextDialog(title, text, font, parent).show()
+                    return True
+        elif event.type() == QEvent.MouseButtonDblClick:
+            record = model.data(index, HistoryListModel.RecordRole)
+            QApplication.clipboard().setText(
+                f"你: {record.get('user_input', '')}\n银狼: {record.get('ai_response', '')}")
+            return True
+        return super().editorEvent(event, model, option, index)
 
 
 class HistoryViewer(QWidget):
     """历史记录查看器窗口"""
-    
+
     def __init__(self):
         super().__init__()
         self.history_file = "data/history.jsonl"
-        self.all_records = []  # 所有历史记录
-        self.displayed_count = 0  # 已显示的记录数
+        self.history_index = get_history_index(self.history_file)
         self.batch_size = 20  # 每次加载的记录数
-        self.loading = False  # 是否正在加载
-        
+
         self.setup_ui()
-        
+
     def setup_ui(self):
         """设置界面"""
         self.setWindowTitle("历史记录")
         self.setWindowFlags(Qt.Window)
         self.resize(600, 700)
-        
+
         # 主布局
         main_layout = QVBoxLayout(self)
         main_layout.setContentsMargins(10, 10, 10, 10)
-        
+
         # 标题
         title = QLabel("对话历史")
         title.setFont(QFont("Arial", 14, QFont.Bold))
         title.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(title)
-        
-        # 滚动区域
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        
-        # 内容容器
-        self.content_widget = QWidget()
-        self.content_layout = QVBoxLayout(self.content_widget)
-        self.content_layout.setAlignment(Qt.AlignTop)
-        self.content_layout.setSpacing(10)
-        
-        self.scroll_area.setWidget(self.content_widget)
-        main_layout.addWidget(self.scroll_area)
-        
-        # 监听滚动事件
-        self.scroll_area.verticalScrollBar().valueChanged.connect(self.on_scroll)
-        
+
+        # 虚拟化列表：只绘制可见的记录，滚动到底部时模型自动加载下一页
+        self.model = HistoryListModel(self.history_index, self.batch_size, self)
+        self.list_view = QListView()
+        self.delegate = HistoryItemDelegate(self.list_view)
+        self.list_view.setModel(self.model)
+        self.list_view.setItemDelegate(self.delegate)
+        self.list_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.list_view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.list_view.verticalScrollBar().setSingleStep(20)
+        self.list_view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.list_view.setResizeMode(QListView.Adjust)
+        self.list_view.setStyleSheet("QListView { border: none; background: transparent; }")
+        main_layout.addWidget(self.list_view)
+
+        self.model.rowsInserted.connect(self.update_status)
+        self.model.modelReset.connect(self.update_status)
+
         # 底部提示
         self.status_label = QLabel("")
         self.status_label.setAlignment(Qt.AlignCenter)
         self.status_label.setStyleSheet("color: #666; font-size: 10pt;")
         main_layout.addWidget(self.status_label)
-        
+
     def load_initial_records(self):
         """加载初始记录"""
-        if not os.path.exists(self.history_file):
-            self.status_label.setText("暂无历史记录")
-            return
-            
         try:
-            # 读取所有记录（不倒序，保持原始顺序，最新的在文件末尾）
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                # 倒序读取，让最新的记录在列表开头
-                self.all_records = [json.loads(line) for line in reversed(lines) if line.strip()]
-            
+            self.delegate.clear_cache()
+            self.model.reload()
+            if self.model.total_count == 0:
+                self.status_label.setText("暂无历史记录")
+                return
             # 加载第一批
-            self.load_more_records()
-            
+            self.model.fetchMore()
         except Exception as e:
             self.status_label.setText(f"加载失败: {str(e)}")
-    
-    def load_more_records(self):
-        """加载更多记录"""
-        if self.loading:
-            return
-            
-        self.loading = True
-        self.status_label.setText("加载中...")
-        
-        # 计算要加载的记录范围
-        start = self.displayed_count
-        end = min(start + self.batch_size, len(self.all_records))
-        
-        if start >= len(self.all_records):
-            self.status_label.setText("已加载全部记录")
-            self.loading = False
+
+    def update_status(self, *args):
+        """更新底部的加载状态"""
+        total = self.model.total_count
+        if not total:
             return
-        
-        # 添加记录到界面
-        for i in range(start, end):
-            record = self.all_records[i]
-            self.add_record_widget(record)
-        
-        self.displayed_count = end
-        
-        # 更新状态
-        if self.displayed_count >= len(self.all_records):
-            self.status_label.setText(f"已加载全部 {len(self.all_records)} 条记录")
+        if self.model.canFetchMore():
+            self.status_label.setText(f"已加载 {self.model.consumed}/{total} 条，向下滚动加载更多")
         else:
-            self.status_label.setText(f"已加载 {self.displayed_count}/{len(self.all_records)} 条，向下滚动加载更多")
-        
-        self.loading = False
-    
-    def add_record_widget(self, record):
-        """添加单条记录到界面"""
-        # 创建记录容器
-        record_frame = QFrame()
-        record_frame.setFrameShape(QFrame.StyledPanel)
-        record_frame.setStyleSheet("""
-            QFrame {
-                background-color: #f5f5f5;
-                border-radius: 8px;
-                padding: 10px;
-            }
-        """)
-        
-        record_layout = QVBoxLayout(record_frame)
-        record_layout.setSpacing(8)
-        
-        # 时间戳
-        timestamp = record.get('timestamp', '')
-        if timestamp:
-            time_label = QLabel(f"🕐 {timestamp}")
-            time_label.setStyleSheet("color: #666; font-size: 9pt;")
-            record_layout.addWidget(time_label)
-        
-        # 用户输入
-        if 'user_input' in record and record['user_input']:
-            user_label = QLabel("你:")
-            user_label.setStyleSheet("color: #2196F3; font-weight: bold; font-size: 10pt;")
-            record_layout.addWidget(user_label)
-            
-            user_text = QTextEdit()
-            user_text.setPlainText(record['user_input'])
-            user_text.setReadOnly(True)
-            user_text.setMaximumHeight(100)
-            user_text.setStyleSheet("""
-                QTextEdit {
-                    background-color: white;
-                    border: 1px solid #ddd;
-                    border-radius: 4px;
-                    padding: 5px;
-                    font-size: 9pt;
-                }
-            """)
-            record_layout.addWidget(user_text)
-        
-        # AI回复
-        if 'ai_response' in record and record['ai_response']:
-            ai_label = QLabel("银狼:")
-            ai_label.setStyleSheet("color: #9c27b0; font-weight: bold; font-size: 10pt;")
-            record_layout.addWidget(ai_label)
-            
-            ai_text = QTextEdit()
-            ai_text.setPlainText(record['ai_response'])
-            ai_text.setReadOnly(True)
-            ai_text.setMaximumHeight(150)
-            ai_text.setStyleSheet("""
-                QTextEdit {
-                    background-color: white;
-                    border: 1px solid #ddd;
-                    border-radius: 4px;
-                    padding: 5px;
-                    font-size: 9pt;
-                }
-            """)
-            record_layout.addWidget(ai_text)
-        
-        # 工具调用（可折叠）
-        if 'tool_calls' in record and record['tool_calls']:
-            tool_responses = record.get('tool_responses', [])
-            
-            # 工具调用标题
-            tool_label = QLabel(f"🔧 工具调用 ({len(record['tool_calls'])}次):")
-            tool_label.setStyleSheet("color: #FF9800; font-weight: bold; font-size: 9pt;")
-            record_layout.addWidget(tool_label)
-            
-            # 每个工具调用都可以下拉
-            for i, tool_call in enumerate(record['tool_calls']):
-                tool_collapsible = self.create_collapsible_tool(tool_call, tool_responses, i)
-                record_layout.addWidget(tool_collapsible)
-        
-        # 添加到布局末尾（最新记录在底部，因为我们倒序读取）
-        self.content_layout.addWidget(record_frame)
-    
-    def create_collapsible_tool(self, tool_call, tool_responses, index):
-        """创建可折叠的工具调用部件"""
-        
-        # 容器
-        container = QWidget()
-        container_layout = QVBoxLayout(container)
-        container_layout.setContentsMargins(10, 0, 0, 0)
-        container_layout.setSpacing(5)
-        
-        # 工具名称和折叠按钮（简洁样式，类似列表项）
-        tool_name = tool_call.get('function', {}).get('name', '未知')
-        toggle_button = QPushButton(f"  ▸  {tool_name}")
-        toggle_button.setCheckable(True)
-        toggle_button.setChecked(False)
-        toggle_button.setFlat(True)
-        toggle_button.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                border: none;
-                padding: 2px;
-                text-align: left;
-                font-size: 9pt;
-                color: #666;
-            }
-            QPushButton:hover {
-                color: #FF9800;
-            }
-            QPushButton:checked {
-                color: #FF9800;
-            }
-        """)
-        container_layout.addWidget(toggle_button)
-        
-        # 详细信息容器（默认隐藏）
-        details_widget = QWidget()
-        details_layout = QVBoxLayout(details_widget)
-        details_layout.setContentsMargins(20, 5, 0, 5)
-        details_layout.setSpacing(5)
-        
-        # 输入参数
-        tool_args = tool_call.get('function', {}).get('arguments', '')
-        if tool_args:
-            input_label = QLabel("📥 输入:")
-            input_label.setStyleSheet("color: #666; font-size: 9pt; font-weight: bold;")
-            details_layout.addWidget(input_label)
-            
-            input_text = QTextEdit()
-            try:
-                # 尝试格式化 JSON
-                args_dict = json.loads(tool_args) if isinstance(tool_args, str) else tool_args
-                formatted_args = json.dumps(args_dict, indent=2, ensure_ascii=False)
-                input_text.setPlainText(formatted_args)
-            except:
-                input_text.setPlainText(str(tool_args))
-            
-            input_text.setReadOnly(True)
-            input_text.setMaximumHeight(100)
-            input_text.setStyleSheet("""
-                QTextEdit {
-                    background-color: #FAFAFA;
-                    border: 1px solid #E0E0E0;
-                    border-radius: 4px;
-                    padding: 5px;
-                    font-size: 8pt;
-                    font-family: Consolas, monospace;
-                }
-            """)
-            details_layout.addWidget(input_text)
-        
-        # 输出结果
-        tool_call_id = tool_call.get('id', '')
-        tool_response = None
-        for resp in tool_responses:
-            if resp.get('tool_call_id') == tool_call_id:
-                tool_response = resp
-                break
-        
-        if tool_response:
-            output_label = QLabel("📤 输出:")
-            output_label.setStyleSheet("color: #666; font-size: 9pt; font-weight: bold;")
-            details_layout.addWidget(output_label)
-            
-            output_text = QTextEdit()
-            content = tool_response.get('content', '')
-            try:
-                # 尝试格式化 JSON
-                content_dict = json.loads(content) if isinstance(content, str) else content
-                formatted_content = json.dumps(content_dict, indent=2, ensure_ascii=False)
-                output_text.setPlainText(formatted_content)
-            except:
-                output_text.setPlainText(str(content))
-            
-            output_text.setReadOnly(True)
-            output_text.setMaximumHeight(150)
-            output_text.setStyleSheet("""
-                QTextEdit {
-                    background-color: #FAFAFA;
-                    border: 1px solid #E0E0E0;
-                    border-radius: 4px;
-                    padding: 5px;
-                    font-size: 8pt;
-                    font-family: Consolas, monospace;
-                }
-            """)
-            details_layout.addWidget(output_text)
-        
-        details_widget.setVisible(False)
-        container_layout.addWidget(details_widget)
-        
-        # 连接折叠/展开事件
-        def toggle_details(checked):
-            details_widget.setVisible(checked)
-            # 更新箭头方向
-            if checked:
-                toggle_button.setText(f"  ▾  {tool_name}")
-            else:
-                toggle_button.setText(f"  ▸  {tool_name}")
-        
-        toggle_button.toggled.connect(toggle_details)
-        
-        return container
-    
-    def on_scroll(self, value):
-        """滚动事件处理"""
-        # 当滚动到底部时加载更多
-        scrollbar = self.scroll_area.verticalScrollBar()
-        if value >= scrollbar.maximum() - 10 and not self.loading:
-            if self.displayed_count < len(self.all_records):
-                self.load_more_records()
-    
+            self.status_label.setText(f"已加载全部 {total} 条记录")
+
+    def resizeEvent(self, event):
+        """宽度变化后行高需要重新计算"""
+        super().resizeEvent(event)
+        self.delegate.clear_cache()
+
     def showEvent(self, event):
         """窗口显示时重新加载历史"""
         super().showEvent(event)
         self.reload_history()
-    
+
     def reload_history(self):
         """重新加载历史记录"""
-        # 清空现有内容
-        while self.content_layout.count():
-            item = self.content_layout.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
-        
-        # 重置状态
-        self.all_records = []
-        self.displayed_count = 0
-        self.loading = False
-        
-        # 重新加载
         self.load_initial_records()
@@ -1,6 +1,6 @@
 from PyQt5.QtWidgets import QWidget
 from PyQt5.QtCore import Qt, QPoint, QSize
-from PyQt5.QtGui import QPainter, QColor, QFont, QFontMetrics
+from PyQt5.QtGui import QPainter, QColor, QFont, QFontMetrics, QStaticText, QTransform, QPixmap, QPixmapCache
 from config import BubbleConfig
 
 class MessageBubble(QWidget):
@@ -16,107 +16,134 @@ class MessageBubble(QWidget):
         self.max_width = BubbleConfig.MAX_WIDTH  # 最大宽度
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
         self.setAttribute(Qt.WA_TranslucentBackground)
+        self._font_metrics = QFontMetrics(self.font)
+        self._advances = {}  # 字符宽度缓存
+        self._reset_layout()
         self._calculate_size()
         
-    def _wrap_text(self, text, max_width):
-        """改进的文本换行算法，支持中英文混合和长单词"""
-        font_metrics = QFontMetrics(self.font)
-        lines = []
-        current_line = ""
-        
-        # 按字符处理，更适合中英文混合文本
-        for char in text:
-            test_line = current_line + char
-            test_width = font_metrics.horizontalAdvance(test_line)
-            
+    def _reset_layout(self):
+        """清空已排版的内容"""
+        self._laid_out = ""  # 已经排版过的文本
+        self._lines = []  # 已完成换行的行
+        self._static_lines = []  # 与_lines一一对应的QStaticText缓存，绘制时按需创建
+        self._current_line = ""  # 还未结束的最后一行
+        self._current_width = 0
+        self._current_static = None  # (文本, QStaticText)
+        self._max_line_width = 0
+
+    def _advance(self, char):
+        """单个字符的宽度（带缓存）"""
+        advance = self._advances.get(char)
+        if advance is None:
+            advance = self._font_metrics.horizontalAdvance(char)
+            self._advances[char] = advance
+        return advance
+
+    def _finish_line(self, line, width):
+        self._lines.append(line)
+        self._max_line_width = max(self._max_line_width, width)
+
+    def _layout_tail(self, tail):
+        """
+        只对新追加的文本排版，已完成的行保持不变
+        按字符换行，支持中英文混合和长单词，行宽由字符宽度累加得到
+        """
+        max_width = self.max_width - 2 * self.padding
+        for char in tail:
             # 如果当前字符是换行符，直接换行
             if char == '\n':
-                lines.append(current_line)
-                current_line = ""
+                self._finish_line(self._current_line, self._current_width)
+                self._current_line = ""
+                self._current_width = 0
+                continue
+
+            advance = self._advance(char)
+            if self._current_width + advance <= max_width:
+                self._current_line += char
+                self._current_width += advance
                 continue
-                
-            # 检查添加字符后是否超出宽度
-            if test_width <= max_width:
-                current_line = test_line
+
+            # 超出宽度时换行
+            if self._current_line:
+                self._finish_line(self._current_line, self._current_width)
+            if advance > max_width:
+                # 单个字符就超过宽度，强制单独成行
+                self._finish_line(char, advance)
+                self._current_line = ""
+                self._current_width = 0
             else:
-                # 超出宽度时换行
-                if current_line:  # 当前行有内容
-                    lines.append(current_line)
-                
-                # 处理长字符或长单词（如果单个字符就超过宽度，强制显示）
-                if font_metrics.horizontalAdvance(char) > max_width:
-                    # 单个字符就超过宽度，特殊处理
-                    lines.append(char)
-                    current_line = ""
-                else:
-                    current_line = char
-        
-        # 添加最后一行
-        if current_line:
-            lines.append(current_line)
-        
-        return lines
-    
+                self._current_line = char
+                self._current_width = advance
+
     def _calculate_size(self):
-        """根据文本内容计算窗口大小"""
+        """根据已排版的行计算窗口大小"""
         if not self.text:
             self.resize(self.min_width, 50)
             return
-            
-        # 使用字体度量计算文本尺寸
-        font_metrics = QFontMetrics(self.font)
-        
-        # 计算可用文本宽度（减去两倍内边距）
-        available_width = self.max_width - 2 * self.padding
-        
-        # 使用改进的换行算法
-        wrapped_lines = self._wrap_text(self.text, available_width)
-        
-        # 计算最大行宽度
-        max_line_width = 0
-        for line in wrapped_lines:
-            line_width = font_metrics.horizontalAdvance(line)
-            max_line_width = max(max_line_width, line_width)
-        
+
+        line_count = len(self._lines) + (1 if self._current_line else 0)
+        max_line_width = max(self._max_line_width, self._current_width)
+
         # 计算文本总高度
-        text_height = len(wrapped_lines) * font_metrics.height()
-        
+        text_height = line_count * self._font_metrics.height()
+
         # 计算气泡宽度（文本最大宽度 + 两倍内边距，但不超过最大宽度）
         bubble_width = min(max_line_width + 2 * self.padding, self.max_width)
         bubble_width = max(bubble_width, self.min_width)  # 确保不小于最小宽度
-        
+
         # 计算总高度（文本高度 + 两倍内边距 + 箭头高度）
         bubble_height = text_height + 2 * self.padding + self.arrow_height
-        
+
         self.resize(bubble_width, bubble_height)
-    
+
     def set_text(self, text):
-        """设置文本并重新计算大小"""
+        """设置文本并重新计算大小，流式追加时只排版新增的部分"""
+        if not text.startswith(self._laid_out):
+            self._reset_layout()
+        self._layout_tail(text[len(self._laid_out):])
+        self._laid_out = text
         self.text = text
         self._calculate_size()
         self.update()
-    
+
+    def _static_text(self, line):
+        static = QStaticText(line)
+        static.setTextFormat(Qt.PlainText)
+        static.setPerformanceHint(QStaticText.AggressiveCaching)
+        static.prepare(QTransform(), self.font)
+        return static
+
     def get_current_text(self):
         """获取当前显示的文本"""
         return self.text
         
-    def paintEvent(self, event):
-        """绘制气泡样式"""
-        painter = QPainter(self)
+    def _chrome_pixmap(self, width, height):
+        """
+        获取气泡背景、边框和箭头的预渲染图像
+
+        按尺寸、设备像素比和配色缓存在QPixmapCache中，流式输出时的重绘只需要绘制文字
+        """
+        ratio = self.devicePixelRatioF()
+        key = (f"message_bubble_chrome:{width}x{height}@{ratio}:{self.arrow_height}:"
+               f"{BubbleConfig.BACKGROUND_COLOR}:{BubbleConfig.BORDER_COLOR}")
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None and not pixmap.isNull():
+            return pixmap
+
+        pixmap = QPixmap(int(width * ratio), int(height * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+
+        painter = QPainter(pixmap)
         painter.setRenderHint(QPainter.Antialiasing)
-        
-        width = self.width()
-        height = self.height()
         bubble_height = height - self.arrow_height
-        
+
         # 绘制气泡背景
         painter.setBrush(QColor(*BubbleConfig.BACKGROUND_COLOR))
         painter.setPen(QColor(*BubbleConfig.BORDER_COLOR))
         painter.drawRoundedRect(0, 0, width, bubble_height, 10, 10)
-        
+
         # 绘制指向箭头
-        painter.setBrush(QColor(*BubbleConfig.BACKGROUND_COLOR))
-        painter.setPen(QColor(*BubbleConfig.BORDER_COLOR))
         arrow_center = width // 2
         arrow_points = [
             QPoint(arrow_center - 8, bubble_height),
@@ -124,26 +151,37 @@ class MessageBubble(QWidget):
             QPoint(arrow_center, height)
         ]
         painter.drawPolygon(arrow_points)
-        
+        painter.end()
+
+        QPixmapCache.insert(key, pixmap)
+        return pixmap
+
+    def paintEvent(self, event):
+        """绘制气泡样式"""
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        # 背景、边框和箭头使用缓存的预渲染图像
+        painter.drawPixmap(0, 0, self._chrome_pixmap(self.width(), self.height()))
+
         # 绘制文字
         painter.setPen(QColor(*BubbleConfig.TEXT_COLOR))
         painter.setFont(self.font)
         
-        # 使用改进的换行算法
-        available_width = width - 2 * self.padding
-        wrapped_lines = self._wrap_text(self.text, available_width)
-        
-        font_metrics = QFontMetrics(self.font)
-        line_height = font_metrics.height()
-        y_offset = self.padding + font_metrics.ascent()  # 从顶部内边距开始，加上字体的上升部分
-        
-        for line in wrapped_lines:
-            # 修改：从左到右绘制文本，不再居中
-            x_offset = self.padding  # 使用固定的左边距
-            
-            painter.drawText(x_offset, y_offset, line)
+        # 复用已排版的行，已完成的行缓存为QStaticText
+        while len(self._static_lines) < len(self._lines):
+            self._static_lines.append(self._static_text(self._lines[len(self._static_lines)]))
+        line_height = self._font_metrics.height()
+        y_offset = self.padding
+        for static in self._static_lines:
+            painter.drawStaticText(self.padding, y_offset, static)
             y_offset += line_height
-        
+
+        if self._current_line:
+            if self._current_static is None or self._current_static[0] != self._current_line:
+                self._current_static = (self._current_line, self._static_text(self._current_line))
+            painter.drawStaticText(self.padding, y_offset, self._current_static[1])
+
     def update_position(self):
         """更新位置（跟随宠物）"""
         if self.parent_pet and self.isVisible():
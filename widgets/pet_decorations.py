@@ -4,13 +4,65 @@
 """
 import math
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtCore import Qt, QTimer, QLineF, QPointF
-from PyQt5.QtGui import QPainter, QColor, QPen
+from PyQt5.QtCore import Qt, QTimer, QLineF, QPointF, QRectF
+from PyQt5.QtGui import QPainter, QColor, QPen, QPixmap
 from config import PetDecorationConfig
+from .animation_clock import get_animation_clock
+
+
+def _render_spinner_frame(painter, size, angle):
+    """在painter上绘制指定角度的一帧加载圈"""
+    center = QPointF(size / 2, size / 2)
+    radius = size / 2 * 0.7
+    
+    # 绘制多个小点组成的圈
+    for i in range(PetDecorationConfig.LOADING_SPINNER_DOTS):
+        angle_rad = math.radians(angle + i * (360 / PetDecorationConfig.LOADING_SPINNER_DOTS))
+        alpha = 255 * (i / PetDecorationConfig.LOADING_SPINNER_DOTS)
+        
+        color = QColor(*PetDecorationConfig.LOADING_SPINNER_COLOR, int(alpha))
+        pen = QPen(color)
+        pen.setWidth(PetDecorationConfig.LOADING_SPINNER_LINE_WIDTH)
+        painter.setPen(pen)
+        
+        start_point = QPointF(
+            center.x() + (radius - 4) * math.cos(angle_rad),
+            center.y() + (radius - 4) * math.sin(angle_rad)
+        )
+        end_point = QPointF(
+            center.x() + radius * math.cos(angle_rad),
+            center.y() + radius * math.sin(angle_rad)
+        )
+        
+        painter.drawLine(QLineF(start_point, end_point))
+
+
+# 加载圈精灵图缓存：(尺寸, 设备像素比) -> 横向排列所有帧的QPixmap
+_spinner_atlases = {}
+
+def get_spinner_atlas(size, ratio):
+    """获取加载圈精灵图，所有旋转角度的帧只渲染一次"""
+    key = (size, ratio)
+    atlas = _spinner_atlases.get(key)
+    if atlas is None:
+        frames = LoadingSpinner.frame_count()
+        atlas = QPixmap(int(size * ratio) * frames, int(size * ratio))
+        atlas.setDevicePixelRatio(ratio)
+        atlas.fill(Qt.transparent)
+        painter = QPainter(atlas)
+        painter.setRenderHint(QPainter.Antialiasing)
+        for frame in range(frames):
+            painter.save()
+            painter.translate(frame * size, 0)
+            _render_spinner_frame(painter, size, frame * PetDecorationConfig.LOADING_SPINNER_ROTATION_STEP)
+            painter.restore()
+        painter.end()
+        _spinner_atlases[key] = atlas
+    return atlas
 
 
 class LoadingSpinner(QWidget):
-    """小型加载圈组件，显示在宠物头上"""
+    """小型加载圈组件，显示在宠物头上，帧来自预渲染的精灵图，由共享动画时钟驱动"""
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setFixedSize(PetDecorationConfig.LOADING_SPINNER_SIZE, 
@@ -18,53 +70,39 @@ class LoadingSpinner(QWidget):
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
         self.setAttribute(Qt.WA_TranslucentBackground)
         
-        self.angle = 0
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_animation)
+        self.frame = 0
+        
+    @staticmethod
+    def frame_count():
+        """一圈的帧数"""
+        return max(1, 360 // PetDecorationConfig.LOADING_SPINNER_ROTATION_STEP)
         
     def start_animation(self):
         """开始动画"""
-        self.timer.start(PetDecorationConfig.LOADING_SPINNER_ANIMATION_SPEED)
+        get_animation_clock().subscribe(self.update_animation, self)
         self.show()
         
     def stop_animation(self):
         """停止动画"""
-        self.timer.stop()
+        get_animation_clock().unsubscribe(self.update_animation)
         self.hide()
         
-    def update_animation(self):
-        """更新动画"""
-        self.angle = (self.angle + PetDecorationConfig.LOADING_SPINNER_ROTATION_STEP) % 360
-        self.update()
+    def update_animation(self, elapsed_ms):
+        """按时钟时间计算当前帧，帧变化时才重绘"""
+        frame = (elapsed_ms // PetDecorationConfig.LOADING_SPINNER_ANIMATION_SPEED) % self.frame_count()
+        if frame != self.frame:
+            self.frame = frame
+            self.update()
         
     def paintEvent(self, event):
-        """绘制加载圈"""
+        """从精灵图中绘制当前帧"""
+        size = PetDecorationConfig.LOADING_SPINNER_SIZE
+        atlas = get_spinner_atlas(size, self.devicePixelRatioF())
+        # 源矩形使用精灵图的物理像素坐标
+        frame_size = size * atlas.devicePixelRatio()
         painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
-        
-        center = QPointF(self.width() / 2, self.height() / 2)
-        radius = min(self.width(), self.height()) / 2 * 0.7
-        
-        # 绘制多个小点组成的圈
-        for i in range(PetDecorationConfig.LOADING_SPINNER_DOTS):
-            angle_rad = math.radians(self.angle + i * (360 / PetDecorationConfig.LOADING_SPINNER_DOTS))
-            alpha = 255 * (i / PetDecorationConfig.LOADING_SPINNER_DOTS)
-            
-            color = QColor(*PetDecorationConfig.LOADING_SPINNER_COLOR, int(alpha))
-            pen = QPen(color)
-            pen.setWidth(PetDecorationConfig.LOADING_SPINNER_LINE_WIDTH)
-            painter.setPen(pen)
-            
-            start_point = QPointF(
-                center.x() + (radius - 4) * math.cos(angle_rad),
-                center.y() + (radius - 4) * math.sin(angle_rad)
-            )
-            end_point = QPointF(
-                center.x() + radius * math.cos(angle_rad),
-                center.y() + radius * math.sin(angle_rad)
-            )
-            
-            painter.drawLine(QLineF(start_point, end_point))
+        painter.drawPixmap(QRectF(0, 0, size, size), atlas,
+                           QRectF(self.frame * frame_size, 0, frame_size, frame_size))
 
 
 class PetDecorationManager:
@@ -123,6 +161,19 @@ class PetDecorationManager:
             
             self.loading_spinner.move(spinner_x, spinner_y)
             
+    def pause(self):
+        """宠物隐藏时暂停共享动画时钟并隐藏加载圈"""
+        get_animation_clock().pause()
+        if self.loading_spinner:
+            self.loading_spinner.hide()
+            
+    def resume(self):
+        """宠物重新显示时恢复共享动画时钟和加载圈"""
+        get_animation_clock().resume()
+        if self.loading_spinner:
+            self._calculate_and_set_spinner_position()
+            self.loading_spinner.show()
+            
     def cleanup(self):
         """清理所有装饰"""
         self.stop_thinking_timer()
\ No newline at end of file
@@ -5,25 +5,38 @@
 import random
 from PyQt5.QtCore import QThread, pyqtSignal
 from config import SystemConfig
+from services.cancellation import CancellationToken, CancelledError
+from services.chat_events import TextDelta
 
 
 class AIResponseThread(QThread):
     """AI响应处理线程"""
-    response_chunk = pyqtSignal(str)
-    finished = pyqtSignal()
+    chat_event = pyqtSignal(object)  # services.chat_events中的事件
+    response_finished = pyqtSignal()  # 正常回复完成（不覆盖QThread.finished，后者在线程退出时总会发出）
     
-    def __init__(self, chat_service, message):
+    def __init__(self, chat_service, message, retrieval_query=None):
         super().__init__()
         self.chat_service = chat_service
         self.message = message
+        self.retrieval_query = retrieval_query
+        self.cancel_token = CancellationToken()
+        
+    def cancel(self):
+        """取消本轮对话：关闭流式连接、结束正在运行的工具，不再发出任何内容"""
+        self.cancel_token.cancel()
         
     def run(self):
         try:
-            for chunk in self.chat_service.process_message_stream(self.message):
-                self.response_chunk.emit(chunk)
-            self.finished.emit()
+            for event in self.chat_service.process_message_stream(self.message, self.cancel_token,
+                                                                  self.retrieval_query):
+                # 取消后生成器会自行收尾，这里只是不再把内容发给界面
+                if not self.cancel_token.cancelled:
+                    self.chat_event.emit(event)
+            if not self.cancel_token.cancelled:
+                self.response_finished.emit()
         except Exception as e:
-            self.response_chunk.emit('\n' + random.choice(SystemConfig.BACKUP_RESPONSES))
+            if not self.cancel_token.cancelled:
+                self.chat_event.emit(TextDelta('\n' + random.choice(SystemConfig.BACKUP_RESPONSES)))
             print(f"AI回复处理错误: {e}")
 
 
@@ -31,17 +44,27 @@ class VisionProcessThread(QThread):
     """VLM图片描述处理线程"""
     vision_completed = pyqtSignal(str, str)  # 发射(final_message, original_message)
     vision_failed = pyqtSignal(str, str)     # 发射(error_message, original_message)
+    vision_progress = pyqtSignal(str)        # 发射到目前为止的部分描述
     
     def __init__(self, vision_service, pixmap, message):
         super().__init__()
         self.vision_service = vision_service
-        self.pixmap = pixmap
+        # QPixmap只能在UI线程中使用，构造时（UI线程）转换为QImage交给工作线程预处理
+        self.image = pixmap.toImage()
+        self.cache_key = pixmap.cacheKey()
         self.message = message
+        self.cancel_token = CancellationToken()
+        
+    def cancel(self):
+        """取消图片描述：关闭流式连接，不再发出任何信号"""
+        self.cancel_token.cancel()
         
     def run(self):
         try:
             # 使用VLM描述图片
-            image_description = self.vision_service.describe_image(self.pixmap, self.message)
+            image_description = self.vision_service.describe_image(self.image, self.message, self.cache_key,
+                                                                   on_progress=self.vision_progress.emit,
+                                                                   cancel_token=self.cancel_token)
             
             # 构建最终消息格式
             if self.message.strip():
@@ -51,6 +74,8 @@ class VisionProcessThread(QThread):
             
             self.vision_completed.emit(final_message, self.message)
             
+        except CancelledError:
+            print("VLM图片描述已取消")
         except Exception as e:
             print(f"VLM线程处理失败: {e}")
             import traceback